@@ -0,0 +1,388 @@
+# encoding: utf-8
+"""
+cache.py
+"""
+
+__author__ = "Neil Massey"
+__date__ = "19 Oct 2026"
+__copyright__ = "Copyright 2026 United Kingdom Research and Innovation"
+__license__ = "BSD - see LICENSE file in top-level package directory"
+__contact__ = "neil.massey@stfc.ac.uk"
+
+import json
+import os
+import os.path
+import sqlite3
+import time
+import zlib
+from hashlib import sha256
+from typing import Optional, Iterable
+
+import nlds_admin.common.config as CFG
+import nlds_admin.rabbit.message_keys as MSG
+import nlds_admin.rabbit.routing_keys as RK
+from nlds_admin.common.deserialize import deserialize
+
+# Config file section for the cache.  All of the options are optional, e.g.:
+# "cache": {
+#     "directory": "~/.cache/nlds-admin",
+#     "max_size": 268435456,
+#     "ttl": {"list": 300, "find": 300, "stat": 30, "label": 3600,
+#             "fingerprint": 604800, "listing": 900}
+# }
+CACHE_CONFIG_SECTION = "cache"
+CACHE_CONFIG_DIRECTORY = "directory"
+CACHE_CONFIG_MAX_SIZE = "max_size"
+CACHE_CONFIG_TTL = "ttl"
+CACHE_FILE = "cache.sqlite"
+DEFAULT_CONFIG = {
+    CACHE_CONFIG_DIRECTORY: "~/.cache/nlds-admin",
+    CACHE_CONFIG_MAX_SIZE: 256 * 1024 * 1024,  # bytes
+    CACHE_CONFIG_TTL: {
+        RK.LIST: 300,  # seconds
+        RK.FIND: 300,
+        RK.STAT: 30,
+        MSG.LABEL: 3600,
+        "fingerprint": 7 * 24 * 3600,
+        "listing": 900,
+    },
+}
+
+# the kinds of id that a cached response can be tagged with, so that it can be
+# invalidated when a command changes the holding or transaction
+TAG_HOLDING_ID = "holding_id"
+TAG_TRANSACT_ID = "transaction_id"
+TAG_ID = "id"
+
+
+def open_cache_db(
+    config: Optional[dict] = None, check_same_thread: bool = True
+) -> sqlite3.Connection:
+    """Open (and create if necessary) the SQLite database that holds the local caches.
+    The database is in the cache directory from the config.  If check_same_thread is
+    False then the connection can be used from other threads, but the caller must
+    serialize its use."""
+    cache_config = get_cache_config(config)
+    cache_dir = os.path.expanduser(cache_config[CACHE_CONFIG_DIRECTORY])
+    os.makedirs(cache_dir, exist_ok=True)
+    db = sqlite3.connect(
+        os.path.join(cache_dir, CACHE_FILE),
+        timeout=30,
+        check_same_thread=check_same_thread,
+    )
+    db.execute("PRAGMA journal_mode=WAL")
+    return db
+
+
+def get_cache_config(config: Optional[dict] = None) -> dict:
+    """Merge the cache section of the config file into the default cache config."""
+    if config is None:
+        config = CFG.load_config()
+    cache_config = dict(DEFAULT_CONFIG)
+    if CACHE_CONFIG_SECTION in config:
+        user_config = config[CACHE_CONFIG_SECTION]
+        cache_config = cache_config | user_config
+        cache_config[CACHE_CONFIG_TTL] = DEFAULT_CONFIG[CACHE_CONFIG_TTL] | (
+            user_config.get(CACHE_CONFIG_TTL, {})
+        )
+    return cache_config
+
+
+class ResponseCache:
+    """On-disk cache of the responses to the list, find and stat queries.
+
+    Responses are keyed by the command and the normalized DETAILS and META of the
+    request message, and expire after a per-command time to live.  The cache is
+    bounded in size, with the least recently used responses evicted first.  Each
+    response is tagged with the holding ids, transaction ids and (transaction record)
+    ids that it contains, so that it can be invalidated when a command changes one of
+    those holdings or transactions.
+
+    If refresh is True then cached responses are not used, but the new responses are
+    still stored in the cache."""
+
+    def __init__(self, config: Optional[dict] = None, refresh: bool = False):
+        self.cache_config = get_cache_config(config)
+        self.refresh = refresh
+        self.db = open_cache_db(config)
+        self.db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                command TEXT,
+                created REAL,
+                accessed REAL,
+                size INTEGER,
+                body BLOB
+            );
+            CREATE TABLE IF NOT EXISTS response_tags (
+                key TEXT,
+                kind TEXT,
+                value TEXT
+            );
+            CREATE INDEX IF NOT EXISTS response_tags_value
+                ON response_tags (kind, value);
+            CREATE INDEX IF NOT EXISTS response_tags_key ON response_tags (key);
+            """
+        )
+
+    @staticmethod
+    def key(command: str, msg_dict: dict, variant: str = "") -> str:
+        """Create the key for a request from the command and the normalized DETAILS
+        and META of the request message.  This must be called before the message is
+        published, as publishing adds a timestamp to the message.  variant
+        distinguishes requests that are post-processed differently, e.g. stat
+        without the holding labels."""
+        request = {
+            "command": command,
+            "variant": variant,
+            MSG.DETAILS: msg_dict.get(MSG.DETAILS, {}),
+            MSG.META: msg_dict.get(MSG.META, {}),
+        }
+        request_json = json.dumps(request, sort_keys=True, default=str)
+        return sha256(request_json.encode()).hexdigest()
+
+    def get(self, key: str, command: str) -> Optional[dict]:
+        """Return the (deserialized) cached response for the key, or None if there is
+        no response, it has expired, or the cache is being refreshed."""
+        if self.refresh:
+            return None
+        row = self.db.execute(
+            "SELECT created, body FROM responses WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        created, body = row
+        now = time.time()
+        if now - created > self.cache_config[CACHE_CONFIG_TTL].get(command, 0):
+            self._delete([key])
+            return None
+        with self.db:
+            self.db.execute(
+                "UPDATE responses SET accessed = ? WHERE key = ?", (now, key)
+            )
+        return deserialize(zlib.decompress(body))
+
+    def put(self, key: str, command: str, body: bytes, response: dict) -> None:
+        """Store the raw response body in the cache, tagged with the ids in the
+        (deserialized) response.  Failed responses are not stored."""
+        details = response.get(MSG.DETAILS, {})
+        if details.get("failure"):
+            return
+        compressed = zlib.compress(body, level=1)
+        now = time.time()
+        tags = set(_response_tags(response))
+        with self.db:
+            self._delete([key], commit=False)
+            self.db.execute(
+                "INSERT INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                (key, command, now, now, len(compressed), compressed),
+            )
+            self.db.executemany(
+                "INSERT INTO response_tags VALUES (?, ?, ?)",
+                [(key, kind, str(value)) for kind, value in tags],
+            )
+        self._evict()
+
+    def invalidate(
+        self,
+        holding_ids: Iterable = (),
+        transaction_ids: Iterable = (),
+        ids: Iterable = (),
+    ) -> None:
+        """Remove the cached responses that contain any of the holding ids,
+        transaction ids or (transaction record) ids.  If none are given then the whole
+        cache is cleared, as the change cannot be narrowed down."""
+        tags = (
+            [(TAG_HOLDING_ID, str(h)) for h in holding_ids if h is not None]
+            + [(TAG_TRANSACT_ID, str(t)) for t in transaction_ids if t is not None]
+            + [(TAG_ID, str(i)) for i in ids if i is not None]
+        )
+        if len(tags) == 0:
+            with self.db:
+                self.db.execute("DELETE FROM responses")
+                self.db.execute("DELETE FROM response_tags")
+            return
+        keys = set()
+        for kind, value in tags:
+            rows = self.db.execute(
+                "SELECT key FROM response_tags WHERE kind = ? AND value = ?",
+                (kind, value),
+            )
+            keys.update(r[0] for r in rows)
+        self._delete(keys)
+
+    def _delete(self, keys: Iterable[str], commit: bool = True) -> None:
+        rows = [(k,) for k in keys]
+        self.db.executemany("DELETE FROM responses WHERE key = ?", rows)
+        self.db.executemany("DELETE FROM response_tags WHERE key = ?", rows)
+        if commit:
+            self.db.commit()
+
+    def _evict(self) -> None:
+        """Remove expired responses, then the least recently used responses until the
+        cache is under its maximum size."""
+        now = time.time()
+        ttl = self.cache_config[CACHE_CONFIG_TTL]
+        max_ttl = max(ttl[command] for command in (RK.LIST, RK.FIND, RK.STAT))
+        expired = self.db.execute(
+            "SELECT key FROM responses WHERE created < ?", (now - max_ttl,)
+        )
+        self._delete([r[0] for r in expired])
+
+        max_size = self.cache_config[CACHE_CONFIG_MAX_SIZE]
+        (total,) = self.db.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM responses"
+        ).fetchone()
+        if total <= max_size:
+            return
+        evict = []
+        for key, size in self.db.execute(
+            "SELECT key, size FROM responses ORDER BY accessed"
+        ).fetchall():
+            if total <= max_size:
+                break
+            evict.append(key)
+            total -= size
+        self._delete(evict)
+
+    def close(self) -> None:
+        self.db.close()
+
+
+class LabelCache:
+    """Cache of the holding labels for transaction ids, used to avoid asking the
+    catalog for the labels of the transactions returned by stat.  Labels are held in
+    memory for the life of the LabelCache, and in the cache database, where they
+    expire after the "label" time to live.  Transactions that have no label (yet) are
+    not cached, as the holding may not have been created yet.
+
+    If refresh is True then the labels in the database are not used, but the new
+    labels are still stored."""
+
+    def __init__(self, config: Optional[dict] = None, refresh: bool = False):
+        self.cache_config = get_cache_config(config)
+        self.refresh = refresh
+        self.labels = {}
+        self.db = open_cache_db(config)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS labels "
+            "(transaction_id TEXT PRIMARY KEY, label TEXT, created REAL)"
+        )
+
+    def get_labels(self, transaction_ids: Iterable[str]) -> dict[str, str]:
+        """Return the known labels for the transaction ids, as a dictionary of
+        transaction_id -> label.  Transaction ids without a known label are not in
+        the dictionary."""
+        labels = {t: self.labels[t] for t in transaction_ids if t in self.labels}
+        missing = [t for t in transaction_ids if t not in labels]
+        if self.refresh or len(missing) == 0:
+            return labels
+        oldest = time.time() - self.cache_config[CACHE_CONFIG_TTL][MSG.LABEL]
+        # query in batches to stay under SQLite's limit on the number of parameters
+        for i in range(0, len(missing), 500):
+            batch = missing[i : i + 500]
+            placeholders = ", ".join("?" * len(batch))
+            rows = self.db.execute(
+                f"SELECT transaction_id, label FROM labels WHERE created >= ? "
+                f"AND transaction_id IN ({placeholders})",
+                [oldest] + batch,
+            )
+            for t, label in rows:
+                labels[t] = label
+                self.labels[t] = label
+        return labels
+
+    def put_labels(self, labels: dict[str, str]) -> None:
+        """Store the labels, a dictionary of transaction_id -> label."""
+        self.labels.update(labels)
+        now = time.time()
+        with self.db:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO labels VALUES (?, ?, ?)",
+                [(t, label, now) for t, label in labels.items()],
+            )
+
+    def invalidate(self, transaction_ids: Iterable = ()) -> None:
+        """Remove the labels for the transaction ids, or all of the labels if no
+        transaction ids are given."""
+        transaction_ids = [t for t in transaction_ids if t is not None]
+        with self.db:
+            if len(transaction_ids) == 0:
+                self.labels.clear()
+                self.db.execute("DELETE FROM labels")
+            else:
+                for t in transaction_ids:
+                    self.labels.pop(t, None)
+                self.db.executemany(
+                    "DELETE FROM labels WHERE transaction_id = ?",
+                    [(t,) for t in transaction_ids],
+                )
+
+    def close(self) -> None:
+        self.db.close()
+
+
+def _response_tags(response: dict):
+    """Yield the (kind, value) tags for the holdings and transactions in the request
+    details and the response data of a list, find or stat response."""
+    details = response.get(MSG.DETAILS, {})
+    for kind in (TAG_HOLDING_ID, TAG_TRANSACT_ID, TAG_ID):
+        if details.get(kind) is not None:
+            yield kind, details[kind]
+    data = response.get(MSG.DATA, {})
+    # list returns a list of holdings, with a list of transaction ids
+    # find returns a dictionary of holdings, with a dictionary of transactions
+    holdings = data.get(MSG.HOLDINGS, [])
+    if isinstance(holdings, dict):
+        holdings = holdings.values()
+    for h in holdings:
+        if MSG.ID in h:
+            yield TAG_HOLDING_ID, h[MSG.ID]
+        if MSG.HOLDING_ID in h:
+            yield TAG_HOLDING_ID, h[MSG.HOLDING_ID]
+        for t in h.get(MSG.TRANSACTIONS, []):
+            yield TAG_TRANSACT_ID, t
+    # stat returns a list of transaction records
+    for tr in data.get(MSG.RECORD_LIST, []):
+        if MSG.ID in tr:
+            yield TAG_ID, tr[MSG.ID]
+        if MSG.TRANSACT_ID in tr:
+            yield TAG_TRANSACT_ID, tr[MSG.TRANSACT_ID]
+
+
+def response_transaction_ids(response: Optional[dict]) -> list[str]:
+    """Return the transaction ids of the transaction records in a response."""
+    if response is None:
+        return []
+    records = response.get(MSG.DATA, {}).get(MSG.RECORD_LIST, [])
+    return [r[MSG.TRANSACT_ID] for r in records if r.get(MSG.TRANSACT_ID)]
+
+
+def invalidate_cache(
+    config: Optional[dict] = None,
+    holding_id: Optional[int] = None,
+    transaction_id: Optional[str] = None,
+    id: Optional[int] = None,
+) -> None:
+    """Invalidate the cached responses after a command has changed a holding or
+    transaction.  If no holding_id, transaction_id or id is given then the whole cache
+    is cleared.  The list and find responses are tagged with the transaction_id, not
+    the id, so if only the id is given then the whole cache is cleared too."""
+    if holding_id is None and transaction_id is None:
+        id = None
+    cache = ResponseCache(config)
+    try:
+        cache.invalidate(
+            holding_ids=[holding_id], transaction_ids=[transaction_id], ids=[id]
+        )
+    finally:
+        cache.close()
+    # the labels only need invalidating if the whole cache is cleared, or the
+    # transaction is known
+    if transaction_id is not None or (holding_id is None and id is None):
+        label_cache = LabelCache(config)
+        try:
+            label_cache.invalidate(transaction_ids=[transaction_id])
+        finally:
+            label_cache.close()
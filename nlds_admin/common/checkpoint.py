@@ -0,0 +1,115 @@
+# encoding: utf-8
+"""
+checkpoint.py
+"""
+
+__author__ = "Neil Massey"
+__date__ = "19 Oct 2026"
+__copyright__ = "Copyright 2026 United Kingdom Research and Innovation"
+__license__ = "BSD - see LICENSE file in top-level package directory"
+__contact__ = "neil.massey@stfc.ac.uk"
+
+import json
+import os
+import os.path
+import time
+from typing import Optional
+
+from nlds_admin.common.cache import get_cache_config, CACHE_CONFIG_DIRECTORY
+
+# A checkpoint is a state file of newline delimited JSON, so that a long running
+# campaign (e.g. auditing every holding) can be stopped and resumed without redoing
+# the work that has finished.  The first line is the header, recording what the
+# campaign is, and each subsequent line is the result of one finished item:
+#   {"campaign": {...}, "created": <time>}
+#   {"key": <item key>, "finished": <time>, "result": {...}}
+# Results are appended and flushed to disk as each item finishes, so that at most
+# the line being written is lost if the process is killed.  An incomplete last line
+# is ignored when the checkpoint is loaded.
+
+
+def default_state_file(name: str) -> str:
+    """Return the path of the state file for a campaign called name, in the cache
+    directory from the config."""
+    cache_dir = os.path.expanduser(get_cache_config()[CACHE_CONFIG_DIRECTORY])
+    return os.path.join(cache_dir, f"{name}.ndjson")
+
+
+class Checkpoint:
+    """The state file of a resumable campaign, holding the results of the items that
+    have finished."""
+
+    def __init__(self, path: str, campaign: dict, restart: bool = False):
+        self.path = path
+        self.campaign = campaign
+        # item key -> result
+        self.finished = {}
+        if os.path.exists(path) and not restart:
+            self._load()
+        else:
+            self._create()
+        self.fh = open(path, "a")
+
+    def _create(self) -> None:
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        header = {"campaign": self.campaign, "created": time.time()}
+        # write the header to a temporary file and move it into place, so that a
+        # restart does not leave a state file without a header
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as fh:
+            fh.write(json.dumps(header) + "\n")
+        os.replace(tmp_path, self.path)
+
+    def _load(self) -> None:
+        with open(self.path) as fh:
+            lines = fh.readlines()
+        try:
+            header = json.loads(lines[0])
+        except (IndexError, json.JSONDecodeError):
+            raise RuntimeError(f"State file {self.path} has no valid header.")
+        if header.get("campaign") != self.campaign:
+            raise RuntimeError(
+                f"State file {self.path} is for a different campaign: "
+                f"{header.get('campaign')}.  Use a different state file, or restart "
+                "the campaign."
+            )
+        for line in lines[1:]:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                # the last line may be incomplete if the process was killed
+                continue
+            self.finished[entry["key"]] = entry["result"]
+        # truncate any incomplete last line, so that the next result starts on a
+        # new line
+        if len(lines) > 0 and not lines[-1].endswith("\n"):
+            with open(self.path, "w") as fh:
+                fh.writelines(lines[:-1])
+
+    def __contains__(self, key) -> bool:
+        return key in self.finished
+
+    def __len__(self) -> int:
+        return len(self.finished)
+
+    def get(self, key) -> Optional[dict]:
+        return self.finished.get(key)
+
+    def record(self, key, result: dict) -> None:
+        """Record that the item has finished, with its result."""
+        entry = {"key": key, "finished": time.time(), "result": result}
+        self.fh.write(json.dumps(entry) + "\n")
+        self.fh.flush()
+        os.fsync(self.fh.fileno())
+        self.finished[key] = result
+
+    def close(self) -> None:
+        self.fh.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,214 @@
+# encoding: utf-8
+"""
+compact_filelist.py
+"""
+
+__author__ = "Neil Massey"
+__date__ = "19 Oct 2026"
+__copyright__ = "Copyright 2026 United Kingdom Research and Innovation"
+__license__ = "BSD - see LICENSE file in top-level package directory"
+__contact__ = "neil.massey@stfc.ac.uk"
+
+import json
+from collections import Counter
+from typing import Optional
+
+# The compact filelist encoding replaces the list of {"file_details": {...}, ...}
+# entries in the DATA part of a message with a dictionary:
+# {
+#     "encoding": "front-coded-v1",
+#     "prefix": [0, 31, 29, ...],
+#     "suffix": ["/gws/nopw/j04/project/a.nc", "b.nc", "c/d.nc", ...],
+#     "defaults": {"size": 0, "holding_id": 14, ...},
+#     "overrides": {"size": [[0, 1024], [2, 2048]], ...},
+#     "templates": ["{}", ...],
+#     "template": [[5, 1], ...],
+#     "order": [2, 0, 1, ...],
+# }
+# The original_paths are sorted and front-coded: each path is stored as the length of
+# the prefix it shares with the previous path, and the remaining suffix.  "order" holds
+# the position of each sorted entry in the original filelist, so that the order of the
+# filelist is kept, and is empty if the filelist was already sorted.  The other
+# fields of the file_details are stored once, in "defaults", with only the entries that
+# differ from the default, in value or in type, stored in "overrides", as [index,
+# value] pairs.  Any other
+# keys in the entry (e.g. "storage_locations") are stored as JSON templates, with the
+# original_path replaced by a placeholder, so that near-identical entries are stored
+# once.  "template" holds the [index, template] pairs for entries that do not use the
+# first template.
+COMPACT_ENCODING = "front-coded-v1"
+ENCODING = "encoding"
+FILE_DETAILS = "file_details"
+ORIGINAL_PATH = "original_path"
+# placeholder for the original_path in the templates - this is the JSON escaped form
+# of a NUL character, which cannot occur in a path
+_PATH_PLACEHOLDER = "\\u0000p"
+
+# The default values of the file_details for a file, used when building filelists
+# for the messages that the admin tools send, and as the defaults for the compact
+# encoding
+DEFAULT_FILE_DETAILS = {
+    "original_path": None,
+    "path_type": 0,  # zero is FILE type
+    "link_path": None,
+    "size": 0,
+    "user": 0,
+    "group": 0,
+    "permissions": 0,
+    "mode": 0,
+    "access_time": 0.0,
+    "failure_reason": None,
+    "holding_id": 0,
+}
+
+
+def file_details(
+    original_path: str,
+    holding_id: int = 0,
+    failure_reason: Optional[str] = None,
+) -> dict:
+    """Build the file_details for a file, with the default values for all the fields
+    that the admin tools do not know."""
+    fd = dict(DEFAULT_FILE_DETAILS)
+    fd[ORIGINAL_PATH] = original_path
+    fd["holding_id"] = holding_id
+    fd["failure_reason"] = failure_reason
+    return fd
+
+
+def is_compact(filelist) -> bool:
+    """Determine whether a filelist is in the compact encoding."""
+    return isinstance(filelist, dict) and filelist.get(ENCODING) == COMPACT_ENCODING
+
+
+def _common_prefix_length(a: str, b: str) -> int:
+    n = min(len(a), len(b))
+    i = 0
+    while i < n and a[i] == b[i]:
+        i += 1
+    return i
+
+
+def encode_filelist(filelist: list[dict]) -> dict:
+    """Encode a filelist of {"file_details": {...}, ...} entries into the compact
+    encoding.  The entries are sorted by original_path, and their original order is
+    recorded so that decode_filelist returns them in it."""
+    order = sorted(
+        range(len(filelist)), key=lambda i: filelist[i][FILE_DETAILS][ORIGINAL_PATH]
+    )
+    entries = [filelist[i] for i in order]
+    if all(i == j for i, j in enumerate(order)):
+        order = []
+
+    # front-code the sorted paths
+    prefix = []
+    suffix = []
+    previous = ""
+    for e in entries:
+        path = e[FILE_DETAILS][ORIGINAL_PATH]
+        p = _common_prefix_length(previous, path)
+        prefix.append(p)
+        suffix.append(path[p:])
+        previous = path
+
+    # the default for each field is its most common value, compared by its JSON, so
+    # that unhashable values can be counted
+    counters = {}
+    for e in entries:
+        for k, v in e[FILE_DETAILS].items():
+            if k != ORIGINAL_PATH:
+                counters.setdefault(k, Counter())[json.dumps(v)] += 1
+    defaults = {k: json.loads(c.most_common(1)[0][0]) for k, c in counters.items()}
+    overrides = {}
+    for i, e in enumerate(entries):
+        for k, v in e[FILE_DETAILS].items():
+            # the type is compared too, as 0, 0.0 and False are equal
+            if k != ORIGINAL_PATH and (
+                v != defaults[k] or type(v) is not type(defaults[k])
+            ):
+                overrides.setdefault(k, []).append([i, v])
+        # fields missing from this entry are recorded so they are not defaulted
+        for k in defaults.keys() - e[FILE_DETAILS].keys():
+            overrides.setdefault("-missing", []).append([i, k])
+
+    # the rest of each entry is stored as a template with the path replaced
+    templates = []
+    template_index = {}
+    template = []
+    for i, e in enumerate(entries):
+        rest = {k: v for k, v in e.items() if k != FILE_DETAILS}
+        text = json.dumps(rest, sort_keys=True)
+        if _PATH_PLACEHOLDER in text:
+            raise ValueError("Filelist entry cannot be encoded in compact form.")
+        escaped_path = json.dumps(e[FILE_DETAILS][ORIGINAL_PATH])[1:-1]
+        if escaped_path:
+            text = text.replace(escaped_path, _PATH_PLACEHOLDER)
+        if text not in template_index:
+            template_index[text] = len(templates)
+            templates.append(text)
+        t = template_index[text]
+        if t != 0:
+            template.append([i, t])
+
+    return {
+        ENCODING: COMPACT_ENCODING,
+        "prefix": prefix,
+        "suffix": suffix,
+        "defaults": defaults,
+        "overrides": overrides,
+        "templates": templates,
+        "template": template,
+        "order": order,
+    }
+
+
+def decode_filelist(compact: dict) -> list[dict]:
+    """Decode a filelist in the compact encoding back into a list of
+    {"file_details": {...}, ...} entries, in the order of the original filelist."""
+    if not is_compact(compact):
+        raise RuntimeError(
+            f"Filelist is not in the compact encoding {COMPACT_ENCODING}."
+        )
+    defaults = compact["defaults"]
+    templates = compact["templates"]
+    template = [0] * len(compact["prefix"])
+    for i, t in compact["template"]:
+        template[i] = t
+
+    entries = []
+    previous = ""
+    for i, (p, s) in enumerate(zip(compact["prefix"], compact["suffix"])):
+        path = previous[:p] + s
+        previous = path
+        fd = {ORIGINAL_PATH: path}
+        fd.update(defaults)
+        text = templates[template[i]] if templates else "{}"
+        escaped_path = json.dumps(path)[1:-1]
+        entry = json.loads(text.replace(_PATH_PLACEHOLDER, escaped_path))
+        entry[FILE_DETAILS] = fd
+        entries.append(entry)
+
+    for k, values in compact["overrides"].items():
+        if k == "-missing":
+            for i, field in values:
+                del entries[i][FILE_DETAILS][field]
+        else:
+            for i, v in values:
+                entries[i][FILE_DETAILS][k] = v
+
+    # put the entries back in their original order
+    order = compact.get("order")
+    if order:
+        original = [None] * len(entries)
+        for entry, i in zip(entries, order):
+            original[i] = entry
+        entries = original
+    return entries
+
+
+def pack_filelist(filelist: list[dict], compact: bool = False):
+    """Return the filelist to put in the DATA part of a message, either as it is or in
+    the compact encoding."""
+    if compact:
+        return encode_filelist(filelist)
+    return filelist
@@ -1,18 +1,41 @@
 import nlds_admin.common.config as CFG
 import nlds_admin.rabbit.routing_keys as RK
 import minio
+import urllib3
+from typing import Optional
 
+# seconds to wait for a connection to, or a read from, the object store
+OBJECT_STORE_TIMEOUT = 300
 
-def connect_to_object_store(settings: str = CFG.CONFIG_FILE_LOCATION):
+
+def connect_to_object_store(
+    settings: str = CFG.CONFIG_FILE_LOCATION, pool_size: Optional[int] = None
+):
     # get the tenancy from the server config
     config = CFG.load_config(settings)
     access_key = config["cronjob_publisher"]["access_key"]
     secret_key = config["cronjob_publisher"]["secret_key"]
     tenancy = config["cronjob_publisher"]["tenancy"]
+    # the default connection pool keeps 10 connections, so a client that is shared by
+    # more threads than that is given a larger pool, otherwise the extra connections
+    # are opened and closed for every request
+    http_client = None
+    if pool_size is not None:
+        http_client = urllib3.PoolManager(
+            timeout=urllib3.Timeout(
+                connect=OBJECT_STORE_TIMEOUT, read=OBJECT_STORE_TIMEOUT
+            ),
+            maxsize=pool_size,
+            block=True,
+            retries=urllib3.Retry(
+                total=5, backoff_factor=0.2, status_forcelist=[500, 502, 503, 504]
+            ),
+        )
     client = minio.Minio(
         tenancy,
         access_key=access_key,
         secret_key=secret_key,
         secure=False,
+        http_client=http_client,
     )
     return client
@@ -1,32 +1,60 @@
+from typing import Any, Callable, Optional, Union
+
 from nlds_admin.rabbit import message_keys as MSG
+from nlds_admin.common.serialize import (
+    BINARY_CONTENT_ENCODING,
+    is_binary,
+    deserialize_binary,
+    decompress_data,
+    codec_from_flag,
+)
+from nlds_admin.common.compact_filelist import is_compact, decode_filelist
 import json
-import zlib
-import base64
 
 
-def deserialize(body: str) -> dict:
+def deserialize(
+    body: Union[str, bytes, bytearray],
+    content_encoding: Optional[str] = None,
+    object_pairs_hook: Optional[Callable[[list], Any]] = None,
+) -> dict:
     """Deserialize the message body by calling JSON loads and decompressing the
-    message if necessary."""
-    body_dict = json.loads(body)
+    message if necessary.  The body can be passed as the raw bytes returned from
+    RabbitMQ, so there is no need to decode it to a str first.
+    Both the JSON message format and the binary message format are accepted.  The
+    binary format is detected from the content_encoding, if given, or from the start
+    of the body.
+    A filelist in the compact encoding is expanded back into the list of files.
+    The object_pairs_hook is passed to json.loads, so that the objects in the DATA
+    part of the message can be processed as they are parsed."""
+    if content_encoding == BINARY_CONTENT_ENCODING or is_binary(body):
+        body_dict = deserialize_binary(body, object_pairs_hook)
+    else:
+        body_dict = json.loads(body, object_pairs_hook=object_pairs_hook)
+        _decompress(body_dict, object_pairs_hook)
+    # check whether the filelist is in the compact encoding
+    data = body_dict.get(MSG.DATA)
+    if isinstance(data, dict) and is_compact(data.get(MSG.FILELIST)):
+        data[MSG.FILELIST] = decode_filelist(data[MSG.FILELIST])
+    return body_dict
+
+
+def _decompress(
+    body_dict: dict, object_pairs_hook: Optional[Callable[[list], Any]] = None
+) -> None:
+    """Decompress the DATA section of a message in the JSON format, in place."""
     # check whether the DATA section is serialized
     if MSG.COMPRESS in body_dict[MSG.DETAILS] and body_dict[MSG.DETAILS][MSG.COMPRESS]:
-        # data is in a b64 encoded ascii string - need to convert to bytes (in
-        # ascii format before decompressing and loading into json
-        try:
-            byte_string = body_dict[MSG.DATA].encode("ascii")
-        except AttributeError:
+        # data is in a b64 encoded ascii string - b64decode accepts the str directly,
+        # so there is no need to encode it to bytes before decompressing
+        byte_string = body_dict[MSG.DATA]
+        if not isinstance(byte_string, str):
             raise RuntimeError(
                 "DATA part of message was not compressed, despite compressed flag being"
                 " set in message"
             )
-        else:
-            decompressed_string = zlib.decompress(base64.b64decode(byte_string))
-            body_dict[MSG.DATA] = json.loads(decompressed_string)
-            info = (
-                f"Decompressing message, compressed size {len(byte_string)}, "
-                f" actual size {len(decompressed_string)}"
-            )
+        # the compress flag is either True (zlib) or the name of the codec
+        codec = codec_from_flag(body_dict[MSG.DETAILS][MSG.COMPRESS])
+        body_dict[MSG.DATA] = decompress_data(byte_string, codec, object_pairs_hook)
         # specify that the message is now decompressed, in case it gets passed through
         # deserialize again
         body_dict[MSG.DETAILS][MSG.COMPRESS] = False
-    return body_dict
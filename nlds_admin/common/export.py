@@ -0,0 +1,299 @@
+# encoding: utf-8
+"""
+export.py
+"""
+
+__author__ = "Neil Massey"
+__date__ = "19 Oct 2026"
+__copyright__ = "Copyright 2026 United Kingdom Research and Innovation"
+__license__ = "BSD - see LICENSE file in top-level package directory"
+__contact__ = "neil.massey@stfc.ac.uk"
+
+import csv
+import json
+import sys
+from abc import ABC, abstractmethod
+from typing import Iterable, Iterator, Optional
+
+import numpy as np
+
+from nlds_admin.rabbit import message_keys as MSG
+from nlds_admin.common.file_table import FileTable
+
+# Export formats for find, list and stat.  Rows are written in batches of columns, so
+# that a whole response never has to be converted to rows at once.  parquet requires
+# the optional pyarrow package.
+NDJSON = "ndjson"
+CSV = "csv"
+PARQUET = "parquet"
+FORMATS = (NDJSON, CSV, PARQUET)
+DEFAULT_BATCH_ROWS = 65536
+
+# The fields of the rows for each command, as (name, type) pairs.  The types are used
+# for the parquet schema.
+FILE_FIELDS = (
+    ("path", "string"),
+    ("path_type", "int64"),
+    ("link_path", "string"),
+    ("size", "int64"),
+    ("user", "int64"),
+    ("group", "int64"),
+    ("permissions", "int64"),
+    ("holding_id", "int64"),
+    ("label", "string"),
+    ("transaction_id", "string"),
+    ("ingest_time", "string"),
+    ("storage_locations", "string"),
+    ("url", "string"),
+)
+HOLDING_FIELDS = (
+    ("holding_id", "int64"),
+    ("label", "string"),
+    ("user", "string"),
+    ("group", "string"),
+    ("ingest_time", "string"),
+    ("transactions", "string"),
+    ("tags", "string"),
+)
+SUB_RECORD_FIELDS = (
+    ("id", "int64"),
+    ("transaction_id", "string"),
+    ("user", "string"),
+    ("group", "string"),
+    ("api_action", "string"),
+    ("job_label", "string"),
+    ("label", "string"),
+    ("creation_time", "string"),
+    ("sub_id", "string"),
+    ("state", "string"),
+    ("last_updated", "string"),
+    ("failed_files", "int64"),
+)
+
+
+def _import_pyarrow():
+    """Import pyarrow, raising a RuntimeError if the optional package is not
+    installed."""
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise RuntimeError(
+            "Export format parquet requires an optional package that is not "
+            "installed.  Install it with: pip install nlds-admin[parquet]"
+        )
+    return pyarrow
+
+
+class ExportWriter(ABC):
+    """Write rows, in batches of columns, to a file in one of the export formats.
+    Use open_writer to create the writer for a format."""
+
+    def __init__(self, output: str, fields: tuple, batch_rows: int):
+        self.output = output
+        self.fields = fields
+        self.names = [name for name, _ in fields]
+        self.batch_rows = batch_rows
+        self.n_rows = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def write_rows(self, rows: Iterable[dict]) -> None:
+        """Write the rows, which are dictionaries keyed by the field names, in
+        batches of batch_rows."""
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= self.batch_rows:
+                self.write_columns({n: [r.get(n) for r in batch] for n in self.names})
+                batch = []
+        if len(batch) > 0:
+            self.write_columns({n: [r.get(n) for r in batch] for n in self.names})
+
+    @abstractmethod
+    def write_columns(self, columns: dict) -> None:
+        """Write a batch of rows, given as a dictionary of field name -> list or
+        numpy array of the values."""
+
+    def close(self) -> None:
+        pass
+
+    def _columns_to_lists(self, columns: dict) -> list[list]:
+        return [
+            (
+                columns[n].tolist()
+                if isinstance(columns[n], np.ndarray)
+                else list(columns[n])
+            )
+            for n in self.names
+        ]
+
+
+class _TextWriter(ExportWriter):
+    def __init__(self, output: str, fields: tuple, batch_rows: int):
+        super().__init__(output, fields, batch_rows)
+        if output == "-":
+            self.fh = sys.stdout
+        else:
+            self.fh = open(output, "w", newline="")
+
+    def close(self) -> None:
+        if self.fh is not sys.stdout:
+            self.fh.close()
+        else:
+            self.fh.flush()
+
+
+class NDJSONWriter(_TextWriter):
+    """Write one JSON object per line."""
+
+    def write_columns(self, columns: dict) -> None:
+        lists = self._columns_to_lists(columns)
+        for values in zip(*lists):
+            self.fh.write(json.dumps(dict(zip(self.names, values))) + "\n")
+            self.n_rows += 1
+
+
+class CSVWriter(_TextWriter):
+    """Write comma separated values, with a header row."""
+
+    def __init__(self, output: str, fields: tuple, batch_rows: int):
+        super().__init__(output, fields, batch_rows)
+        self.writer = csv.writer(self.fh)
+        self.writer.writerow(self.names)
+
+    def write_columns(self, columns: dict) -> None:
+        lists = self._columns_to_lists(columns)
+        rows = list(zip(*lists))
+        self.writer.writerows(rows)
+        self.n_rows += len(rows)
+
+
+class ParquetWriter(ExportWriter):
+    """Write a parquet file, with one row group per batch of columns."""
+
+    def __init__(self, output: str, fields: tuple, batch_rows: int):
+        super().__init__(output, fields, batch_rows)
+        if output == "-":
+            raise RuntimeError("Export format parquet requires an --output file.")
+        pa = _import_pyarrow()
+        types = {
+            "string": pa.string(),
+            "int64": pa.int64(),
+            "float64": pa.float64(),
+            "bool": pa.bool_(),
+        }
+        self.pa = pa
+        self.schema = pa.schema([(name, types[t]) for name, t in fields])
+        self.writer = pa.parquet.ParquetWriter(output, self.schema)
+
+    def write_columns(self, columns: dict) -> None:
+        arrays = []
+        for field in self.schema:
+            values = columns[field.name]
+            # numeric numpy columns are converted without going through python
+            # objects
+            if isinstance(values, np.ndarray) and values.dtype != object:
+                arrays.append(self.pa.array(values, type=field.type))
+            else:
+                arrays.append(self.pa.array(list(values), type=field.type))
+        batch = self.pa.RecordBatch.from_arrays(arrays, schema=self.schema)
+        self.writer.write_batch(batch)
+        self.n_rows += batch.num_rows
+
+    def close(self) -> None:
+        self.writer.close()
+
+
+def open_writer(
+    output_format: str,
+    output: str = "-",
+    fields: tuple = FILE_FIELDS,
+    batch_rows: int = DEFAULT_BATCH_ROWS,
+) -> ExportWriter:
+    """Create the writer for the export format, writing to the output file, or
+    stdout if output is "-"."""
+    match output_format:
+        case "ndjson":
+            return NDJSONWriter(output, fields, batch_rows)
+        case "csv":
+            return CSVWriter(output, fields, batch_rows)
+        case "parquet":
+            return ParquetWriter(output, fields, batch_rows)
+    raise RuntimeError(f"Unknown export format {output_format}, options: {FORMATS}")
+
+
+def file_columns(files: FileTable, index: Optional[np.ndarray] = None) -> dict:
+    """Convert the files in a FileTable (optionally only those at the indices in
+    index) into the columns of FILE_FIELDS.  The numeric columns are taken directly
+    from the table."""
+    if index is None:
+        index = np.arange(len(files))
+    transaction = files.transaction[index]
+    holding_index = np.array(
+        [t["holding"] for t in files.transactions], dtype=np.int64
+    )[transaction]
+    locations = ["+".join(c) for c in files.location_categories]
+    return {
+        "path": files.path[index],
+        "path_type": files.path_type[index].astype(np.int64),
+        "link_path": files.link_path[index],
+        "size": files.size[index],
+        "user": files.user[index].astype(np.int64),
+        "group": files.group[index].astype(np.int64),
+        "permissions": files.permissions[index].astype(np.int64),
+        "holding_id": np.array(
+            [files.holdings[h][MSG.HOLDING_ID] for h in holding_index], dtype=np.int64
+        ),
+        "label": [files.holdings[h][MSG.LABEL] for h in holding_index],
+        "transaction_id": [files.transactions[t][MSG.TRANSACT_ID] for t in transaction],
+        "ingest_time": [files.transactions[t]["ingest_time"] for t in transaction],
+        "storage_locations": [locations[c] for c in files.location[index]],
+        "url": files.url[index],
+    }
+
+
+def write_files(writer: ExportWriter, files: FileTable) -> None:
+    """Write the files in a FileTable, in batches of the writer's batch_rows."""
+    for start in range(0, len(files), writer.batch_rows):
+        index = np.arange(start, min(start + writer.batch_rows, len(files)))
+        writer.write_columns(file_columns(files, index))
+
+
+def holding_rows(holdings: list[dict]) -> Iterator[dict]:
+    """Yield the HOLDING_FIELDS row for each holding in a list_holdings response."""
+    for h in holdings:
+        yield {
+            "holding_id": h[MSG.ID],
+            "label": h[MSG.LABEL],
+            "user": h[MSG.USER],
+            "group": h[MSG.GROUP],
+            "ingest_time": h["date"],
+            "transactions": ";".join(h.get(MSG.TRANSACTIONS, [])),
+            "tags": json.dumps(h.get("tags", {})),
+        }
+
+
+def sub_record_rows(records: list[dict]) -> Iterator[dict]:
+    """Yield the SUB_RECORD_FIELDS row for each sub-record of each transaction
+    record in a get_request_status response."""
+    for tr in records:
+        for sr in tr[MSG.SUB_RECORD_LIST]:
+            yield {
+                "id": tr[MSG.ID],
+                "transaction_id": tr[MSG.TRANSACT_ID],
+                "user": tr[MSG.USER],
+                "group": tr[MSG.GROUP],
+                "api_action": tr[MSG.API_ACTION],
+                "job_label": tr.get(MSG.JOB_LABEL),
+                "label": tr.get(MSG.LABEL),
+                "creation_time": tr["creation_time"],
+                "sub_id": sr[MSG.SUB_ID],
+                "state": sr[MSG.STATE],
+                "last_updated": sr["last_updated"],
+                "failed_files": len(sr.get("failed_files", [])),
+            }
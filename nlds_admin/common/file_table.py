@@ -0,0 +1,339 @@
+# encoding: utf-8
+"""
+file_table.py
+"""
+
+__author__ = "Neil Massey"
+__date__ = "19 Oct 2026"
+__copyright__ = "Copyright 2026 United Kingdom Research and Innovation"
+__license__ = "BSD - see LICENSE file in top-level package directory"
+__contact__ = "neil.massey@stfc.ac.uk"
+
+import sys
+from array import array
+from typing import Iterator, Optional, Union
+
+import numpy as np
+
+from nlds_admin.rabbit import message_keys as MSG
+from nlds_admin.common.deserialize import deserialize
+
+OBJECT_STORAGE = "OBJECT_STORAGE"
+TAPE = "TAPE"
+
+
+class FileTable:
+    """Columnar representation of the files returned by find_files.
+
+    The find response is a nested dictionary of holdings -> transactions -> filelist,
+    with a dictionary for each file and a list of dictionaries for each file's storage
+    locations.  For holdings with millions of files this costs gigabytes of memory.
+    The FileTable instead holds one array per field, with one entry per file:
+
+        path            : object array of interned str, the original_path
+        path_type       : int8 array
+        link_path       : object array, None if the file is not a link
+        size            : int64 array
+        user, group     : uint32 arrays of the uid and gid
+        permissions     : uint32 array
+        transaction     : int32 codes into the transactions list
+        location        : int16 codes into the location_categories list, each
+                          category is a tuple of the storage_types of the file
+        empty_tape      : bool array, True if the file has an empty TAPE record
+        url             : object array of the OBJECT_STORAGE url, None if there is
+                          no OBJECT_STORAGE location
+
+    The holdings and transactions are held as lists of dictionaries:
+
+        holdings        : [{"holding_id", "label", "user", "group"}, ...]
+        transactions    : [{"transaction_id", "ingest_time", "holding"}, ...]
+
+    where "holding" is the index of the transaction's holding in the holdings list.
+
+    from_body builds the table from the body of the response as it is parsed, so the
+    per-file dictionaries are never all held at once.  from_response builds it from a
+    response that has already been deserialized, so the peak memory while building it
+    is that of the whole parsed response.
+    """
+
+    def __init__(self):
+        self.holdings = []
+        self.transactions = []
+        self.location_categories = []
+        self._location_index = {}
+        self.path = np.empty(0, dtype=object)
+        self.path_type = np.empty(0, dtype=np.int8)
+        self.link_path = np.empty(0, dtype=object)
+        self.size = np.empty(0, dtype=np.int64)
+        self.user = np.empty(0, dtype=np.uint32)
+        self.group = np.empty(0, dtype=np.uint32)
+        self.permissions = np.empty(0, dtype=np.uint32)
+        self.transaction = np.empty(0, dtype=np.int32)
+        self.location = np.empty(0, dtype=np.int16)
+        self.empty_tape = np.empty(0, dtype=bool)
+        self.url = np.empty(0, dtype=object)
+
+    def __len__(self) -> int:
+        return len(self.path)
+
+    @property
+    def n_holdings(self) -> int:
+        return len(self.holdings)
+
+    @classmethod
+    def from_response(cls, response: dict, consume: bool = True) -> "FileTable":
+        """Build a FileTable from a (deserialized) find_files response.  If consume is
+        True then each transaction's filelist is removed from the response once it has
+        been added to the table, so that the memory for the per-file dictionaries is
+        freed as the table is built.  This lowers the memory held after the table is
+        built, but not the peak, as the response has already been parsed in full.  Use
+        from_body if the body of the response is available."""
+        table = cls()
+        table.append_response(response, consume=consume)
+        return table
+
+    def _location_code(self, storage_types: tuple) -> int:
+        code = self._location_index.get(storage_types)
+        if code is None:
+            code = len(self.location_categories)
+            self.location_categories.append(storage_types)
+            self._location_index[storage_types] = code
+        return code
+
+    def append_response(self, response: dict, consume: bool = True) -> None:
+        """Add the files in a find_files response to the table."""
+        columns = _Columns()
+        holdings = response[MSG.DATA][MSG.HOLDINGS]
+        for h in holdings.values():
+            h_index = self._add_holding(h)
+            for tkey, t in h[MSG.TRANSACTIONS].items():
+                t_index = self._add_transaction(tkey, t, h_index)
+                if consume:
+                    files = t.pop(MSG.FILELIST)
+                else:
+                    files = t[MSG.FILELIST]
+                for f in files:
+                    columns.add_file(self, f, t_index)
+                # release the file dictionaries for this transaction
+                del files
+        columns.append_to(self)
+
+    @classmethod
+    def from_body(
+        cls, body: Union[str, bytes, bytearray], content_encoding: Optional[str] = None
+    ) -> tuple["FileTable", dict]:
+        """Build a FileTable from the body of a find_files response, as the body is
+        parsed.  Returns the table and the deserialized response, without the
+        filelists of its transactions."""
+        table = cls()
+        response = table.append_body(body, content_encoding)
+        return table, response
+
+    def append_body(
+        self, body: Union[str, bytes, bytearray], content_encoding: Optional[str] = None
+    ) -> dict:
+        """Add the files in the body of a find_files response to the table, as the
+        body is parsed.  Each file is added to the columns as soon as it is parsed, and
+        its dictionary is not kept, so the peak memory is that of the body and the
+        table, rather than that of the whole parsed response.  Returns the
+        deserialized response, with an empty filelist for each transaction."""
+        columns = _Columns()
+        # files are parsed before the transaction and holding that they are in, so
+        # their transaction codes are filled in when their holding has been parsed.
+        # assigned is the number of the parsed files that have a transaction code.
+        assigned = 0
+
+        def object_pairs_hook(pairs: list) -> Optional[dict]:
+            nonlocal assigned
+            obj = dict(pairs)
+            if "original_path" in obj:
+                # a file: add it to the columns, with its transaction to follow
+                columns.add_file(self, obj, -1)
+                return None
+            if MSG.FILELIST in obj and "ingest_time" in obj:
+                # a transaction: the files in its filelist are the ones parsed since
+                # the previous transaction
+                obj["n_files"] = len(obj[MSG.FILELIST])
+                obj[MSG.FILELIST] = []
+                return obj
+            if MSG.TRANSACTIONS in obj and MSG.HOLDING_ID in obj:
+                h_index = self._add_holding(obj)
+                for tkey, t in obj[MSG.TRANSACTIONS].items():
+                    t_index = self._add_transaction(tkey, t, h_index)
+                    n_files = t.pop("n_files")
+                    columns.transaction[assigned : assigned + n_files] = array(
+                        "l", [t_index] * n_files
+                    )
+                    assigned += n_files
+                return obj
+            return obj
+
+        response = deserialize(
+            body, content_encoding=content_encoding, object_pairs_hook=object_pairs_hook
+        )
+        columns.append_to(self)
+        return response
+
+    def _add_holding(self, h: dict) -> int:
+        self.holdings.append(
+            {
+                MSG.HOLDING_ID: h[MSG.HOLDING_ID],
+                MSG.LABEL: h[MSG.LABEL],
+                MSG.USER: h[MSG.USER],
+                MSG.GROUP: h.get(MSG.GROUP),
+            }
+        )
+        return len(self.holdings) - 1
+
+    def _add_transaction(self, transaction_id: str, t: dict, h_index: int) -> int:
+        self.transactions.append(
+            {
+                MSG.TRANSACT_ID: transaction_id,
+                "ingest_time": t["ingest_time"],
+                "holding": h_index,
+            }
+        )
+        return len(self.transactions) - 1
+
+    def has_location(self, storage_type: str) -> np.ndarray:
+        """Boolean mask of the files that have a location of the storage_type."""
+        codes = [i for i, c in enumerate(self.location_categories) if storage_type in c]
+        return np.isin(self.location, codes)
+
+    def has_no_location(self) -> np.ndarray:
+        """Boolean mask of the files that have no storage locations."""
+        codes = [i for i, c in enumerate(self.location_categories) if len(c) == 0]
+        return np.isin(self.location, codes)
+
+    def in_transaction(self, transaction_id: str) -> np.ndarray:
+        """Boolean mask of the files that belong to the transaction."""
+        codes = [
+            i
+            for i, t in enumerate(self.transactions)
+            if t[MSG.TRANSACT_ID] == transaction_id
+        ]
+        return np.isin(self.transaction, codes)
+
+    def storage_types(self, index: int) -> tuple:
+        """The storage types of the locations of the file at index."""
+        return self.location_categories[self.location[index]]
+
+    def transaction_of(self, index: int) -> dict:
+        return self.transactions[self.transaction[index]]
+
+    def holding_of(self, index: int) -> dict:
+        return self.holdings[self.transactions[self.transaction[index]]["holding"]]
+
+    def indices(self, mask: Optional[np.ndarray] = None) -> Iterator[int]:
+        """Iterate over the indices of the files, optionally only those in the
+        mask."""
+        if mask is None:
+            return iter(range(len(self)))
+        return iter(np.flatnonzero(mask).tolist())
+
+    def indices_by_transaction(
+        self, mask: Optional[np.ndarray] = None
+    ) -> dict[str, np.ndarray]:
+        """Return a dictionary of transaction_id -> array of the indices of the files
+        in the transaction, for the files in the mask, or all the files if no mask is
+        given.  Every transaction in the table has an entry, even if none of its files
+        are in the mask."""
+        if mask is None:
+            index = np.arange(len(self))
+        else:
+            index = np.flatnonzero(mask)
+        # sort the files by transaction, then split the sorted indices at the
+        # boundaries between transactions
+        index = index[np.argsort(self.transaction[index], kind="stable")]
+        bounds = np.searchsorted(
+            self.transaction[index], np.arange(len(self.transactions) + 1)
+        )
+        # a transaction can be in the table more than once, if it was split across
+        # responses
+        indices = {}
+        for t_index, t in enumerate(self.transactions):
+            t_indices = index[bounds[t_index] : bounds[t_index + 1]]
+            if t[MSG.TRANSACT_ID] in indices:
+                t_indices = np.concatenate((indices[t[MSG.TRANSACT_ID]], t_indices))
+            indices[t[MSG.TRANSACT_ID]] = t_indices
+        return indices
+
+    def paths_by_transaction(
+        self, mask: Optional[np.ndarray] = None
+    ) -> dict[str, list[str]]:
+        """Return a dictionary of transaction_id -> list of paths, for the files in
+        the mask, or all the files if no mask is given.  Every transaction in the table
+        has an entry, even if none of its files are in the mask."""
+        return {
+            transaction_id: self.path[index].tolist()
+            for transaction_id, index in self.indices_by_transaction(mask).items()
+        }
+
+
+class _Columns:
+    """The columns of the files being added to a FileTable, held in arrays of the
+    machine types until they are appended to the table."""
+
+    def __init__(self):
+        self.path = []
+        self.link_path = []
+        self.url = []
+        self.path_type = array("b")
+        self.size = array("q")
+        self.user = array("L")
+        self.group = array("L")
+        self.permissions = array("L")
+        self.transaction = array("l")
+        self.location = array("h")
+        self.empty_tape = array("b")
+
+    def add_file(self, table: FileTable, f: dict, t_index: int) -> None:
+        self.path.append(sys.intern(f["original_path"]))
+        self.path_type.append(f["path_type"])
+        self.link_path.append(f["link_path"] or None)
+        self.size.append(f["size"])
+        self.user.append(f["user"])
+        self.group.append(f["group"])
+        self.permissions.append(f["permissions"])
+        self.transaction.append(t_index)
+        f_url = None
+        f_empty_tape = False
+        for s in f["locations"]:
+            if s["storage_type"] == OBJECT_STORAGE:
+                f_url = s["url"]
+            elif s["storage_type"] == TAPE and s["root"] == "" and s["url"] == "":
+                f_empty_tape = True
+        self.url.append(f_url)
+        self.empty_tape.append(f_empty_tape)
+        self.location.append(
+            table._location_code(tuple(s["storage_type"] for s in f["locations"]))
+        )
+
+    def append_to(self, table: FileTable) -> None:
+        table.path = np.concatenate((table.path, np.array(self.path, dtype=object)))
+        table.link_path = np.concatenate(
+            (table.link_path, np.array(self.link_path, dtype=object))
+        )
+        table.url = np.concatenate((table.url, np.array(self.url, dtype=object)))
+        table.path_type = np.concatenate(
+            (table.path_type, np.asarray(self.path_type, dtype=np.int8))
+        )
+        table.size = np.concatenate((table.size, np.asarray(self.size, dtype=np.int64)))
+        table.user = np.concatenate(
+            (table.user, np.asarray(self.user, dtype=np.uint32))
+        )
+        table.group = np.concatenate(
+            (table.group, np.asarray(self.group, dtype=np.uint32))
+        )
+        table.permissions = np.concatenate(
+            (table.permissions, np.asarray(self.permissions, dtype=np.uint32))
+        )
+        table.transaction = np.concatenate(
+            (table.transaction, np.asarray(self.transaction, dtype=np.int32))
+        )
+        table.location = np.concatenate(
+            (table.location, np.asarray(self.location, dtype=np.int16))
+        )
+        table.empty_tape = np.concatenate(
+            (table.empty_tape, np.asarray(self.empty_tape, dtype=bool))
+        )
@@ -0,0 +1,150 @@
+# encoding: utf-8
+"""
+fingerprint.py
+"""
+
+__author__ = "Neil Massey"
+__date__ = "19 Oct 2026"
+__copyright__ = "Copyright 2026 United Kingdom Research and Innovation"
+__license__ = "BSD - see LICENSE file in top-level package directory"
+__contact__ = "neil.massey@stfc.ac.uk"
+
+import json
+import os.path
+import time
+import zlib
+from hashlib import sha256
+from typing import Iterable, Optional
+
+from nlds_admin.common.cache import (
+    open_cache_db,
+    get_cache_config,
+    CACHE_CONFIG_TTL,
+)
+
+# The fingerprint of a transaction is a two level Merkle tree over its files, for
+# both the catalog and the bucket listing.  The leaves are the hashes of the sorted
+# entries in each directory, and the root is the hash of the sorted (directory, leaf)
+# pairs.  If the roots from the catalog and the bucket both match those of the
+# previous audit then nothing has changed, otherwise the leaves show which
+# directories have changed, and only the objects in those directories need to be
+# verified again.
+FINGERPRINT = "fingerprint"
+# the order of the audit depths, a fingerprint from a deeper audit can be used by a
+# shallower one
+_DEPTH_RANK = {"existence": 0, "size": 1, "checksum": 2}
+
+
+def depth_rank(depth: str) -> int:
+    """Return the rank of an audit depth, higher is deeper."""
+    return _DEPTH_RANK[depth]
+
+
+def directory_leaves(entries: Iterable[tuple[str, str]]) -> dict[str, str]:
+    """Hash the entries, (path, value) pairs, into one leaf for each directory.
+    Returns a dictionary of directory -> hex digest of the sorted entries in the
+    directory."""
+    by_directory = {}
+    for path, value in entries:
+        by_directory.setdefault(os.path.dirname(path), []).append(f"{path}\0{value}\n")
+    leaves = {}
+    for directory, lines in by_directory.items():
+        lines.sort()
+        leaves[directory] = sha256("".join(lines).encode()).hexdigest()
+    return leaves
+
+
+def merkle_root(leaves: dict[str, str]) -> str:
+    """Hash the leaves into the root of the tree."""
+    hasher = sha256()
+    for directory in sorted(leaves):
+        hasher.update(f"{directory}\0{leaves[directory]}\n".encode())
+    return hasher.hexdigest()
+
+
+def changed_directories(old: dict[str, str], new: dict[str, str]) -> set[str]:
+    """Return the directories whose leaves differ between the old and new trees,
+    including those that are in only one of them."""
+    return {d for d in old.keys() | new.keys() if old.get(d) != new.get(d)}
+
+
+class FingerprintStore:
+    """The fingerprints and diffs of the transactions from previous audits, keyed by
+    bucket name, in the cache database.  A fingerprint expires after the
+    "fingerprint" time to live, so that the objects are verified again every so
+    often, even if nothing has changed.  The store is only used from the thread that
+    created it.
+
+    If refresh is True then the stored fingerprints are not used, but the new
+    fingerprints are still stored."""
+
+    def __init__(self, config: Optional[dict] = None, refresh: bool = False):
+        self.cache_config = get_cache_config(config)
+        self.refresh = refresh
+        self.db = open_cache_db(config)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS fingerprints "
+            "(bucket TEXT PRIMARY KEY, depth TEXT, catalog_root TEXT, "
+            "bucket_root TEXT, body BLOB, created REAL)"
+        )
+
+    def get_many(self, buckets: Iterable[str], depth: str) -> dict[str, dict]:
+        """Return the unexpired fingerprints for the buckets from audits at least as
+        deep as depth, as a dictionary of bucket -> record, where a record is:
+            {"depth", "catalog_root", "bucket_root", "catalog_leaves",
+             "bucket_leaves", "diff", "created"}
+        """
+        buckets = list(buckets)
+        records = {}
+        if self.refresh or len(buckets) == 0:
+            return records
+        oldest = time.time() - self.cache_config[CACHE_CONFIG_TTL][FINGERPRINT]
+        # query in batches to stay under SQLite's limit on the number of parameters
+        for i in range(0, len(buckets), 500):
+            batch = buckets[i : i + 500]
+            placeholders = ", ".join("?" * len(batch))
+            rows = self.db.execute(
+                f"SELECT bucket, depth, catalog_root, bucket_root, body, created "
+                f"FROM fingerprints WHERE created >= ? AND bucket IN ({placeholders})",
+                [oldest] + batch,
+            )
+            for bucket, stored_depth, catalog_root, bucket_root, body, created in rows:
+                if depth_rank(stored_depth) < depth_rank(depth):
+                    continue
+                record = json.loads(zlib.decompress(body))
+                record["depth"] = stored_depth
+                record["catalog_root"] = catalog_root
+                record["bucket_root"] = bucket_root
+                record["created"] = created
+                records[bucket] = record
+        return records
+
+    def put_many(self, records: dict[str, dict]) -> None:
+        """Store the fingerprint records, a dictionary of bucket -> record, as
+        returned by get_many.  The created time of a record that was carried over
+        from a previous audit should be kept, so that it still expires."""
+        now = time.time()
+        rows = []
+        for bucket, record in records.items():
+            body = {
+                "catalog_leaves": record["catalog_leaves"],
+                "bucket_leaves": record["bucket_leaves"],
+                "diff": record["diff"],
+            }
+            rows.append(
+                (
+                    bucket,
+                    record["depth"],
+                    record["catalog_root"],
+                    record["bucket_root"],
+                    zlib.compress(json.dumps(body).encode(), level=1),
+                    record.get("created", now),
+                )
+            )
+        with self.db:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO fingerprints VALUES (?, ?, ?, ?, ?, ?)", rows
+            )
+
+    def close(self) -> None:
+        self.db.close()
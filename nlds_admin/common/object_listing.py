@@ -0,0 +1,289 @@
+# encoding: utf-8
+"""
+object_listing.py
+"""
+
+__author__ = "Neil Massey"
+__date__ = "19 Oct 2026"
+__copyright__ = "Copyright 2026 United Kingdom Research and Innovation"
+__license__ = "BSD - see LICENSE file in top-level package directory"
+__contact__ = "neil.massey@stfc.ac.uk"
+
+import json
+import threading
+import time
+import zlib
+from concurrent.futures import Executor
+from typing import Iterable, Optional
+
+from minio.error import S3Error
+from urllib3.exceptions import HTTPError
+
+from nlds_admin.common.cache import open_cache_db, get_cache_config, CACHE_CONFIG_TTL
+
+# The listing cache holds the listing of each bucket from a previous run, so that
+# running audit, then fix-status, then audit again on the same transactions does not
+# list the same buckets each time.  A listing is the sorted object names, with their
+# sizes and (if they were listed) ETags, compressed.  It is used until it is older
+# than the "listing" time to live, or the max_age given, and is invalidated when
+# fix-status sends a catalog update or delete for the bucket's transaction.
+LISTING = "listing"
+
+
+def list_bucket(
+    client, bucket_name: str, etags: Optional[dict[str, str]] = None
+) -> Optional[dict[str, int]]:
+    """List the objects in the bucket, returning a dictionary of object name -> size,
+    or None if the bucket does not exist.  If etags is given then the ETag of each
+    object is added to it."""
+    try:
+        objects = {}
+        for o in client.list_objects(bucket_name, recursive=True):
+            objects[o.object_name] = o.size
+            if etags is not None:
+                etags[o.object_name] = o.etag
+        return objects
+    except S3Error as e:
+        if e.code == "NoSuchBucket":
+            return None
+        raise
+
+
+# Buckets with at least this many objects (estimated from the catalog) are listed in
+# partitions, in parallel.  Each partition is about PARTITION_SIZE objects, as the
+# object store returns a page of at most 1000 objects per request, so smaller
+# partitions would be dominated by the latency of their first request.
+PARTITION_MIN_OBJECTS = 100000
+PARTITION_SIZE = 50000
+# the number of times a partition's listing is resumed after an error
+LIST_RETRIES = 3
+# the number of levels of prefixes to probe for partitions, if there are no paths
+# from the catalog to divide the bucket up with
+MAX_PROBE_DEPTH = 3
+
+
+def partition_bounds(paths: Iterable[str], n_partitions: int) -> list[tuple]:
+    """Divide the key space of a bucket into n_partitions ranges with about the same
+    number of the paths in each.  Each range is (start_after, end), where the range
+    is the names > start_after (or from the start if None), and <= end (or to the
+    end if None), so that the ranges cover all the names, including those of objects
+    that are not in the paths."""
+    paths = sorted(set(paths))
+    if n_partitions < 2 or len(paths) < n_partitions:
+        return [(None, None)]
+    bounds = [paths[len(paths) * i // n_partitions] for i in range(1, n_partitions)]
+    return list(zip([None] + bounds, bounds + [None]))
+
+
+def _list_partition(
+    client,
+    bucket_name: str,
+    prefix: Optional[str] = None,
+    start_after: Optional[str] = None,
+    end: Optional[str] = None,
+    retries: int = LIST_RETRIES,
+) -> tuple[dict[str, int], dict[str, str]]:
+    """List the objects in one partition of a bucket, returning the dictionaries of
+    object name -> size and object name -> ETag.  If the listing fails part way
+    through then it is resumed after the last object listed, rather than started
+    again."""
+    objects = {}
+    etags = {}
+    attempt = 0
+    while True:
+        try:
+            for o in client.list_objects(
+                bucket_name, prefix=prefix, recursive=True, start_after=start_after
+            ):
+                if end is not None and o.object_name > end:
+                    return objects, etags
+                objects[o.object_name] = o.size
+                etags[o.object_name] = o.etag
+                start_after = o.object_name
+            return objects, etags
+        except S3Error as e:
+            if e.code == "NoSuchBucket" or attempt >= retries:
+                raise
+        except (HTTPError, OSError):
+            if attempt >= retries:
+                raise
+        attempt += 1
+
+
+def probe_prefixes(
+    client, bucket_name: str, n_partitions: int, max_depth: int = MAX_PROBE_DEPTH
+) -> tuple[list[str], dict[str, int], dict[str, str]]:
+    """Find the prefixes to partition a bucket by, by listing it with a "/"
+    delimiter, one level at a time, until there are at least n_partitions prefixes.
+    The objects found along the way are not under any of the prefixes, so they are
+    returned as well."""
+    prefixes = [None]
+    objects = {}
+    etags = {}
+    for _ in range(max_depth):
+        if len(prefixes) >= n_partitions:
+            break
+        next_prefixes = []
+        for prefix in prefixes:
+            for o in client.list_objects(bucket_name, prefix=prefix, recursive=False):
+                if o.is_dir:
+                    next_prefixes.append(o.object_name)
+                else:
+                    objects[o.object_name] = o.size
+                    etags[o.object_name] = o.etag
+        prefixes = next_prefixes
+        if len(prefixes) == 0:
+            break
+    return prefixes, objects, etags
+
+
+def list_bucket_parallel(
+    client,
+    bucket_name: str,
+    executor: Executor,
+    paths: Optional[Iterable[str]] = None,
+    n_partitions: int = 8,
+    etags: Optional[dict[str, str]] = None,
+) -> Optional[dict[str, int]]:
+    """List the objects in the bucket in n_partitions partitions, listed at once in
+    the executor, returning a dictionary of object name -> size, or None if the
+    bucket does not exist.  If the paths that are expected in the bucket (from the
+    catalog) are given then the partitions are ranges of names with the same number
+    of paths in each, otherwise they are the prefixes found by probe_prefixes.  If
+    etags is given then the ETag of each object is added to it."""
+    try:
+        if paths is not None:
+            partitions = [
+                {"start_after": start_after, "end": end}
+                for start_after, end in partition_bounds(paths, n_partitions)
+            ]
+            objects = {}
+            probed_etags = {}
+        else:
+            prefixes, objects, probed_etags = probe_prefixes(
+                client, bucket_name, n_partitions
+            )
+            partitions = [{"prefix": prefix} for prefix in prefixes]
+        futures = [
+            executor.submit(_list_partition, client, bucket_name, **partition)
+            for partition in partitions
+        ]
+        if etags is not None:
+            etags.update(probed_etags)
+        for future in futures:
+            partition_objects, partition_etags = future.result()
+            objects.update(partition_objects)
+            if etags is not None:
+                etags.update(partition_etags)
+        return objects
+    except S3Error as e:
+        if e.code == "NoSuchBucket":
+            return None
+        raise
+
+
+def n_partitions_for(n_objects: int, workers: int) -> int:
+    """Return the number of partitions to list a bucket of about n_objects in, with
+    at most workers partitions."""
+    if n_objects < PARTITION_MIN_OBJECTS:
+        return 1
+    return max(1, min(workers, -(-n_objects // PARTITION_SIZE)))
+
+
+class ListingCache:
+    """The listings of the buckets from previous runs, keyed by bucket name, in the
+    cache database.  The cache is shared by the threads that list the buckets, so the
+    use of the database is serialized with a lock.
+
+    If refresh is True then the stored listings are not used, but the new listings
+    are still stored."""
+
+    def __init__(
+        self,
+        config: Optional[dict] = None,
+        refresh: bool = False,
+        max_age: Optional[float] = None,
+    ):
+        cache_config = get_cache_config(config)
+        if max_age is None:
+            max_age = cache_config[CACHE_CONFIG_TTL][LISTING]
+        self.max_age = max_age
+        self.refresh = refresh
+        self.lock = threading.Lock()
+        self.db = open_cache_db(config, check_same_thread=False)
+        with self.lock, self.db:
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS listings "
+                "(bucket TEXT PRIMARY KEY, created REAL, n_objects INTEGER, body BLOB)"
+            )
+            # listings older than both the time to live and max_age have expired,
+            # and a run with a longer max_age may still use the others
+            self.db.execute(
+                "DELETE FROM listings WHERE created < ?",
+                (time.time() - max(max_age, cache_config[CACHE_CONFIG_TTL][LISTING]),),
+            )
+
+    def get(
+        self, bucket_name: str, etags: Optional[dict[str, str]] = None
+    ) -> Optional[dict[str, int]]:
+        """Return the cached listing of the bucket as a dictionary of object name ->
+        size, as from list_bucket, or None if there is no listing younger than
+        max_age.  If etags is given then the ETag of each object is added to it, and
+        a listing without ETags is not used."""
+        if self.refresh:
+            return None
+        with self.lock:
+            row = self.db.execute(
+                "SELECT body FROM listings WHERE bucket = ? AND created >= ?",
+                (bucket_name, time.time() - self.max_age),
+            ).fetchone()
+        if row is None:
+            return None
+        listing = json.loads(zlib.decompress(row[0]))
+        if etags is not None:
+            if listing["etags"] is None:
+                return None
+            etags.update(zip(listing["names"], listing["etags"]))
+        return dict(zip(listing["names"], listing["sizes"]))
+
+    def put(
+        self,
+        bucket_name: str,
+        objects: dict[str, int],
+        etags: Optional[dict[str, str]] = None,
+    ) -> None:
+        """Store the listing of the bucket, with the ETags of the objects if they
+        were listed."""
+        names = sorted(objects)
+        listing = {
+            "names": names,
+            "sizes": [objects[n] for n in names],
+            "etags": None if etags is None else [etags.get(n) for n in names],
+        }
+        body = zlib.compress(json.dumps(listing, separators=(",", ":")).encode())
+        with self.lock, self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO listings VALUES (?, ?, ?, ?)",
+                (bucket_name, time.time(), len(names), body),
+            )
+
+    def invalidate(self, bucket_names: Iterable[str]) -> None:
+        with self.lock, self.db:
+            self.db.executemany(
+                "DELETE FROM listings WHERE bucket = ?", ((b,) for b in bucket_names)
+            )
+
+    def close(self) -> None:
+        self.db.close()
+
+
+def invalidate_listings(
+    bucket_names: Iterable[str], config: Optional[dict] = None
+) -> None:
+    """Invalidate the cached listings of the buckets, after a command has changed
+    them, or the catalog records of their files."""
+    listings = ListingCache(config)
+    try:
+        listings.invalidate(bucket_names)
+    finally:
+        listings.close()
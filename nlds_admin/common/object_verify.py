@@ -0,0 +1,221 @@
+# encoding: utf-8
+"""
+object_verify.py
+"""
+
+__author__ = "Neil Massey"
+__date__ = "19 Oct 2026"
+__copyright__ = "Copyright 2026 United Kingdom Research and Innovation"
+__license__ = "BSD - see LICENSE file in top-level package directory"
+__contact__ = "neil.massey@stfc.ac.uk"
+
+import hashlib
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from minio.error import S3Error
+from minio.helpers import MAX_MULTIPART_COUNT, MIN_PART_SIZE
+
+# How deeply the objects are verified by an audit:
+#   existence : the bucket listing is compared with the catalog, including the sizes
+#               in the listing
+#   size      : each object is also HEADed with stat_object, and its size compared
+#               with the catalog
+#   checksum  : each object is also read and hashed, and the hash compared with the
+#               object's ETag
+DEPTH_EXISTENCE = "existence"
+DEPTH_SIZE = "size"
+DEPTH_CHECKSUM = "checksum"
+DEPTHS = (DEPTH_EXISTENCE, DEPTH_SIZE, DEPTH_CHECKSUM)
+
+# the size of the reads from the stream of an object's GET
+READ_SIZE = 1024 * 1024
+# part sizes commonly used by S3 clients, to try when working out the part size of a
+# multipart upload from its ETag
+_COMMON_PART_SIZES = tuple(n * 1024 * 1024 for n in (5, 8, 16, 32, 64, 128))
+
+
+class Throughput:
+    """Thread safe count of the objects and bytes verified, to report the rate."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.start = time.monotonic()
+        self.objects = 0
+        self.bytes = 0
+
+    def add(self, objects: int, nbytes: int) -> None:
+        with self.lock:
+            self.objects += objects
+            self.bytes += nbytes
+
+    def as_dict(self) -> dict:
+        seconds = time.monotonic() - self.start
+        return {
+            "objects": self.objects,
+            "bytes": self.bytes,
+            "seconds": seconds,
+            "objects_per_second": self.objects / seconds if seconds > 0 else 0.0,
+            "mb_per_second": self.bytes / 1e6 / seconds if seconds > 0 else 0.0,
+        }
+
+
+def stat_object(client, bucket_name: str, object_name: str):
+    """HEAD the object, returning the minio Object, or None if it does not exist."""
+    try:
+        return client.stat_object(bucket_name, object_name)
+    except S3Error as e:
+        if e.code in ("NoSuchKey", "NoSuchBucket"):
+            return None
+        raise
+
+
+def part_sizes(size: int, etag: str) -> list[int]:
+    """Return the part sizes that could have produced the ETag of an object of the
+    given size: the object size for a single part upload, or the candidate part sizes
+    that give the number of parts in the ETag of a multipart upload ("<md5>-<n>").
+    The part size that minio uses by default is tried first."""
+    if "-" not in etag:
+        return [size]
+    n_parts = int(etag.rsplit("-", 1)[1])
+    minio_part_size = (
+        math.ceil(math.ceil(size / MAX_MULTIPART_COUNT) / MIN_PART_SIZE) * MIN_PART_SIZE
+    )
+    mib = 1024 * 1024
+    candidates = [minio_part_size, math.ceil(size / n_parts / mib) * mib]
+    candidates.extend(_COMMON_PART_SIZES)
+    sizes = []
+    for part_size in candidates:
+        if (
+            part_size > 0
+            and math.ceil(size / part_size) == n_parts
+            and part_size not in sizes
+        ):
+            sizes.append(part_size)
+    return sizes
+
+
+def _parts_md5(
+    client,
+    bucket_name: str,
+    object_name: str,
+    offset: int,
+    length: int,
+    part_sizes: list[int],
+) -> list[list[bytes]]:
+    """Read a range of an object with one ranged GET, returning the MD5 digests of
+    the parts in the range for each of the part sizes.  The offset must be on a part
+    boundary for all of the part sizes.  Each byte is read once, and fed to one
+    hasher for each part size."""
+    hashers = [hashlib.md5(usedforsecurity=False) for _ in part_sizes]
+    filled = [0] * len(part_sizes)
+    digests = [[] for _ in part_sizes]
+    response = client.get_object(bucket_name, object_name, offset=offset, length=length)
+    try:
+        for chunk in response.stream(READ_SIZE):
+            view = memoryview(chunk)
+            for i, part_size in enumerate(part_sizes):
+                start = 0
+                while start < len(view):
+                    n = min(part_size - filled[i], len(view) - start)
+                    hashers[i].update(view[start : start + n])
+                    filled[i] += n
+                    start += n
+                    if filled[i] == part_size:
+                        digests[i].append(hashers[i].digest())
+                        hashers[i] = hashlib.md5(usedforsecurity=False)
+                        filled[i] = 0
+    finally:
+        response.close()
+        response.release_conn()
+    # the last part in the range may be short
+    for i in range(len(part_sizes)):
+        if filled[i] > 0:
+            digests[i].append(hashers[i].digest())
+    return digests
+
+
+def object_etags(
+    client,
+    bucket_name: str,
+    object_name: str,
+    size: int,
+    part_sizes: list[int],
+    executor: ThreadPoolExecutor,
+) -> list[str]:
+    """Compute the ETag that the object would have for each of the part sizes,
+    reading the object only once.  The object is read in ranges that start on a part
+    boundary for every part size, with ranged GETs in the executor, so that the
+    ranges are read in parallel.  For a single part size each range is one part."""
+    if size == 0:
+        return [hashlib.md5(b"", usedforsecurity=False).hexdigest()] * len(part_sizes)
+    range_size = math.lcm(*part_sizes)
+    futures = [
+        executor.submit(
+            _parts_md5,
+            client,
+            bucket_name,
+            object_name,
+            offset,
+            min(range_size, size - offset),
+            part_sizes,
+        )
+        for offset in range(0, size, range_size)
+    ]
+    ranges = [f.result() for f in futures]
+    etags = []
+    for i, part_size in enumerate(part_sizes):
+        digests = [d for r in ranges for d in r[i]]
+        if part_size >= size:
+            etags.append(digests[0].hex())
+        else:
+            combined = hashlib.md5(b"".join(digests), usedforsecurity=False)
+            etags.append(f"{combined.hexdigest()}-{len(digests)}")
+    return etags
+
+
+def verify_object(
+    client,
+    bucket_name: str,
+    object_name: str,
+    catalog_size: int,
+    depth: str,
+    executor: ThreadPoolExecutor,
+    throughput: Throughput,
+) -> dict:
+    """Verify an object to the depth, returning a dictionary of the problems found:
+        missing          : the object does not exist
+        object_size      : the size of the object, if it differs from the catalog
+        checksum_mismatch: the object's content does not hash to its ETag
+        unverified       : the checksum could not be verified, as the part size of
+                           the multipart upload could not be worked out
+    An empty dictionary means that the object was verified."""
+    stat = stat_object(client, bucket_name, object_name)
+    if stat is None:
+        throughput.add(1, 0)
+        return {"missing": True}
+    if stat.size != catalog_size:
+        throughput.add(1, 0)
+        return {"object_size": stat.size}
+    if depth != DEPTH_CHECKSUM:
+        throughput.add(1, 0)
+        return {}
+
+    etag = stat.etag.strip('"')
+    candidates = part_sizes(stat.size, etag)
+    if len(candidates) == 0:
+        throughput.add(1, 0)
+        return {"unverified": True}
+    computed = object_etags(
+        client, bucket_name, object_name, stat.size, candidates, executor
+    )
+    throughput.add(1, stat.size)
+    if etag in computed:
+        return {}
+    # if there is only one possible part size then the content does not match the
+    # ETag, otherwise the part size of the upload may not have been found
+    if len(candidates) == 1:
+        return {"checksum_mismatch": True}
+    return {"unverified": True}
@@ -0,0 +1,222 @@
+# encoding: utf-8
+"""
+path_index.py
+"""
+
+__author__ = "Neil Massey"
+__date__ = "19 Oct 2026"
+__copyright__ = "Copyright 2026 United Kingdom Research and Innovation"
+__license__ = "BSD - see LICENSE file in top-level package directory"
+__contact__ = "neil.massey@stfc.ac.uk"
+
+import fnmatch
+import json
+import os
+import os.path
+import re
+import time
+from bisect import bisect_left
+from typing import Iterator, Optional
+
+import numpy as np
+
+from nlds_admin.rabbit import message_keys as MSG
+from nlds_admin.common.file_table import FileTable
+
+# The path index is a directory containing:
+#   paths.bin       : the UTF-8 encoded paths, sorted bytewise, concatenated
+#   offsets.npy     : int64 offsets of the start of each path in paths.bin, plus the
+#                     end of the last path
+#   holding.npy     : int64 holding_id of each path
+#   transaction.npy : int32 code of each path's transaction in meta.json
+#   size.npy        : int64 size of each file
+#   location.npy    : int16 code of each file's storage locations in meta.json
+#   meta.json       : the version, creation time and query of the index, and the
+#                     lists of holdings, transactions and location categories
+# The arrays are memory-mapped when the index is opened, so that a query only reads
+# the pages of the files that it touches.  Sorting the paths bytewise keeps the order
+# of the code points, so that all the paths with a prefix are in a contiguous range
+# that can be found with a binary search.
+INDEX_VERSION = 1
+PATHS_FILE = "paths.bin"
+META_FILE = "meta.json"
+ARRAY_FILES = ("offsets", "holding", "transaction", "size", "location")
+
+# characters that end the literal prefix of a regex
+_REGEX_SPECIAL = set(".^$*+?{}[]\\|()")
+_GLOB_SPECIAL = set("*?[")
+
+
+class _SortedPaths:
+    """Sequence view of the sorted paths in the memory-mapped paths file, for
+    bisect."""
+
+    def __init__(self, paths: np.memmap, offsets: np.ndarray):
+        self.paths = paths
+        self.offsets = offsets
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> bytes:
+        return self.paths[self.offsets[i] : self.offsets[i + 1]].tobytes()
+
+
+def build_index(files: FileTable, directory: str, query: Optional[dict] = None) -> int:
+    """Write the path index for the files in the FileTable to the directory, which
+    is created if necessary.  query is stored in the index metadata, to record what
+    the index was built from.  Returns the number of paths in the index."""
+    os.makedirs(directory, exist_ok=True)
+    encoded = [p.encode() for p in files.path]
+    order = np.array(
+        sorted(range(len(encoded)), key=encoded.__getitem__), dtype=np.int64
+    )
+
+    lengths = np.fromiter(
+        (len(encoded[i]) for i in order), dtype=np.int64, count=len(order)
+    )
+    offsets = np.zeros(len(order) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    with open(os.path.join(directory, PATHS_FILE), "wb") as fh:
+        for i in order:
+            fh.write(encoded[i])
+    del encoded
+
+    transaction_holding = np.array(
+        [files.holdings[t["holding"]][MSG.HOLDING_ID] for t in files.transactions],
+        dtype=np.int64,
+    )
+    arrays = {
+        "offsets": offsets,
+        "holding": transaction_holding[files.transaction[order]],
+        "transaction": files.transaction[order].astype(np.int32),
+        "size": files.size[order],
+        "location": files.location[order].astype(np.int16),
+    }
+    for name, array in arrays.items():
+        np.save(os.path.join(directory, f"{name}.npy"), array)
+
+    # the metadata is written last, so that an index is only valid once it is
+    # complete
+    meta = {
+        "version": INDEX_VERSION,
+        "created": time.time(),
+        "query": query or {},
+        "holdings": files.holdings,
+        "transactions": files.transactions,
+        "location_categories": files.location_categories,
+    }
+    with open(os.path.join(directory, META_FILE), "w") as fh:
+        json.dump(meta, fh)
+    return len(order)
+
+
+class PathIndex:
+    """A memory-mapped path index written by build_index, answering prefix, glob and
+    regex lookups of the paths."""
+
+    def __init__(self, directory: str):
+        meta_path = os.path.join(directory, META_FILE)
+        if not os.path.exists(meta_path):
+            raise RuntimeError(f"No path index found in {directory}.")
+        with open(meta_path) as fh:
+            self.meta = json.load(fh)
+        if self.meta.get("version") != INDEX_VERSION:
+            raise RuntimeError(
+                f"Path index in {directory} is version {self.meta.get('version')}, "
+                f"expected version {INDEX_VERSION}.  Rebuild the index."
+            )
+        for name in ARRAY_FILES:
+            setattr(
+                self,
+                name,
+                np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r"),
+            )
+        paths_file = os.path.join(directory, PATHS_FILE)
+        if os.path.getsize(paths_file) > 0:
+            self.paths = np.memmap(paths_file, dtype=np.uint8, mode="r")
+        else:
+            self.paths = np.zeros(0, dtype=np.uint8)
+        self.sorted_paths = _SortedPaths(self.paths, self.offsets)
+        self.holdings = {h[MSG.HOLDING_ID]: h for h in self.meta["holdings"]}
+
+    def __len__(self) -> int:
+        return len(self.sorted_paths)
+
+    def path(self, i: int) -> str:
+        return self.sorted_paths[i].decode()
+
+    def prefix_range(self, prefix: str) -> tuple[int, int]:
+        """Return the [start, end) range of the indices of the paths that start with
+        the prefix."""
+        encoded = prefix.encode()
+        start = bisect_left(self.sorted_paths, encoded)
+        if len(encoded) == 0:
+            return start, len(self)
+        # the first byte string after all those with the prefix: strip any trailing
+        # 0xff bytes, then increment the last byte
+        upper = encoded.rstrip(b"\xff")
+        if len(upper) == 0:
+            return start, len(self)
+        upper = upper[:-1] + bytes([upper[-1] + 1])
+        end = bisect_left(self.sorted_paths, upper, lo=start)
+        return start, end
+
+    def prefix(self, prefix: str) -> Iterator[int]:
+        """Iterate over the indices of the paths that start with prefix."""
+        return iter(range(*self.prefix_range(prefix)))
+
+    def regex(self, pattern: str) -> Iterator[int]:
+        """Iterate over the indices of the paths that match the regular expression
+        (with re.search).  If the pattern is anchored with ^ then only the paths with
+        its literal prefix are searched."""
+        compiled = re.compile(pattern)
+        start, end = self.prefix_range(_regex_literal_prefix(pattern))
+        for i in range(start, end):
+            if compiled.search(self.path(i)):
+                yield i
+
+    def glob(self, pattern: str) -> Iterator[int]:
+        """Iterate over the indices of the paths that match the shell glob pattern.
+        Only the paths with the literal prefix of the glob are searched."""
+        compiled = re.compile(fnmatch.translate(pattern))
+        literal = pattern
+        for n, c in enumerate(pattern):
+            if c in _GLOB_SPECIAL:
+                literal = pattern[:n]
+                break
+        start, end = self.prefix_range(literal)
+        for i in range(start, end):
+            if compiled.match(self.path(i)):
+                yield i
+
+    def record(self, i: int) -> dict:
+        """Return the details of the path at index i."""
+        holding = self.holdings.get(int(self.holding[i]), {})
+        transaction = self.meta["transactions"][self.transaction[i]]
+        return {
+            MSG.PATH: self.path(i),
+            MSG.HOLDING_ID: int(self.holding[i]),
+            MSG.LABEL: holding.get(MSG.LABEL),
+            MSG.TRANSACT_ID: transaction[MSG.TRANSACT_ID],
+            "size": int(self.size[i]),
+            "storage_locations": self.meta["location_categories"][self.location[i]],
+        }
+
+
+def _regex_literal_prefix(pattern: str) -> str:
+    """Return the literal prefix of a regex that is anchored with ^, i.e. the string
+    that every match must start with, or "" if there is none."""
+    # an alternation may not be under the anchor, e.g. ^a|b
+    if not pattern.startswith("^") or "|" in pattern:
+        return ""
+    literal = []
+    for n, c in enumerate(pattern[1:], start=1):
+        if c in _REGEX_SPECIAL:
+            # a quantifier applies to the previous character, so it is not part of
+            # the literal prefix
+            if c in "*?{" and len(literal) > 0:
+                literal.pop()
+            break
+        literal.append(c)
+    return "".join(literal)
@@ -1,7 +1,11 @@
 import click
+import shutil
 from datetime import datetime
 
 from nlds_admin.rabbit.state import State
+from nlds_admin.common.file_table import FileTable
+from nlds_admin.common.summary import SIZE_BIN_NAMES
+from nlds_admin.common.bcolors import bcolors
 
 
 def integer_permissions_to_string(intperm):
@@ -154,14 +158,6 @@ def get_transaction_state(transaction: dict):
     return state_mapping_reverse[min_state], min_time
 
 
-def _get_url_from_file(f):
-    url = None
-    for s in f["locations"]:
-        if s["storage_type"] == "OBJECT_STORAGE":
-            url = s["url"]
-    return url
-
-
 def print_single_list(response: dict):
     h = response[0]
     click.echo(f"{'':<4}{'user':<16}: {h['user']}")
@@ -187,75 +183,59 @@ def print_multi_list(response: dict):
         )
 
 
-def print_single_file(response, print_url=False):
+def print_single_file(response: FileTable, print_url=False):
     """Print (full) details of one file"""
-    # NRM - note: still using loops over dictionary keys as its
-    # 1. easier than trying to just use the first key
-    # 2. a bit more robust - in case more than one file matches, for example, in
-    # separate holdings
-    for hkey in response:
-        h = response[hkey]
-        for tkey in h["transactions"]:
-            t = h["transactions"][tkey]
-            time = t["ingest_time"].replace("T", " ")
-            for f in t["filelist"]:
-                click.echo(f"{'':<4}{'path':<16}: {f['original_path']}")
-                click.echo(f"{'':<4}{'type':<16}: {f['path_type']}")
-                if f["link_path"]:
-                    click.echo(f"{'':<4}{'link path':<16}: {f['link_path']}")
-                size = pretty_size(f["size"])
-                click.echo(f"{'':<4}{'size':<16}: {size}")
-                click.echo(f"{'':<4}{'user uid':<16}: {f['user']}")
-                click.echo(f"{'':<4}{'group gid':<16}: {f['group']}")
-                click.echo(
-                    f"{'':<4}{'permissions':<16}: "
-                    f"{integer_permissions_to_string(f['permissions'])}"
-                )
-                click.echo(f"{'':<4}{'ingest time':<16}: {time[0:19]}")
-                # locations
-                stls = " "
-                for s in f["locations"]:
-                    stls += s["storage_type"] + ", "
-                if len(f["locations"]) == 0:
-                    stls += "NONE" + ", "
-
-                click.echo(f"{'':<4}{'storage location':<16}:{stls[0:-2]}")
-                url = _get_url_from_file(f)
-                if url is not None and print_url:
-                    click.echo(f"{'':<4}{'url':<16}: {url}")
-
-
-def print_simple_file(response, print_url=False):
-    for hkey in response:
-        h = response[hkey]
-        for tkey in h["transactions"]:
-            t = h["transactions"][tkey]
-            for f in t["filelist"]:
-                url = _get_url_from_file(f)
-                if print_url and url:
-                    click.echo(url)
-                else:
-                    click.echo(f"{f['original_path']}")
-
-
-def print_multi_file(response, print_url):
-    for hkey in response:
-        h = response[hkey]
-        for tkey in h["transactions"]:
-            t = h["transactions"][tkey]
-            time = t["ingest_time"].replace("T", " ")
-            for f in t["filelist"]:
-                size = pretty_size(f["size"])
-                url = _get_url_from_file(f)
-                if url and print_url:
-                    path_print = _get_url_from_file(f)
-                else:
-                    path_print = f["original_path"]
-                click.echo(
-                    f"{'':4}{h['user']:<16}"
-                    f"{h['holding_id']:<6}{h['label']:<16}"
-                    f"{size:<8}{time[:11]:<12}{path_print}"
-                )
+    # NRM - note: still looping over all the files in the table as it is a bit more
+    # robust - in case more than one file matches, for example, in separate holdings
+    for i in response.indices():
+        time = response.transaction_of(i)["ingest_time"].replace("T", " ")
+        click.echo(f"{'':<4}{'path':<16}: {response.path[i]}")
+        click.echo(f"{'':<4}{'type':<16}: {response.path_type[i]}")
+        if response.link_path[i]:
+            click.echo(f"{'':<4}{'link path':<16}: {response.link_path[i]}")
+        size = pretty_size(int(response.size[i]))
+        click.echo(f"{'':<4}{'size':<16}: {size}")
+        click.echo(f"{'':<4}{'user uid':<16}: {response.user[i]}")
+        click.echo(f"{'':<4}{'group gid':<16}: {response.group[i]}")
+        click.echo(
+            f"{'':<4}{'permissions':<16}: "
+            f"{integer_permissions_to_string(int(response.permissions[i]))}"
+        )
+        click.echo(f"{'':<4}{'ingest time':<16}: {time[0:19]}")
+        # locations
+        storage_types = response.storage_types(i)
+        if len(storage_types) == 0:
+            storage_types = ("NONE",)
+        click.echo(f"{'':<4}{'storage location':<16}: {', '.join(storage_types)}")
+        url = response.url[i]
+        if url is not None and print_url:
+            click.echo(f"{'':<4}{'url':<16}: {url}")
+
+
+def print_simple_file(response: FileTable, print_url=False):
+    for i in response.indices():
+        url = response.url[i]
+        if print_url and url:
+            click.echo(url)
+        else:
+            click.echo(f"{response.path[i]}")
+
+
+def print_multi_file(response: FileTable, print_url):
+    for i in response.indices():
+        h = response.holding_of(i)
+        time = response.transaction_of(i)["ingest_time"].replace("T", " ")
+        size = pretty_size(int(response.size[i]))
+        url = response.url[i]
+        if url and print_url:
+            path_print = url
+        else:
+            path_print = response.path[i]
+        click.echo(
+            f"{'':4}{h['user']:<16}"
+            f"{h['holding_id']:<6}{h['label']:<16}"
+            f"{size:<8}{time[:11]:<12}{path_print}"
+        )
 
 
 def print_single_stat(response: dict):
@@ -414,7 +394,11 @@ def print_action(
         print_simple_file(response, url)
         return
 
-    n_holdings = len(response)
+    # the files from find are in a FileTable, the other actions are lists / dicts
+    if isinstance(response, FileTable):
+        n_holdings = response.n_holdings
+    else:
+        n_holdings = len(response)
     if n_holdings == 0:
         click.echo(f"No transactions found for {header}")
         return
@@ -453,3 +437,304 @@ def print_action(
         "stat": print_multi_stat,
     }
     action_functions[api_action](response)
+
+
+def format_watch_row(tr: dict, sr: dict) -> str:
+    """Format a single sub-record for the stat --watch display."""
+    last_update = sr["last_updated"].replace("T", " ")
+    return (
+        f"{'':<4}{str(tr['id'])[:11]:<12}{tr['api_action'][:15]:<16}"
+        f"{sr['sub_id'][:36]:<38}{sr['state'][:22]:<23}{last_update[:19]:<20}"
+    )
+
+
+def format_watch_progress(progress: dict) -> str:
+    """Format the aggregate progress line for the stat --watch display."""
+    states = ", ".join(f"{s}: {n}" for s, n in sorted(progress["states"].items()))
+    return (
+        f"{'':<4}{progress['final']}/{progress['sub_records']} sub records finished, "
+        f"{progress['failed_files']} failed files, "
+        f"{progress['throughput']:.1f} sub records/min, "
+        f"{int(progress['elapsed'])}s elapsed [{states}]"
+    )
+
+
+def print_watch(poll: dict, rows: list, tty: bool = True):
+    """Print a poll from watch_request_status.  rows is the list of sub_ids in the
+    order that they have been displayed, and is updated with any new sub-records.
+    On a terminal, the rows for the changed sub-records and the progress line are
+    redrawn in place.  Otherwise, the changed and new rows are printed with the time
+    of the poll, followed by the progress line."""
+    progress = format_watch_progress(poll["progress"])
+    if not tty:
+        now = datetime.now().isoformat(sep=" ", timespec="seconds")
+        for tr, sr in poll["changed"] + poll["new"]:
+            click.echo(f"{now}{format_watch_row(tr, sr)}")
+        click.echo(f"{now}{progress}")
+        return
+
+    # truncate the lines to the terminal width, so that they do not wrap and the
+    # rows can be redrawn in place
+    width = shutil.get_terminal_size().columns - 1
+    progress = progress[:width]
+
+    if len(rows) == 0:
+        click.echo(
+            f"{'':<4}{'id':<12}{'action':<16}{'sub id':<38}{'state':<23}"
+            f"{'last update':<20}"
+        )
+    else:
+        # the cursor is on the line below the progress line, with the rows above it
+        for tr, sr in poll["changed"]:
+            up = len(rows) - rows.index(sr["sub_id"]) + 1
+            click.echo(
+                f"\033[{up}A\r\033[2K{format_watch_row(tr, sr)[:width]}"
+                f"\033[{up}B\r",
+                nl=False,
+            )
+        # move up to overwrite the progress line
+        click.echo("\033[1A\r\033[2K", nl=False)
+    for tr, sr in poll["new"]:
+        rows.append(sr["sub_id"])
+        click.echo(format_watch_row(tr, sr)[:width])
+    click.echo(progress)
+
+
+def print_summary(rows: list[dict], group_by: str):
+    """Print the rows of a FileSummary as a compact table."""
+    click.echo(
+        f"{'':<4}{group_by:<38}{'label':<16}{'files':>10}{'size':>10}"
+        f"{'object':>10}{'tape':>10}{'none':>8}"
+        + "".join(f"{name:>8}" for name in SIZE_BIN_NAMES)
+    )
+    for row in rows:
+        click.echo(
+            f"{'':<4}{str(row[group_by])[:37]:<38}{row['label'][:15]:<16}"
+            f"{row['files']:>10}{pretty_size(row['bytes']):>10}"
+            f"{row['OBJECT_STORAGE']:>10}{row['TAPE']:>10}{row['NONE']:>8}"
+            + "".join(f"{row[name]:>8}" for name in SIZE_BIN_NAMES)
+        )
+
+
+def print_audit(audit: dict):
+    """Print the structured diff from audit_holding."""
+    click.echo(
+        f"Audit of holding {audit['holding_id']} ({audit['label']}) for user: "
+        f"{audit['user']}, group: {audit['group']}"
+    )
+    for d in audit["transactions"]:
+        n_problems = (
+            len(d["missing"])
+            + len(d["orphaned"])
+            + len(d["size_mismatch"])
+            + len(d.get("checksum_mismatch", []))
+        )
+        if n_problems == 0 and d["bucket_exists"]:
+            status = bcolors.GREEN + "OK" + bcolors.ENDC
+        else:
+            status = bcolors.RED + "FAILED" + bcolors.ENDC
+        click.echo(
+            f"{'':<4}{d['transaction_id']:<38}{status} "
+            f"catalog: {d['catalog_files']}, expected: {d['expected_objects']}, "
+            f"objects: {d['objects']}"
+        )
+        fingerprint = d.get("fingerprint")
+        if fingerprint and fingerprint["verified_directories"] is not None:
+            click.echo(
+                f"{'':<8}{fingerprint['verified_directories']} of "
+                f"{fingerprint['directories']} directories changed since the previous "
+                "audit"
+            )
+        if not d["bucket_exists"]:
+            click.echo(f"{'':<8}bucket {d['bucket']} does not exist")
+        for p in d["missing"]:
+            click.echo(f"{'':<8}{'missing':<16}: {p}")
+        for p in d["orphaned"]:
+            click.echo(f"{'':<8}{'orphaned':<16}: {p}")
+        for m in d["size_mismatch"]:
+            click.echo(
+                f"{'':<8}{'size mismatch':<16}: {m['path']} (catalog: "
+                f"{m['catalog_size']}, object: {m['object_size']})"
+            )
+        for p in d.get("checksum_mismatch", []):
+            click.echo(f"{'':<8}{'checksum':<16}: {p}")
+        for p in d.get("unverified", []):
+            click.echo(f"{'':<8}{'unverified':<16}: {p}")
+    t = audit["totals"]
+    click.echo(
+        f"Totals: {t['catalog_files']} files in catalog, {t['expected_objects']} "
+        f"expected on object storage, {t['objects']} objects, {t['missing']} missing, "
+        f"{t['orphaned']} orphaned, {t['size_mismatch']} size mismatches, "
+        f"{t.get('checksum_mismatch', 0)} checksum mismatches, "
+        f"{t.get('unverified', 0)} unverified, "
+        f"{t['missing_buckets']} missing buckets"
+    )
+    if audit.get("throughput"):
+        print_throughput(audit["throughput"])
+
+
+def print_audit_sample(audit: dict):
+    """Print the estimate of the defect rate from sample_holding."""
+    click.echo(
+        f"Sampled audit of holding {audit['holding_id']} ({audit['label']}) for user: "
+        f"{audit['user']}, group: {audit['group']}"
+    )
+    for d in audit["defects"]:
+        click.echo(f"{'':<4}{d['problem']:<18}: {d['path']} ({d['transaction_id']})")
+    click.echo(
+        f"Verified {audit['sample']} of {audit['population']} files on object "
+        f"storage ({audit['unverified']} unverified): {len(audit['defects'])} "
+        f"defective, rate {audit['defect_rate']:.3%}"
+    )
+    low, high = audit["estimated_defects"]
+    click.echo(
+        f"Defect rate at {audit['confidence']:.1%} confidence: "
+        f"{audit['lower_bound']:.3%} to {audit['upper_bound']:.3%}, "
+        f"estimated {low} to {high} defective files in the holding"
+    )
+    if audit["passed"] is not None:
+        if audit["passed"]:
+            status = bcolors.GREEN + "PASSED" + bcolors.ENDC
+        else:
+            status = bcolors.RED + "FAILED" + bcolors.ENDC
+        click.echo(
+            f"{status}: upper bound {audit['upper_bound']:.3%} against maximum "
+            f"defect rate {audit['max_defect_rate']:.3%}"
+        )
+    print_throughput(audit["throughput"])
+
+
+def print_throughput(throughput: dict):
+    """Print the throughput of the object verification in an audit."""
+    if throughput["objects"] == 0:
+        return
+    click.echo(
+        f"Verified {throughput['objects']} objects "
+        f"({throughput['bytes'] / 1e6:.1f} MB read) in "
+        f"{throughput['seconds']:.1f}s: "
+        f"{throughput['objects_per_second']:.1f} objects/s, "
+        f"{throughput['mb_per_second']:.1f} MB/s"
+    )
+
+
+def print_audit_campaign_row(audit: dict):
+    """Print the one line summary of a holding audited in an audit campaign."""
+    holding = (
+        f"{audit['holding_id']:<8}{audit['label']:<32}{audit['user']:<16}"
+        f"{audit['group']:<16}"
+    )
+    if "failure" in audit:
+        status = bcolors.RED + "ERROR" + bcolors.ENDC
+        click.echo(f"{holding}{status} {audit['failure']}")
+        return
+    t = audit["totals"]
+    n_problems = (
+        t["missing"]
+        + t["orphaned"]
+        + t["size_mismatch"]
+        + t.get("checksum_mismatch", 0)
+    )
+    if n_problems == 0 and t["missing_buckets"] == 0:
+        status = bcolors.GREEN + "OK" + bcolors.ENDC
+    else:
+        status = bcolors.RED + "FAILED" + bcolors.ENDC
+    click.echo(
+        f"{holding}{status} catalog: {t['catalog_files']}, missing: {t['missing']}, "
+        f"orphaned: {t['orphaned']}, size mismatch: {t['size_mismatch']}, "
+        f"checksum mismatch: {t.get('checksum_mismatch', 0)}, "
+        f"missing buckets: {t['missing_buckets']}"
+    )
+
+
+def print_audit_campaign_totals(totals: dict, n_holdings: int):
+    """Print the totals of an audit campaign, from campaign_totals."""
+    click.echo(
+        f"Audited {totals['holdings']} of {n_holdings} holdings, "
+        f"{totals['failed_holdings']} with problems: "
+        f"{totals.get('catalog_files', 0)} files in catalog, "
+        f"{totals.get('missing', 0)} missing, {totals.get('orphaned', 0)} orphaned, "
+        f"{totals.get('size_mismatch', 0)} size mismatches, "
+        f"{totals.get('checksum_mismatch', 0)} checksum mismatches, "
+        f"{totals.get('missing_buckets', 0)} missing buckets"
+    )
+
+
+def print_fix_plan(plan: dict, plan_file: str):
+    """Print the actions in a fix-status plan, and where it was written."""
+    click.echo(
+        f"{bcolors.BOLD}Fix plan for transaction {plan['transaction_id']} "
+        f"({plan['state']}, {plan['complete_files']} complete files){bcolors.ENDC}"
+    )
+    click.echo(f"{'':<4}{'action':<20}{'sub_id':<40}{'files':<8}")
+    for action in plan["actions"]:
+        n_files = len(action.get("filelist", []))
+        click.echo(f"{'':<4}{action['action']:<20}{action['sub_id']:<40}{n_files:<8}")
+    click.echo(f"Plan written to {plan_file}")
+
+
+def print_apply_outcomes(outcomes: list[dict]):
+    """Print the outcome of each action applied from a fix-status plan."""
+    if len(outcomes) == 0:
+        click.echo("No actions applied.")
+        return
+    click.echo(f"{'':<4}{'action':<20}{'sub_id':<40}{'files':<8}{'status':<8}")
+    n_failed = 0
+    for o in outcomes:
+        if o["status"] == "failed":
+            status = bcolors.RED + "FAILED" + bcolors.ENDC + f" {o['error']}"
+            n_failed += 1
+        else:
+            status = bcolors.GREEN + "SENT" + bcolors.ENDC
+        click.echo(f"{'':<4}{o['action']:<20}{o['sub_id']:<40}{o['files']:<8}{status}")
+    click.echo(f"{len(outcomes) - n_failed} actions sent, {n_failed} failed.")
+
+
+def print_stuck_results(results: list[dict]):
+    """Print the summary table of the stuck transactions found by fix-status
+    --stuck-older-than, with the actions planned for each, and their outcome if the
+    plans were applied."""
+    if len(results) == 0:
+        click.echo("No stuck transactions found.")
+        return
+    click.echo(
+        f"{'id':<8}{'transaction_id':<38}{'user':<16}{'group':<16}{'last update':<21}"
+        f"{'subs':<6}{'update':<8}{'delete':<8}{'status'}"
+    )
+    counts = {"planned": 0, "fixed": 0, "failed": 0}
+    for r in results:
+        st = r["stuck"]
+        row = (
+            f"{st['id']:<8}{st['transaction_id']:<38}{st['user']:<16}"
+            f"{st['group']:<16}{st['last_updated'].replace('T', ' '):<21}"
+            f"{len(st['sub_ids']):<6}"
+        )
+        if "failure" in r:
+            counts["failed"] += 1
+            status = bcolors.RED + "ERROR" + bcolors.ENDC
+            click.echo(f"{row}{'':<16}{status} {r['failure']}")
+            continue
+        n_files = {"catalog_update": 0, "catalog_delete": 0}
+        for action in r["plan"]["actions"]:
+            if action["action"] in n_files:
+                n_files[action["action"]] += len(action["filelist"])
+        row += f"{n_files['catalog_update']:<8}{n_files['catalog_delete']:<8}"
+        if "outcomes" not in r:
+            counts["planned"] += 1
+            status = bcolors.YELLOW + "PLANNED" + bcolors.ENDC
+        else:
+            n_failed = sum(1 for o in r["outcomes"] if o["status"] == "failed")
+            if n_failed == 0:
+                counts["fixed"] += 1
+                status = bcolors.GREEN + "FIXED" + bcolors.ENDC
+            else:
+                counts["failed"] += 1
+                status = (
+                    bcolors.RED
+                    + f"FAILED {n_failed}/{len(r['outcomes'])} actions"
+                    + bcolors.ENDC
+                )
+        click.echo(f"{row}{status}")
+    click.echo(
+        f"{len(results)} stuck transactions: {counts['fixed']} fixed, "
+        f"{counts['planned']} planned, {counts['failed']} failed."
+    )
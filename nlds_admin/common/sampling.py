@@ -0,0 +1,88 @@
+# encoding: utf-8
+"""
+sampling.py
+"""
+
+__author__ = "Neil Massey"
+__date__ = "19 Oct 2026"
+__copyright__ = "Copyright 2026 United Kingdom Research and Innovation"
+__license__ = "BSD - see LICENSE file in top-level package directory"
+__contact__ = "neil.massey@stfc.ac.uk"
+
+import math
+from statistics import NormalDist
+from typing import Iterable, Optional
+
+import numpy as np
+
+
+def _z(confidence: float) -> float:
+    """The two sided normal quantile for the confidence level."""
+    if not 0 < confidence < 1:
+        raise RuntimeError("Confidence must be between 0 and 1.")
+    return NormalDist().inv_cdf(1 - (1 - confidence) / 2)
+
+
+def sample_size(confidence: float, max_defect_rate: float) -> int:
+    """Return the number of files to sample so that, if none of them are defective,
+    the upper Wilson bound on the defect rate at the confidence level is at most
+    max_defect_rate."""
+    if not 0 < max_defect_rate < 1:
+        raise RuntimeError("Maximum defect rate must be between 0 and 1.")
+    z = _z(confidence)
+    return math.ceil(z * z * (1 - max_defect_rate) / max_defect_rate)
+
+
+def wilson_interval(
+    defects: int, n: int, confidence: float, population: Optional[int] = None
+) -> tuple[float, float]:
+    """Return the Wilson score interval for the defect rate from defects in a sample
+    of n, at the confidence level.  If the sample is the whole population then the
+    rate is known exactly."""
+    if n == 0:
+        return 0.0, 1.0
+    p = defects / n
+    if population is not None and n >= population:
+        return p, p
+    z = _z(confidence)
+    z2 = z * z
+    centre = (p + z2 / (2 * n)) / (1 + z2 / n)
+    half = z * math.sqrt(p * (1 - p) / n + z2 / (4 * n * n)) / (1 + z2 / n)
+    return max(0.0, centre - half), min(1.0, centre + half)
+
+
+class Reservoir:
+    """Uniform random sample of a fixed size from a stream of items of unknown
+    length (reservoir sampling, Algorithm R).  The stream is added in batches, and
+    the random numbers for each batch are drawn with numpy, so that only the items
+    that enter the reservoir are handled in python."""
+
+    def __init__(self, size: int, seed: Optional[int] = None):
+        if size < 1:
+            raise RuntimeError("Sample size must be at least 1.")
+        self.size = size
+        self.items = []
+        # the number of items seen so far
+        self.seen = 0
+        self.rng = np.random.default_rng(seed)
+
+    def add(self, items: list) -> None:
+        """Add a batch of items from the stream."""
+        start = 0
+        # fill the reservoir first
+        if len(self.items) < self.size:
+            start = min(len(items), self.size - len(self.items))
+            self.items.extend(items[:start])
+            self.seen += start
+        n = len(items) - start
+        if n == 0:
+            return
+        # item t (counting from 0) replaces a random slot with probability size/(t+1)
+        t = np.arange(self.seen, self.seen + n, dtype=np.int64)
+        slots = self.rng.integers(0, t + 1)
+        for i in np.flatnonzero(slots < self.size):
+            self.items[slots[i]] = items[start + i]
+        self.seen += n
+
+    def extend(self, items: Iterable) -> None:
+        self.add(list(items))
@@ -0,0 +1,194 @@
+# encoding: utf-8
+"""
+serialize.py
+"""
+
+__author__ = "Neil Massey"
+__date__ = "19 Oct 2026"
+__copyright__ = "Copyright 2026 United Kingdom Research and Innovation"
+__license__ = "BSD - see LICENSE file in top-level package directory"
+__contact__ = "neil.massey@stfc.ac.uk"
+
+import json
+import zlib
+import base64
+import struct
+from typing import Any, Callable, Optional, Union
+
+from nlds_admin.rabbit import message_keys as MSG
+
+# content_encoding for the two message formats.  The JSON format is the one that the
+# NLDS server produces.  The binary format is an opt-in format for messages produced
+# by the admin tools, and consists of:
+#   BINARY_MAGIC | length of header (4 bytes, big endian) | header | DATA
+# where the header is the JSON of every part of the message except DATA, and DATA is
+# the compressed JSON of the DATA part of the message.  This avoids the 33%
+# overhead, and the extra encode / decode pass, of base64 encoding the compressed DATA
+# and embedding it in a JSON string.
+JSON_CONTENT_ENCODING = "application/json"
+BINARY_CONTENT_ENCODING = "application/x-nlds-binary"
+BINARY_MAGIC = b"NLDS\x01"
+_HEADER_LENGTH = struct.Struct(">I")
+
+# Compression codecs.  The MSG.COMPRESS flag in the message details is either True,
+# meaning zlib (the only codec understood by v1.0.11 of NLDS), or the name of the codec
+# that the DATA part was compressed with.  zstd and lz4 require the optional zstandard
+# and lz4 packages.
+ZLIB = "zlib"
+ZSTD = "zstd"
+LZ4 = "lz4"
+CODECS = (ZLIB, ZSTD, LZ4)
+DEFAULT_LEVELS = {
+    ZLIB: 1,
+    ZSTD: 3,
+    LZ4: 0,
+}
+
+
+def codec_available(codec: str) -> bool:
+    """Determine whether the package required for a codec is installed."""
+    try:
+        _import_codec(codec)
+    except RuntimeError:
+        return False
+    return True
+
+
+def _import_codec(codec: str):
+    """Import the module for a codec, raising a RuntimeError if the codec is unknown or
+    the optional package for it is not installed."""
+    try:
+        match codec:
+            case "zlib":
+                return zlib
+            case "zstd":
+                import zstandard
+
+                return zstandard
+            case "lz4":
+                import lz4.frame
+
+                return lz4.frame
+    except ImportError:
+        raise RuntimeError(
+            f"Compression codec {codec} requires an optional package that is not "
+            f"installed.  Install it with: pip install nlds-admin[{codec}]"
+        )
+    raise RuntimeError(f"Unknown compression codec {codec}, options: {CODECS}")
+
+
+def codec_from_flag(compress_flag: Union[bool, str]) -> str:
+    """Convert the MSG.COMPRESS flag in the message details to a codec name."""
+    if compress_flag is True:
+        return ZLIB
+    if compress_flag in CODECS:
+        return compress_flag
+    raise RuntimeError(f"Unknown compression flag {compress_flag} in message.")
+
+
+def compress_flag(codec: str) -> Union[bool, str]:
+    """Convert a codec name to the MSG.COMPRESS flag for the message details.  zlib is
+    flagged as True, so that the message can still be read by NLDS."""
+    if codec == ZLIB:
+        return True
+    return codec
+
+
+def compress_bytes(
+    byte_string: bytes, codec: str = ZLIB, level: Optional[int] = None
+) -> bytes:
+    """Compress a byte string with the codec, at the codec's default level if no level
+    is given."""
+    module = _import_codec(codec)
+    if level is None:
+        level = DEFAULT_LEVELS[codec]
+    match codec:
+        case "zlib":
+            return module.compress(byte_string, level=level)
+        case "zstd":
+            return module.ZstdCompressor(level=level).compress(byte_string)
+        case "lz4":
+            return module.compress(byte_string, compression_level=level)
+
+
+def decompress_bytes(byte_string: bytes, codec: str = ZLIB) -> bytes:
+    """Decompress a byte string that was compressed with the codec."""
+    module = _import_codec(codec)
+    match codec:
+        case "zlib":
+            return module.decompress(byte_string)
+        case "zstd":
+            return module.ZstdDecompressor().decompress(byte_string)
+        case "lz4":
+            return module.decompress(byte_string)
+
+
+def compress_data(
+    data_dict: dict, codec: str = ZLIB, level: Optional[int] = None
+) -> str:
+    """Compress the data part of the message into a base64 encoded string, so that it
+    can be embedded in a JSON message.  Only zlib is compatible with v1.0.11 of NLDS"""
+    byte_string = json.dumps(data_dict).encode("ascii")
+    return base64.b64encode(compress_bytes(byte_string, codec, level)).decode("ascii")
+
+
+def decompress_data(
+    data_string: str,
+    codec: str = ZLIB,
+    object_pairs_hook: Optional[Callable[[list], Any]] = None,
+) -> dict:
+    """Decompress the base64 encoded data part of the message back into a dict.  The
+    object_pairs_hook is passed to json.loads."""
+    decompressed_string = decompress_bytes(base64.b64decode(data_string), codec)
+    return json.loads(decompressed_string, object_pairs_hook=object_pairs_hook)
+
+
+def is_binary(body: Union[str, bytes, bytearray]) -> bool:
+    """Determine whether a message body is in the binary format, by checking for the
+    magic string at the start of the body."""
+    return isinstance(body, (bytes, bytearray)) and body[: len(BINARY_MAGIC)] == (
+        BINARY_MAGIC
+    )
+
+
+def serialize_binary(
+    msg_dict: dict, codec: str = ZLIB, level: Optional[int] = None
+) -> bytes:
+    """Serialize a message into the binary format.  The DATA part of the message is
+    compressed with the codec and written as raw bytes after the JSON header."""
+    header = {k: v for k, v in msg_dict.items() if k != MSG.DATA}
+    header[MSG.DETAILS] = dict(msg_dict[MSG.DETAILS])
+    # flag the data as compressed with the codec, so the reader can decompress it
+    header[MSG.DETAILS][MSG.COMPRESS] = compress_flag(codec)
+    header_bytes = json.dumps(header).encode("ascii")
+    data_bytes = compress_bytes(
+        json.dumps(msg_dict.get(MSG.DATA, {})).encode("ascii"), codec, level
+    )
+    return b"".join(
+        (BINARY_MAGIC, _HEADER_LENGTH.pack(len(header_bytes)), header_bytes, data_bytes)
+    )
+
+
+def deserialize_binary(
+    body: Union[bytes, bytearray],
+    object_pairs_hook: Optional[Callable[[list], Any]] = None,
+) -> dict:
+    """Deserialize a message in the binary format into a dict, decompressing the DATA
+    part of the message.  The object_pairs_hook is passed to json.loads for the DATA
+    part."""
+    if not is_binary(body):
+        raise RuntimeError("Message body is not in the binary message format.")
+    view = memoryview(body)
+    start = len(BINARY_MAGIC)
+    (header_length,) = _HEADER_LENGTH.unpack_from(view, start)
+    start += _HEADER_LENGTH.size
+    body_dict = json.loads(bytes(view[start : start + header_length]))
+    start += header_length
+    codec = codec_from_flag(body_dict[MSG.DETAILS][MSG.COMPRESS])
+    body_dict[MSG.DATA] = json.loads(
+        decompress_bytes(view[start:], codec), object_pairs_hook=object_pairs_hook
+    )
+    # the message is now decompressed, in case it gets passed through deserialize
+    # again
+    body_dict[MSG.DETAILS][MSG.COMPRESS] = False
+    return body_dict
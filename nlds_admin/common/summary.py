@@ -0,0 +1,131 @@
+# encoding: utf-8
+"""
+summary.py
+"""
+
+__author__ = "Neil Massey"
+__date__ = "19 Oct 2026"
+__copyright__ = "Copyright 2026 United Kingdom Research and Innovation"
+__license__ = "BSD - see LICENSE file in top-level package directory"
+__contact__ = "neil.massey@stfc.ac.uk"
+
+import numpy as np
+
+from nlds_admin.rabbit import message_keys as MSG
+from nlds_admin.common.file_table import FileTable, OBJECT_STORAGE, TAPE
+
+# what the files can be grouped by in the summary
+BY_HOLDING = "holding"
+BY_TRANSACTION = "transaction"
+BY_USER = "user"
+GROUP_BY = (BY_HOLDING, BY_TRANSACTION, BY_USER)
+
+# upper edges of the size histogram bins, in bytes - the last bin is everything at or
+# above the last edge
+SIZE_BIN_EDGES = np.array([10**3, 10**6, 10**8, 10**9, 10**10], dtype=np.int64)
+SIZE_BIN_NAMES = ("<1K", "<1M", "<100M", "<1G", "<10G", ">=10G")
+
+# the columns of the statistics held for each group
+_FILES = 0
+_BYTES = 1
+_OBJECT_STORAGE = 2
+_TAPE = 3
+_NO_LOCATION = 4
+_HISTOGRAM = 5
+_N_STATS = _HISTOGRAM + len(SIZE_BIN_NAMES)
+
+
+class FileSummary:
+    """Aggregate statistics of the files in one or more FileTables, grouped by
+    holding, transaction or user:  the number of files, the total size, the number
+    of files with an OBJECT_STORAGE location, with a TAPE location, and with no
+    location, and a histogram of the file sizes.  The statistics are computed with
+    numpy over the columns of each FileTable as it is added, so that the FileTable
+    can be released once it has been added, and only the totals are kept."""
+
+    def __init__(self, group_by: str = BY_HOLDING):
+        if group_by not in GROUP_BY:
+            raise RuntimeError(
+                f"Unknown summary grouping {group_by}, options: {GROUP_BY}"
+            )
+        self.group_by = group_by
+        # group key -> array of the _N_STATS statistics
+        self.stats = {}
+        # group key -> label to print with the key, e.g. the holding label
+        self.labels = {}
+
+    def _group_codes(self, files: FileTable) -> tuple[np.ndarray, list, list]:
+        """Return the group code for each file, and the key and label of each code."""
+        if self.group_by == BY_TRANSACTION:
+            keys = [t[MSG.TRANSACT_ID] for t in files.transactions]
+            labels = [
+                files.holdings[t["holding"]][MSG.LABEL] for t in files.transactions
+            ]
+            return files.transaction, keys, labels
+        # map each transaction to its holding
+        transaction_holding = np.array(
+            [t["holding"] for t in files.transactions], dtype=np.int64
+        )
+        holding = transaction_holding[files.transaction]
+        if self.group_by == BY_HOLDING:
+            keys = [h[MSG.HOLDING_ID] for h in files.holdings]
+            labels = [h[MSG.LABEL] for h in files.holdings]
+            return holding, keys, labels
+        # group the holdings by user
+        users = sorted(set(h[MSG.USER] for h in files.holdings))
+        user_code = {u: i for i, u in enumerate(users)}
+        holding_user = np.array(
+            [user_code[h[MSG.USER]] for h in files.holdings], dtype=np.int64
+        )
+        return holding_user[holding], users, [""] * len(users)
+
+    def add(self, files: FileTable) -> None:
+        """Add the files in the FileTable to the summary."""
+        if len(files) == 0:
+            return
+        codes, keys, labels = self._group_codes(files)
+        groups, inverse = np.unique(codes, return_inverse=True)
+        stats = np.zeros((len(groups), _N_STATS), dtype=np.int64)
+        stats[:, _FILES] = np.bincount(inverse, minlength=len(groups))
+        np.add.at(stats[:, _BYTES], inverse, files.size)
+        for column, mask in (
+            (_OBJECT_STORAGE, files.has_location(OBJECT_STORAGE)),
+            (_TAPE, files.has_location(TAPE) & ~files.empty_tape),
+            (_NO_LOCATION, files.has_no_location()),
+        ):
+            stats[:, column] = np.bincount(inverse[mask], minlength=len(groups))
+        bins = np.searchsorted(SIZE_BIN_EDGES, files.size, side="right")
+        np.add.at(stats, (inverse, _HISTOGRAM + bins), 1)
+
+        for g, code in enumerate(groups):
+            key = keys[code]
+            if key in self.stats:
+                self.stats[key] += stats[g]
+            else:
+                self.stats[key] = stats[g].copy()
+                self.labels[key] = labels[code]
+
+    def rows(self) -> list[dict]:
+        """Return the summary as a list of dictionaries, one per group, in key order,
+        followed by the total over all groups."""
+        rows = []
+        total = np.zeros(_N_STATS, dtype=np.int64)
+        for key in sorted(self.stats, key=str):
+            rows.append(self._row(key, self.labels[key], self.stats[key]))
+            total += self.stats[key]
+        rows.append(self._row("total", "", total))
+        return rows
+
+    def _row(self, key, label: str, stats: np.ndarray) -> dict:
+        row = {
+            self.group_by: key,
+            MSG.LABEL: label,
+            "files": int(stats[_FILES]),
+            "bytes": int(stats[_BYTES]),
+            OBJECT_STORAGE: int(stats[_OBJECT_STORAGE]),
+            TAPE: int(stats[_TAPE]),
+            "NONE": int(stats[_NO_LOCATION]),
+        }
+        for i, name in enumerate(SIZE_BIN_NAMES):
+            row[name] = int(stats[_HISTOGRAM + i])
+        return row
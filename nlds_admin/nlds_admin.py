@@ -1,18 +1,158 @@
 import click
+import csv
+import re
+import sys
+from json import dumps as json_dumps
 
 from nlds_admin.rabbit.rpc_publisher import RabbitMQRPCPublisher
 from nlds_admin.publishers.list import list_holdings
-from nlds_admin.publishers.find import find_files
-from nlds_admin.publishers.status import get_request_status
+from nlds_admin.publishers.find import (
+    find_files,
+    stream_find_files,
+    summarise_files,
+    DEFAULT_PAGE_SIZE,
+    DEFAULT_MAX_PAGE_BYTES,
+)
+from nlds_admin.publishers.status import get_request_status, stream_request_status
+from nlds_admin.publishers.watch import watch_request_status
 from nlds_admin.publishers.cancel import cancel_transaction
-from nlds_admin.publishers.audit import audit_holding
-from nlds_admin.publishers.fix_status import fix_transaction_status
+from nlds_admin.publishers.locate import (
+    read_paths,
+    locate_paths,
+    location_rows,
+    flatten_row,
+    CSV_FIELDS,
+    DEFAULT_BATCH_SIZE,
+    DEFAULT_CONCURRENCY,
+)
+from nlds_admin.publishers.audit import (
+    audit_holding,
+    audit_campaign,
+    campaign_holdings,
+    campaign_totals,
+    DEFAULT_WORKERS,
+    DEFAULT_CAMPAIGN_CONCURRENCY,
+    DEFAULT_CONFIDENCE,
+    ObjectStoreVerifier,
+    sample_holding,
+)
+from nlds_admin.common.object_verify import DEPTHS, DEPTH_EXISTENCE
+from nlds_admin.publishers.fix_status import (
+    fix_transaction_status,
+    fix_stuck_transactions,
+    apply_plan_file,
+    apply_stuck_results,
+    confirm_fix,
+    parse_age,
+    DEFAULT_STUCK_CONCURRENCY,
+    DEFAULT_LIST_WORKERS,
+    DEFAULT_CHUNK_FILES,
+    DEFAULT_CHUNK_BYTES,
+)
 from nlds_admin.publishers.fix_tape_records import fix_holding_tape_records
 from nlds_admin.publishers.unstage import unstage_holding
 
 from nlds_admin.common import prints
+from nlds_admin.common.file_table import FileTable
+from nlds_admin.common import export
+from nlds_admin.common.summary import GROUP_BY
+from nlds_admin.common.path_index import build_index, PathIndex
+from nlds_admin.common.cache import (
+    ResponseCache,
+    LabelCache,
+    invalidate_cache,
+    response_transaction_ids,
+)
+from nlds_admin.common.checkpoint import Checkpoint, default_state_file
+from nlds_admin.common.fingerprint import FingerprintStore
+from nlds_admin.common.object_listing import ListingCache
 from nlds_admin import __version__
-from nlds_admin.common.deserialize import deserialize
+
+
+def cache_options(f):
+    """Add the options that control the local cache of query results to a command."""
+    f = click.option(
+        "--refresh",
+        default=False,
+        is_flag=True,
+        help="Ignore the locally cached result and refresh it from the NLDS.",
+    )(f)
+    f = click.option(
+        "--no-cache",
+        "no_cache",
+        default=False,
+        is_flag=True,
+        help="Do not use, or store the result in, the local cache.",
+    )(f)
+    return f
+
+
+def export_options(f):
+    """Add the options to export the rows of the result to a file to a command."""
+    f = click.option(
+        "--output",
+        default="-",
+        type=click.Path(dir_okay=False, writable=True, allow_dash=True),
+        help="File to write the --format output to.  Default is stdout.",
+    )(f)
+    f = click.option(
+        "--format",
+        "output_format",
+        default=None,
+        type=click.Choice(export.FORMATS),
+        help="Export the result as rows in this format, written incrementally to "
+        "--output.  parquet requires the pyarrow package and an --output file.",
+    )(f)
+    return f
+
+
+def summary_option(f):
+    """Add the option to print a summary of the files, rather than the files, to a
+    command."""
+    return click.option(
+        "--summary",
+        default=None,
+        type=click.Choice(GROUP_BY),
+        help="Print a summary of the files, grouped by holding, transaction or user: "
+        "the number of files, total size, storage locations and a histogram of the "
+        "file sizes.",
+    )(f)
+
+
+def print_file_summary(rpc_publisher, json, group_by, **find_kwargs):
+    """Summarise the files that match the query and print the summary."""
+    try:
+        summary = summarise_files(
+            rpc_publisher=rpc_publisher,
+            user="nlds",
+            group="**all**",
+            group_by=group_by,
+            **find_kwargs,
+        )
+    except RuntimeError as e:
+        raise click.UsageError(e)
+    finally:
+        rpc_publisher.close_connection()
+    if json:
+        click.echo(json_dumps(summary.rows()))
+    else:
+        prints.print_summary(summary.rows(), group_by)
+
+
+def get_cache(rpc_publisher, no_cache, refresh):
+    if no_cache:
+        return None
+    return ResponseCache(rpc_publisher.whole_config, refresh=refresh)
+
+
+def get_label_cache(rpc_publisher, no_cache, refresh):
+    if no_cache:
+        return None
+    return LabelCache(rpc_publisher.whole_config, refresh=refresh)
+
+
+# commands that connect to the NLDS themselves, if at all
+LOCAL_COMMANDS = ("index",)
 
 
 @click.group(invoke_without_command=True)
@@ -39,7 +179,7 @@ def nlds_admin(ctx, version):
             )
         else:
             click.echo(ctx.get_help())
-    else:
+    elif ctx.invoked_subcommand not in LOCAL_COMMANDS:
         rpc_publisher = RabbitMQRPCPublisher()
         rpc_publisher.get_connection()
         ctx.obj = rpc_publisher
@@ -102,6 +242,9 @@ def nlds_admin(ctx, version):
     default=False,
     help="Switch between ascending and descending time order.",
 )
+@summary_option
+@export_options
+@cache_options
 def list(
     ctx,
     user,
@@ -114,10 +257,31 @@ def list(
     json,
     limit,
     time,
+    summary,
+    output_format,
+    output,
+    no_cache,
+    refresh,
 ):
     rpc_publisher = ctx.obj
+    if summary:
+        # summarise the files in the holdings that would be listed
+        print_file_summary(
+            rpc_publisher=rpc_publisher,
+            json=json,
+            group_by=summary,
+            groupall=groupall,
+            label=label,
+            holding_id=holding_id,
+            transaction_id=transaction_id,
+            tag=tag,
+            query_user=user,
+            query_group=group,
+        )
+        return
+
     try:
-        ret = list_holdings(
+        json_response = list_holdings(
             rpc_publisher=rpc_publisher,
             user="nlds",
             group="**all**",
@@ -130,10 +294,10 @@ def list(
             query_group=group,
             limit=limit,
             time=time,
+            cache=get_cache(rpc_publisher, no_cache, refresh),
         )
     finally:
         rpc_publisher.close_connection()
-    json_response = deserialize(ret)
     response_details = json_response["details"]
     if "meta" in json_response:
         response_meta = json_response["meta"]
@@ -151,8 +315,16 @@ def list(
 
     response_data = json_response["data"]["holdings"]
 
-    if json:
-        click.echo(json_response)
+    if output_format:
+        try:
+            with export.open_writer(
+                output_format, output, fields=export.HOLDING_FIELDS
+            ) as writer:
+                writer.write_rows(export.holding_rows(response_data))
+        except RuntimeError as e:
+            raise click.UsageError(e)
+    elif json:
+        click.echo(json_dumps(json_response))
     else:
         prints.print_action(response_data, response_details, response_meta, time)
 
@@ -235,6 +407,13 @@ def list(
 @click.option(
     "-L", "--limit", default=None, type=int, help="Limit the number of files to list"
 )
+@click.option(
+    "-O",
+    "--offset",
+    default=None,
+    type=int,
+    help="Offset the start of the files to list.",
+)
 @click.option(
     "-9/-0",
     "--descending/--ascending",
@@ -242,6 +421,32 @@ def list(
     default=False,
     help="Switch between ascending and descending time order.",
 )
+@click.option(
+    "-P",
+    "--paged",
+    default=False,
+    is_flag=True,
+    help="Fetch the files in pages, printing each page as it arrives, rather than "
+    "in one reply.  --limit caps the total number of files.",
+)
+@click.option(
+    "--page-size",
+    "page_size",
+    default=DEFAULT_PAGE_SIZE,
+    type=int,
+    help="The number of files in the first page for --paged.  Later pages are "
+    "sized to keep each reply under --max-page-bytes.",
+)
+@click.option(
+    "--max-page-bytes",
+    "max_page_bytes",
+    default=DEFAULT_MAX_PAGE_BYTES,
+    type=int,
+    help="The target maximum size of each reply for --paged, in bytes.",
+)
+@summary_option
+@export_options
+@cache_options
 def find(
     ctx,
     user,
@@ -256,11 +461,72 @@ def find(
     simple,
     url,
     limit,
+    offset,
     time,
+    paged,
+    page_size,
+    max_page_bytes,
+    summary,
+    output_format,
+    output,
+    no_cache,
+    refresh,
 ):
     rpc_publisher = ctx.obj
+    if summary:
+        print_file_summary(
+            rpc_publisher=rpc_publisher,
+            json=json,
+            group_by=summary,
+            paged=paged,
+            page_size=page_size,
+            max_page_bytes=max_page_bytes,
+            groupall=groupall,
+            label=label,
+            holding_id=holding_id,
+            transaction_id=transaction_id,
+            path=path,
+            tag=tag,
+            query_user=user,
+            query_group=group,
+            limit=limit,
+            offset=offset,
+            descending=time,
+        )
+        return
+
+    if paged:
+        try:
+            find_paged(
+                rpc_publisher=rpc_publisher,
+                output_format=output_format,
+                output=output,
+                json=json,
+                simple=simple,
+                url=url,
+                time=time,
+                page_size=page_size,
+                max_page_bytes=max_page_bytes,
+                groupall=groupall,
+                label=label,
+                holding_id=holding_id,
+                transaction_id=transaction_id,
+                path=path,
+                tag=tag,
+                query_user=user,
+                query_group=group,
+                limit=limit,
+                offset=offset,
+                descending=time,
+            )
+        except RuntimeError as e:
+            raise click.UsageError(e)
+        finally:
+            rpc_publisher.close_connection()
+        return
+
     try:
-        ret = find_files(
+        json_response = find_files(
             rpc_publisher=rpc_publisher,
             user="nlds",
             group="**all**",
@@ -273,11 +539,12 @@ def find(
             query_user=user,
             query_group=group,
             limit=limit,
+            offset=offset,
             descending=time,
+            cache=get_cache(rpc_publisher, no_cache, refresh),
         )
     finally:
         rpc_publisher.close_connection()
-    json_response = deserialize(ret)
     response_details = json_response["details"]
     if "meta" in json_response:
         response_meta = json_response["meta"]
@@ -293,16 +560,352 @@ def find(
             fail_string += "\n" + response_details["failure"]
         raise click.UsageError(fail_string)
 
-    response_data = json_response["data"]["holdings"]
-
-    if json:
-        click.echo(json_response)
+    if output_format:
+        try:
+            with export.open_writer(output_format, output) as writer:
+                export.write_files(writer, FileTable.from_response(json_response))
+        except RuntimeError as e:
+            raise click.UsageError(e)
+    elif json:
+        click.echo(json_dumps(json_response))
     else:
+        # convert the files to the columnar FileTable, releasing the response's
+        # per-file dictionaries as it goes
+        response_data = FileTable.from_response(json_response)
         prints.print_action(
             response_data, response_details, response_meta, time, simple, url
         )
 
 
+def find_paged(
+    rpc_publisher, output_format, output, json, simple, url, time, **find_kwargs
+):
+    """Print or export the files from stream_find_files, one page at a time."""
+    if output_format:
+        with export.open_writer(output_format, output) as writer:
+            for page in stream_find_files(
+                rpc_publisher=rpc_publisher, user="nlds", group="**all**", **find_kwargs
+            ):
+                if page["details"].get("failure"):
+                    raise RuntimeError(page["details"]["failure"])
+                export.write_files(writer, FileTable.from_response(page))
+        return
+
+    n_files = 0
+    for page in stream_find_files(
+        rpc_publisher=rpc_publisher, user="nlds", group="**all**", **find_kwargs
+    ):
+        response_details = page["details"]
+        response_meta = page.get("meta", {})
+        if "failure" in response_details and len(response_details["failure"]) > 0:
+            fail_string = "Failed to find files "
+            fail_string += prints.construct_header_string(
+                response_details, response_meta, time, simple, url
+            )
+            fail_string += "\n" + response_details["failure"]
+            raise click.UsageError(fail_string)
+        if json:
+            click.echo(json_dumps(page))
+            continue
+        files = FileTable.from_response(page)
+        if n_files == 0 and len(files) > 0 and not simple:
+            header = prints.construct_header_string(
+                response_details, response_meta, time, simple, url
+            )
+            click.echo(f"Listing files for holdings {header}")
+            prints.print_table_headers("find")
+        n_files += len(files)
+        if simple:
+            prints.print_simple_file(files, url)
+        else:
+            prints.print_multi_file(files, url)
+    if n_files == 0 and not json:
+        click.echo("No files found.")
+
+
+@nlds_admin.command(
+    "locate",
+    help="Find the holding, transaction and storage locations of each path in a file "
+    "of paths.",
+)
+@click.pass_context
+@click.option(
+    "-f",
+    "--paths-file",
+    "paths_file",
+    required=True,
+    type=click.File("r"),
+    help="File containing the paths to locate, one per line.  Use - for stdin.",
+)
+@click.option(
+    "-u",
+    "--user",
+    default=None,
+    type=str,
+    help="The username to locate the files for.",
+)
+@click.option(
+    "-g", "--group", default=None, type=str, help="The group to locate the files for."
+)
+@click.option(
+    "-A",
+    "--groupall",
+    default=False,
+    is_flag=True,
+    help="Locate files that belong to a group, rather than a single user",
+)
+@click.option(
+    "-F",
+    "--format",
+    "output_format",
+    default="ndjson",
+    type=click.Choice(["ndjson", "csv"]),
+    help="The format of the output, one row per input path.",
+)
+@click.option(
+    "-o",
+    "--output",
+    default="-",
+    type=click.File("w"),
+    help="File to write the output to.  Default is stdout.",
+)
+@click.option(
+    "--batch-size",
+    "batch_size",
+    default=DEFAULT_BATCH_SIZE,
+    type=int,
+    help="The maximum number of paths in each catalog query.",
+)
+@click.option(
+    "--concurrency",
+    default=DEFAULT_CONCURRENCY,
+    type=int,
+    help="The maximum number of catalog queries in flight at once.",
+)
+def locate(
+    ctx,
+    paths_file,
+    user,
+    group,
+    groupall,
+    output_format,
+    output,
+    batch_size,
+    concurrency,
+):
+    rpc_publisher = ctx.obj
+    paths = read_paths(paths_file)
+    try:
+        matches, failures = locate_paths(
+            rpc_publisher=rpc_publisher,
+            paths=paths,
+            batch_size=batch_size,
+            concurrency=concurrency,
+            query_user=user,
+            query_group=group,
+            groupall=groupall,
+        )
+    except RuntimeError as e:
+        raise click.UsageError(e)
+    finally:
+        rpc_publisher.close_connection()
+
+    rows = location_rows(paths, matches)
+    if output_format == "csv":
+        writer = csv.DictWriter(output, fieldnames=CSV_FIELDS)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(flatten_row(row))
+    else:
+        for row in rows:
+            output.write(json_dumps(row) + "\n")
+    n_found = sum(1 for p in matches.values() if len(p) > 0)
+    click.echo(f"Located {n_found} of {len(matches)} unique paths.", err=True)
+    for failure in set(failures):
+        click.echo(f"Catalog: {failure}", err=True)
+
+
+@nlds_admin.group(
+    "index",
+    help="Build and query a local index of the paths of the files in the catalog.",
+)
+def index():
+    pass
+
+
+@index.command("build", help="Build a path index from the results of find.")
+@click.option(
+    "-d",
+    "--directory",
+    required=True,
+    type=click.Path(file_okay=False),
+    help="The directory to write the index to.",
+)
+@click.option(
+    "-u",
+    "--user",
+    default=None,
+    type=str,
+    help="The username to index files for.",
+)
+@click.option(
+    "-g", "--group", default=None, type=str, help="The group to index files for."
+)
+@click.option(
+    "-A",
+    "--groupall",
+    default=False,
+    is_flag=True,
+    help="Index files that belong to a group, rather than a single user",
+)
+@click.option(
+    "-l",
+    "--label",
+    default=None,
+    type=str,
+    help="The label of the holding(s) to index.  This can be a regular expression "
+    "(regex).",
+)
+@click.option(
+    "-h",
+    "--holding_id",
+    default=None,
+    type=int,
+    help="The numeric id of the holding to index.",
+)
+@click.option(
+    "-t",
+    "--tag",
+    default=None,
+    type=str,
+    help="The tag(s) of the holding(s) to index.",
+)
+@click.option(
+    "-P",
+    "--paged",
+    default=False,
+    is_flag=True,
+    help="Fetch the files in pages, rather than in one reply.",
+)
+def index_build(directory, user, group, groupall, label, holding_id, tag, paged):
+    query = {
+        "user": user,
+        "group": group,
+        "groupall": groupall,
+        "label": label,
+        "holding_id": holding_id,
+        "tag": tag,
+    }
+    rpc_publisher = RabbitMQRPCPublisher()
+    rpc_publisher.get_connection()
+    find_kwargs = dict(
+        rpc_publisher=rpc_publisher,
+        user="nlds",
+        group="**all**",
+        groupall=groupall,
+        label=label,
+        holding_id=holding_id,
+        tag=tag,
+        query_user=user,
+        query_group=group,
+    )
+    files = FileTable()
+    try:
+        if paged:
+            pages = stream_find_files(**find_kwargs)
+        else:
+            pages = [find_files(**find_kwargs)]
+        for page in pages:
+            if page["details"].get("failure"):
+                raise RuntimeError(page["details"]["failure"])
+            files.append_response(page)
+    except RuntimeError as e:
+        raise click.UsageError(e)
+    finally:
+        rpc_publisher.close_connection()
+    n_paths = build_index(files, directory, query)
+    click.echo(
+        f"Indexed {n_paths} paths from {files.n_holdings} holdings in {directory}"
+    )
+
+
+@index.command("query", help="Look up paths in a path index.")
+@click.option(
+    "-d",
+    "--directory",
+    required=True,
+    type=click.Path(file_okay=False, exists=True),
+    help="The directory of the index.",
+)
+@click.option(
+    "-p",
+    "--prefix",
+    "match",
+    flag_value="prefix",
+    default=True,
+    help="Match the paths that start with PATTERN (default).",
+)
+@click.option(
+    "-G",
+    "--glob",
+    "match",
+    flag_value="glob",
+    help="Match the paths with the shell glob PATTERN.",
+)
+@click.option(
+    "-r",
+    "--regex",
+    "match",
+    flag_value="regex",
+    help="Match the paths with the regular expression PATTERN.",
+)
+@click.option(
+    "-1",
+    "--simple",
+    default=False,
+    is_flag=True,
+    help="Output the list of paths, one per line, path only.",
+)
+@click.option(
+    "-j",
+    "--json",
+    default=False,
+    is_flag=True,
+    help="Output one JSON object per path.",
+)
+@click.option(
+    "-L", "--limit", default=None, type=int, help="Limit the number of paths to list"
+)
+@click.argument("pattern")
+def index_query(directory, match, simple, json, limit, pattern):
+    try:
+        path_index = PathIndex(directory)
+        match match:
+            case "glob":
+                indices = path_index.glob(pattern)
+            case "regex":
+                indices = path_index.regex(pattern)
+            case _:
+                indices = path_index.prefix(pattern)
+        for n, i in enumerate(indices):
+            if limit is not None and n >= limit:
+                break
+            if simple:
+                click.echo(path_index.path(i))
+                continue
+            record = path_index.record(i)
+            if json:
+                click.echo(json_dumps(record))
+            else:
+                click.echo(
+                    f"{record['holding_id']:<6}{str(record['label'])[:15]:<16}"
+                    f"{prints.pretty_size(record['size']):<8}"
+                    f"{'+'.join(record['storage_locations']):<24}{record['path']}"
+                )
+    except (RuntimeError, re.error) as e:
+        raise click.UsageError(e)
+
+
 @nlds_admin.command("stat", help="List transactions.")
 @click.pass_context
 @click.option(
@@ -414,6 +1017,47 @@ def find(
     default=True,
     help="Switch between ascending and descending time order.",
 )
+@click.option(
+    "-w",
+    "--watch",
+    default=None,
+    type=float,
+    metavar="INTERVAL",
+    help="Keep polling the status of the transactions every INTERVAL seconds, "
+    "showing only the sub records that have changed, until all of the sub records "
+    "have finished.  The polling interval backs off when nothing changes.",
+)
+@click.option(
+    "--all",
+    "all_pages",
+    default=False,
+    is_flag=True,
+    help="Page through all of the transactions, printing each page as it arrives.  "
+    "--limit caps the total number of transactions and --offset is the start of the "
+    "first page.",
+)
+@click.option(
+    "--page-size",
+    "page_size",
+    default=1000,
+    type=int,
+    help="The number of transactions in each page for --all.",
+)
+@click.option(
+    "--concurrency",
+    default=2,
+    type=int,
+    help="The maximum number of pages to fetch at once for --all.",
+)
+@click.option(
+    "--no-labels",
+    "no_labels",
+    default=False,
+    is_flag=True,
+    help="Do not fetch the holding labels of the transactions from the catalog.",
+)
+@export_options
+@cache_options
 def stat(
     ctx,
     user,
@@ -430,13 +1074,118 @@ def stat(
     limit,
     offset,
     time,
+    watch,
+    all_pages,
+    page_size,
+    concurrency,
+    no_labels,
+    output_format,
+    output,
+    no_cache,
+    refresh,
 ):
     rpc_publisher = ctx.obj
     api_action_list = [a for a in api_action]
     state_list = [s for s in state]
     exclude_api_action_list = [x for x in exclude_api_action]
+    if watch is not None:
+        if json or output_format:
+            rpc_publisher.close_connection()
+            raise click.UsageError("--watch cannot be used with --json or --format.")
+        try:
+            polls = watch_request_status(
+                rpc_publisher=rpc_publisher,
+                interval=watch,
+                user="nlds",
+                group="**all**",
+                groupall=groupall,
+                id=id,
+                transaction_id=transaction_id,
+                job_label=job_label,
+                state=state_list,
+                sub_id=sub_id,
+                api_action=api_action_list,
+                exclude_api_action=exclude_api_action_list,
+                query_user=user,
+                query_group=group,
+                limit=limit,
+                offset=offset,
+                descending=time,
+                labels=not no_labels,
+                label_cache=get_label_cache(rpc_publisher, no_cache, refresh),
+            )
+            rows = []
+            tty = sys.stdout.isatty()
+            for poll in polls:
+                if len(poll["records"]) == 0:
+                    click.echo("No transactions found.")
+                    break
+                prints.print_watch(poll, rows, tty)
+        except RuntimeError as e:
+            raise click.UsageError(e)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            rpc_publisher.close_connection()
+        return
+
+    if all_pages:
+        try:
+            pages = stream_request_status(
+                rpc_publisher=rpc_publisher,
+                user="nlds",
+                group="**all**",
+                page_size=page_size,
+                concurrency=concurrency,
+                limit=limit,
+                offset=offset,
+                labels=not no_labels,
+                label_cache=get_label_cache(rpc_publisher, no_cache, refresh),
+                groupall=groupall,
+                id=id,
+                transaction_id=transaction_id,
+                job_label=job_label,
+                state=state_list,
+                sub_id=sub_id,
+                api_action=api_action_list,
+                exclude_api_action=exclude_api_action_list,
+                query_user=user,
+                query_group=group,
+                descending=time,
+            )
+            if output_format:
+                with export.open_writer(
+                    output_format, output, fields=export.SUB_RECORD_FIELDS
+                ) as writer:
+                    for page in pages:
+                        writer.write_rows(
+                            export.sub_record_rows(page["data"]["records"])
+                        )
+                return
+            n_records = 0
+            for page in pages:
+                records = page["data"]["records"]
+                if json:
+                    click.echo(json_dumps(page))
+                    continue
+                if n_records == 0 and len(records) > 0:
+                    header = prints.construct_header_string(
+                        page["details"], page["meta"], time
+                    )
+                    click.echo(f"State of transactions for {header}")
+                    prints.print_table_headers("stat")
+                n_records += len(records)
+                prints.print_multi_stat(records)
+            if n_records == 0 and not json:
+                click.echo("No transactions found.")
+        except RuntimeError as e:
+            raise click.UsageError(e)
+        finally:
+            rpc_publisher.close_connection()
+        return
+
     try:
-        ret = get_request_status(
+        json_response = get_request_status(
             rpc_publisher=rpc_publisher,
             user="nlds",
             group="**all**",
@@ -453,10 +1202,12 @@ def stat(
             limit=limit,
             offset=offset,
             descending=time,
+            labels=not no_labels,
+            cache=get_cache(rpc_publisher, no_cache, refresh),
+            label_cache=get_label_cache(rpc_publisher, no_cache, refresh),
         )
     finally:
         rpc_publisher.close_connection()
-    json_response = deserialize(ret)
     response_details = json_response["details"]
     response_data = json_response["data"]
     response_meta = json_response["meta"]
@@ -473,8 +1224,16 @@ def stat(
             fail_string += "\n" + response_details["failure"]
         raise click.UsageError(fail_string)
 
-    if json:
-        click.echo(json_response)
+    if output_format:
+        try:
+            with export.open_writer(
+                output_format, output, fields=export.SUB_RECORD_FIELDS
+            ) as writer:
+                writer.write_rows(export.sub_record_rows(response_data))
+        except RuntimeError as e:
+            raise click.UsageError(e)
+    elif json:
+        click.echo(json_dumps(json_response))
     else:
         prints.print_action(response_data, response_details, response_meta, time)
 
@@ -530,8 +1289,9 @@ def cancel(ctx, user, group, id, transaction_id, job_label, json):
     # we do want to use the RPC publisher for this, so that we can have interaction
     # with the user
     rpc_publisher = ctx.obj
+    json_response = None
     try:
-        ret = cancel_transaction(
+        json_response = cancel_transaction(
             rpc_publisher=rpc_publisher,
             user=user,
             group=group,
@@ -541,7 +1301,11 @@ def cancel(ctx, user, group, id, transaction_id, job_label, json):
         )
     finally:
         rpc_publisher.close_connection()
-    json_response = deserialize(ret)
+        # the cancelled transactions may be in cached query results.  The transaction
+        # ids are taken from the response, as the cached list and find responses are
+        # tagged with them, and only the id may have been given
+        for t_id in response_transaction_ids(json_response) or [transaction_id]:
+            invalidate_cache(rpc_publisher.whole_config, transaction_id=t_id, id=id)
     response_details = json_response["details"]
     if "meta" in json_response:
         response_meta = json_response["meta"]
@@ -569,13 +1333,10 @@ def cancel(ctx, user, group, id, transaction_id, job_label, json):
         raise click.UsageError(fail_string)
 
     if json:
-        click.echo(json_response)
+        click.echo(json_dumps(json_response))
     else:
         prints.print_action(response_data, response_details, response_meta)
 
-    if json:
-        click.echo(json_response)
-
 
 @nlds_admin.command(
     "audit",
@@ -623,27 +1384,294 @@ def cancel(ctx, user, group, id, transaction_id, job_label, json):
 @click.option(
     "-j",
     "--json",
-    default=None,
-    type=str,
+    default=False,
+    is_flag=True,
     help="Output the audit results in JSON.",
 )
-def audit(ctx, user, group, id, transaction_id, label, json):
+@click.option(
+    "-w",
+    "--workers",
+    default=DEFAULT_WORKERS,
+    type=int,
+    help=(
+        "The number of object store buckets to list, and objects to verify, at once."
+    ),
+)
+@click.option(
+    "-d",
+    "--depth",
+    default=DEPTH_EXISTENCE,
+    type=click.Choice(DEPTHS),
+    help=(
+        "How deeply to verify the objects.  existence: compare the bucket listing "
+        "with the catalog.  size: also check the size of each object.  checksum: "
+        "also read each object and check its contents against its ETag."
+    ),
+)
+@click.option(
+    "--full",
+    default=False,
+    is_flag=True,
+    help=(
+        "Verify all the objects, rather than only those in the directories that have "
+        "changed since the previous audit."
+    ),
+)
+@click.option(
+    "--sample",
+    default=None,
+    type=int,
+    help=(
+        "Verify a uniform random sample of this many files of the holding, and "
+        "estimate the defect rate of the whole holding."
+    ),
+)
+@click.option(
+    "--max-defect-rate",
+    default=None,
+    type=float,
+    help=(
+        "Sample enough files to test that the defect rate of the holding is below "
+        "this rate, at the --confidence level, e.g. 0.001."
+    ),
+)
+@click.option(
+    "--confidence",
+    default=DEFAULT_CONFIDENCE,
+    type=float,
+    help="The confidence level of the bounds on the defect rate of a sampled audit.",
+)
+@click.option(
+    "--seed",
+    default=None,
+    type=int,
+    help="The seed for the random sample, to repeat a sampled audit.",
+)
+@click.option(
+    "--group-wide",
+    default=False,
+    is_flag=True,
+    help="Audit all the holdings of the group (and user, if given).",
+)
+@click.option(
+    "--all",
+    "all_holdings",
+    default=False,
+    is_flag=True,
+    help="Audit all the holdings in the catalog.",
+)
+@click.option(
+    "--state-file",
+    default=None,
+    type=click.Path(dir_okay=False),
+    help=(
+        "The state file that a --group-wide or --all audit is checkpointed to, so "
+        "that it can be stopped and resumed.  Defaults to a file in the cache "
+        "directory, named for the user and group."
+    ),
+)
+@click.option(
+    "--restart",
+    default=False,
+    is_flag=True,
+    help="Start a --group-wide or --all audit again, discarding the state file.",
+)
+@click.option(
+    "-c",
+    "--concurrency",
+    default=DEFAULT_CAMPAIGN_CONCURRENCY,
+    type=int,
+    help="The number of holdings to audit at once for --group-wide or --all.",
+)
+@click.option(
+    "--listing-max-age",
+    "listing_max_age",
+    default=None,
+    type=float,
+    help="Use the cached listing of a bucket if it is younger than this, in "
+    'seconds.  Defaults to the "listing" time to live in the cache config.',
+)
+@click.option(
+    "--refresh-listings",
+    "refresh_listings",
+    default=False,
+    is_flag=True,
+    help="List the buckets again, rather than using the cached listings.",
+)
+def audit(
+    ctx,
+    user,
+    group,
+    id,
+    transaction_id,
+    label,
+    json,
+    workers,
+    depth,
+    full,
+    sample,
+    max_defect_rate,
+    confidence,
+    seed,
+    group_wide,
+    all_holdings,
+    state_file,
+    restart,
+    concurrency,
+    listing_max_age,
+    refresh_listings,
+):
     """
     Audit will check that the files recorded in a holding actually exist on the object
     storage.  Could later extend this to being on the tape, via the aggregation.
     """
+    rpc_publisher = ctx.obj
+    sampled = sample is not None or max_defect_rate is not None
+    if sampled and (group_wide or all_holdings):
+        rpc_publisher.close_connection()
+        raise click.UsageError(
+            "--sample and --max-defect-rate audit a single holding, and cannot be "
+            "given with --group-wide or --all."
+        )
+    if sampled:
+        try:
+            sample_result = sample_holding(
+                rpc_publisher=rpc_publisher,
+                user=user,
+                group=group,
+                id=id,
+                transaction_id=transaction_id,
+                label=label,
+                sample=sample,
+                confidence=confidence,
+                max_defect_rate=max_defect_rate,
+                workers=workers,
+                depth=depth,
+                seed=seed,
+            )
+        except RuntimeError as e:
+            raise click.UsageError(e)
+        finally:
+            rpc_publisher.close_connection()
+        if json:
+            click.echo(json_dumps(sample_result))
+        else:
+            prints.print_audit_sample(sample_result)
+        return
+    if group_wide or all_holdings:
+        try:
+            run_audit_campaign(
+                rpc_publisher,
+                user,
+                group,
+                group_wide,
+                all_holdings,
+                state_file,
+                restart,
+                json,
+                workers,
+                depth,
+                full,
+                concurrency,
+                listing_max_age,
+                refresh_listings,
+            )
+        except RuntimeError as e:
+            raise click.UsageError(e)
+        finally:
+            rpc_publisher.close_connection()
+        return
+    fingerprints = FingerprintStore(refresh=full)
+    # a full audit does not use the cached listings either
+    listings = ListingCache(refresh=full or refresh_listings, max_age=listing_max_age)
     try:
-        rpc_publisher = ctx.obj
-        audit_holding(
+        audit_result = audit_holding(
             rpc_publisher=rpc_publisher,
             user=user,
             group=group,
             id=id,
             transaction_id=transaction_id,
             label=label,
+            workers=workers,
+            depth=depth,
+            fingerprints=fingerprints,
+            listings=listings,
         )
     except RuntimeError as e:
         raise click.UsageError(e)
+    finally:
+        fingerprints.close()
+        listings.close()
+        rpc_publisher.close_connection()
+    if json:
+        click.echo(json_dumps(audit_result))
+    else:
+        prints.print_audit(audit_result)
+
+
+def run_audit_campaign(
+    rpc_publisher,
+    user,
+    group,
+    group_wide,
+    all_holdings,
+    state_file,
+    restart,
+    json,
+    workers,
+    depth,
+    full,
+    concurrency,
+    listing_max_age,
+    refresh_listings,
+):
+    """Audit all the holdings of a group, or of the whole catalog, checkpointing the
+    progress to the state file.  With json, one line of JSON is output for each
+    holding as it finishes."""
+    if group_wide and all_holdings:
+        raise RuntimeError("Only one of --group-wide and --all can be given.")
+    if group_wide and not group:
+        raise RuntimeError("Group is required to perform a --group-wide audit.")
+    if all_holdings and (user or group):
+        raise RuntimeError("User and group cannot be given with --all.")
+    campaign = {"command": "audit", "user": user, "group": group, "depth": depth}
+    if state_file is None:
+        name = "audit-all" if all_holdings else f"audit-{group}-{user or 'all'}"
+        state_file = default_state_file(f"{name}-{depth}")
+
+    holdings = campaign_holdings(rpc_publisher, user=user, group=group)
+    fingerprints = FingerprintStore(refresh=full)
+    listings = ListingCache(refresh=full or refresh_listings, max_age=listing_max_age)
+    try:
+        verifier = ObjectStoreVerifier(
+            workers, depth, fingerprints=fingerprints, listings=listings
+        )
+        with Checkpoint(state_file, campaign, restart=restart) as checkpoint:
+            if len(checkpoint) > 0 and not json:
+                click.echo(
+                    f"Resuming audit from {state_file}: {len(checkpoint)} of "
+                    f"{len(holdings)} holdings already audited."
+                )
+            for audit_result in audit_campaign(
+                rpc_publisher,
+                holdings,
+                checkpoint,
+                concurrency=concurrency,
+                verifier=verifier,
+            ):
+                if json:
+                    click.echo(json_dumps(audit_result))
+                else:
+                    prints.print_audit_campaign_row(audit_result)
+            if not json:
+                prints.print_audit_campaign_totals(
+                    campaign_totals(checkpoint), len(holdings)
+                )
+                prints.print_throughput(verifier.throughput.as_dict())
+                click.echo(f"Audit state saved to {state_file}")
+    finally:
+        fingerprints.close()
+        listings.close()
 
 
 @nlds_admin.command(
@@ -701,13 +1729,153 @@ def audit(ctx, user, group, id, transaction_id, label, json):
     type=str,
     help="Output the fix transaction results in JSON.",
 )
-def fix_status(ctx, user, group, id, transaction_id, state, json):
+@click.option(
+    "--compact",
+    default=False,
+    is_flag=True,
+    help="Send the filelist in the compact (front-coded) encoding.  This can only "
+    "be read by versions of NLDS that support the encoding.",
+)
+@click.option(
+    "--plan",
+    "plan_file",
+    default=None,
+    type=click.Path(dir_okay=False, writable=True),
+    help="Work out the fix and write it to this file as JSON, without changing "
+    "anything.  The plan can be reviewed and then applied with --apply.",
+)
+@click.option(
+    "--apply",
+    "apply_file",
+    default=None,
+    type=click.Path(exists=True, dir_okay=False),
+    help="Apply the fix in a plan written by --plan, without asking for "
+    "confirmation, and report the outcome of each action.",
+)
+@click.option(
+    "--stuck-older-than",
+    "stuck_older_than",
+    default=None,
+    type=str,
+    help="Fix all of the transactions with sub-records that have been in the --state "
+    "for longer than this, e.g. 6h, 30m or 2d, rather than a single transaction.  "
+    "--user and --group restrict the transactions to those of the user and / or "
+    "group.",
+)
+@click.option(
+    "-c",
+    "--concurrency",
+    default=DEFAULT_STUCK_CONCURRENCY,
+    type=int,
+    help="The number of stuck transactions to fix at once for --stuck-older-than.",
+)
+@click.option(
+    "--list-budget",
+    "list_budget",
+    default=DEFAULT_LIST_WORKERS,
+    type=int,
+    help="The number of object store listings at once for --stuck-older-than, "
+    "shared between all of the transactions being fixed.",
+)
+@click.option(
+    "--chunk-files",
+    "chunk_files",
+    default=DEFAULT_CHUNK_FILES,
+    type=int,
+    help="The maximum number of files in each catalog update or delete message.  "
+    "Larger filelists are sent in several messages, each with its own sub id.",
+)
+@click.option(
+    "--chunk-bytes",
+    "chunk_bytes",
+    default=DEFAULT_CHUNK_BYTES,
+    type=int,
+    help="The approximate maximum size of each catalog update or delete message, "
+    "in bytes.",
+)
+@click.option(
+    "--listing-max-age",
+    "listing_max_age",
+    default=None,
+    type=float,
+    help="Use the cached listing of a bucket if it is younger than this, in "
+    'seconds.  Defaults to the "listing" time to live in the cache config.',
+)
+@click.option(
+    "--refresh-listings",
+    "refresh_listings",
+    default=False,
+    is_flag=True,
+    help="List the buckets again, rather than using the cached listings.",
+)
+def fix_status(
+    ctx,
+    user,
+    group,
+    id,
+    transaction_id,
+    state,
+    json,
+    compact,
+    plan_file,
+    apply_file,
+    stuck_older_than,
+    concurrency,
+    list_budget,
+    chunk_files,
+    chunk_bytes,
+    listing_max_age,
+    refresh_listings,
+):
     """
     Fix status will check the status of a transaction and attempt to repair it.
     """
+    rpc_publisher = ctx.obj
+    # the transactions that have had fixes sent, whose cached query results are
+    # invalidated.  Nothing is invalidated if no fixes were sent.
+    transaction_ids = []
+    listings = ListingCache(refresh=refresh_listings, max_age=listing_max_age)
     try:
-        rpc_publisher = ctx.obj
-        fix_transaction_status(
+        if plan_file and apply_file:
+            raise RuntimeError("Only one of --plan and --apply can be given.")
+        if apply_file:
+            plans, outcomes = apply_plan_file(apply_file, compact=compact)
+            transaction_ids = [plan["transaction_id"] for plan in plans]
+            prints.print_apply_outcomes(outcomes)
+            return
+        if stuck_older_than:
+            if id or transaction_id:
+                raise RuntimeError(
+                    "--stuck-older-than cannot be used with --id or --transaction_id."
+                )
+            results = fix_stuck_transactions(
+                rpc_publisher=rpc_publisher,
+                state=state,
+                older_than=parse_age(stuck_older_than),
+                user=user,
+                group=group,
+                concurrency=concurrency,
+                list_budget=list_budget,
+                plan_file=plan_file,
+                max_files=chunk_files,
+                max_bytes=chunk_bytes,
+                listings=listings,
+            )
+            prints.print_stuck_results(results)
+            n_plans = sum(1 for r in results if "plan" in r)
+            if plan_file:
+                click.echo(f"{n_plans} plans written to {plan_file}")
+            elif n_plans > 0 and confirm_fix(
+                f"{n_plans} stuck transactions have been found that can be fixed.",
+                "Do you wish to apply the fixes",
+            ):
+                transaction_ids = [
+                    r["stuck"]["transaction_id"] for r in results if "plan" in r
+                ]
+                apply_stuck_results(results, compact=compact)
+                prints.print_stuck_results(results)
+            return
+        plan, outcomes = fix_transaction_status(
             rpc_publisher=rpc_publisher,
             user=user,
             group=group,
@@ -715,9 +1883,26 @@ def fix_status(ctx, user, group, id, transaction_id, state, json):
             id=id,
             transaction_id=transaction_id,
             json=json,
+            compact=compact,
+            plan_file=plan_file,
+            max_files=chunk_files,
+            max_bytes=chunk_bytes,
+            listings=listings,
         )
+        if plan is not None:
+            prints.print_fix_plan(plan, plan_file)
+        else:
+            # the transaction id is known from the outcomes, even if only the id
+            # was given
+            transaction_ids = sorted({o["transaction_id"] for o in outcomes})
+            prints.print_apply_outcomes(outcomes)
     except RuntimeError as e:
         raise click.UsageError(e)
+    finally:
+        listings.close()
+        # the fixed transactions may be in cached query results
+        for t_id in transaction_ids:
+            invalidate_cache(rpc_publisher.whole_config, transaction_id=t_id)
 
 
 @nlds_admin.command(
@@ -769,7 +1954,16 @@ def fix_status(ctx, user, group, id, transaction_id, state, json):
     type=str,
     help="Output the fix tape location results in JSON.",
 )
-def fix_tape_records(ctx, user, group, holding_id, transaction_id, limit, json):
+@click.option(
+    "--compact",
+    default=False,
+    is_flag=True,
+    help="Send the filelist in the compact (front-coded) encoding.  This can only "
+    "be read by versions of NLDS that support the encoding.",
+)
+def fix_tape_records(
+    ctx, user, group, holding_id, transaction_id, limit, json, compact
+):
     """
     Fix status will check the status of a transaction and attempt to repair it.
     """
@@ -783,9 +1977,17 @@ def fix_tape_records(ctx, user, group, holding_id, transaction_id, limit, json):
             transaction_id=transaction_id,
             limit=limit,
             json=json,
+            compact=compact,
         )
     except RuntimeError as e:
         raise click.UsageError(e)
+    finally:
+        # the fixed holding may be in cached query results
+        invalidate_cache(
+            rpc_publisher.whole_config,
+            holding_id=holding_id,
+            transaction_id=transaction_id,
+        )
 
 
 @nlds_admin.command(
@@ -845,7 +2047,14 @@ def fix_tape_records(ctx, user, group, holding_id, transaction_id, limit, json):
     type=str,
     help="Output the results of unstaging in JSON.",
 )
-def unstage(ctx, user, group, holding_id, transaction_id, limit, json):
+@click.option(
+    "--compact",
+    default=False,
+    is_flag=True,
+    help="Send the filelist in the compact (front-coded) encoding.  This can only "
+    "be read by versions of NLDS that support the encoding.",
+)
+def unstage(ctx, user, group, holding_id, transaction_id, limit, json, compact):
     """
     Fix status will check the status of a transaction and attempt to repair it.
     """
@@ -859,9 +2068,17 @@ def unstage(ctx, user, group, holding_id, transaction_id, limit, json):
             transaction_id=transaction_id,
             limit=limit,
             json=json,
+            compact=compact,
         )
     except RuntimeError as e:
         raise click.UsageError(e)
+    finally:
+        # the fixed holding may be in cached query results
+        invalidate_cache(
+            rpc_publisher.whole_config,
+            holding_id=holding_id,
+            transaction_id=transaction_id,
+        )
 
 
 def main():
@@ -9,12 +9,425 @@ __copyright__ = "Copyright 2026 United Kingdom Research and Innovation"
 __license__ = "BSD - see LICENSE file in top-level package directory"
 __contact__ = "neil.massey@stfc.ac.uk"
 
-from typing import Optional
+import math
+import os.path
+import threading
+from collections import deque
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Future,
+    ThreadPoolExecutor,
+    as_completed,
+    wait,
+)
+from typing import Iterator, Optional
+
+import numpy as np
+from minio.error import S3Error
+from urllib3.exceptions import HTTPError
+
 from nlds_admin.rabbit.rpc_publisher import RabbitMQRPCPublisher
 from nlds_admin.publishers.list import list_holdings
-from nlds_admin.publishers.find import find_files
-from nlds_admin.common.deserialize import deserialize
+from nlds_admin.publishers.find import find_file_table, stream_find_files, _find_message
 from nlds_admin.rabbit import message_keys as MSG
+from nlds_admin.rabbit import routing_keys as RK
+from nlds_admin.common.checkpoint import Checkpoint
+from nlds_admin.common.fingerprint import (
+    FingerprintStore,
+    FINGERPRINT,
+    directory_leaves,
+    merkle_root,
+    changed_directories,
+    depth_rank,
+)
+from nlds_admin.common.connect import connect_to_object_store
+from nlds_admin.common.object_listing import (
+    ListingCache,
+    list_bucket,
+    list_bucket_parallel,
+    n_partitions_for,
+)
+from nlds_admin.common.file_table import FileTable, OBJECT_STORAGE
+from nlds_admin.common.object_verify import (
+    verify_object,
+    Throughput,
+    DEPTHS,
+    DEPTH_EXISTENCE,
+    DEPTH_SIZE,
+    DEPTH_CHECKSUM,
+)
+from nlds_admin.common.sampling import Reservoir, sample_size, wilson_interval
+
+DEFAULT_WORKERS = 16
+# the lists of problems in the diff of a transaction
+PROBLEMS = ("missing", "orphaned", "size_mismatch", "checksum_mismatch")
+# confidence level of the bounds on the defect rate of a sampled audit
+DEFAULT_CONFIDENCE = 0.99
+# number of holdings that an audit campaign has in progress at once
+DEFAULT_CAMPAIGN_CONCURRENCY = 4
+
+
+def diff_transaction(
+    transaction_id: str,
+    catalog: dict[str, int],
+    expected: set[str],
+    objects: Optional[dict[str, int]],
+) -> dict:
+    """Compare the files in the catalog for a transaction with the objects in its
+    bucket.
+        catalog  : all the files in the transaction, path -> size
+        expected : the paths of the files that have an OBJECT_STORAGE location
+        objects  : the objects in the bucket, object name -> size, or None if the
+                   bucket does not exist
+    Returns the diff:
+        missing       : expected files that are not in the bucket
+        orphaned      : objects in the bucket that are not in the catalog
+        size_mismatch : files whose object is a different size to the catalog
+    """
+    if objects is None:
+        missing = sorted(expected)
+        orphaned = []
+        size_mismatch = []
+    else:
+        missing = sorted(p for p in expected if p not in objects)
+        orphaned = sorted(o for o in objects if o not in catalog)
+        size_mismatch = [
+            {
+                MSG.PATH: p,
+                "catalog_size": catalog[p],
+                "object_size": objects[p],
+            }
+            for p in sorted(expected)
+            if p in objects and objects[p] != catalog[p]
+        ]
+    return {
+        MSG.TRANSACT_ID: transaction_id,
+        "bucket": "nlds." + transaction_id,
+        "bucket_exists": objects is not None,
+        "catalog_files": len(catalog),
+        "expected_objects": len(expected),
+        "objects": 0 if objects is None else len(objects),
+        "missing": missing,
+        "orphaned": orphaned,
+        "size_mismatch": size_mismatch,
+    }
+
+
+class ObjectStoreVerifier:
+    """The thread pools and the shared object store client for verifying the
+    transactions of one or more holdings against the object store, to a depth from
+    object_verify.DEPTHS.  There are separate pools, each of workers threads, for the
+    bucket listings, the partitions of the listings of large buckets, the per-object
+    HEADs and the ranged GETs of the object parts, as the tasks in each pool wait for
+    the tasks they submit to the next.  The client's
+    connection pool is sized to match, so that connections are reused.
+    If a FingerprintStore is given then the audit is incremental: only the objects in
+    the directories whose fingerprints have changed since the previous audit are
+    verified, and the problems found in the other directories are carried over from
+    the previous audit.  The fingerprints are kept until save_fingerprints is
+    called, from the thread that created the store.
+    If a ListingCache is given then the cached listing of a bucket is used, rather
+    than listing it again, and new listings are added to the cache."""
+
+    def __init__(
+        self,
+        workers: int = DEFAULT_WORKERS,
+        depth: str = DEPTH_EXISTENCE,
+        client=None,
+        fingerprints: Optional[FingerprintStore] = None,
+        listings: Optional[ListingCache] = None,
+    ):
+        if workers < 1:
+            raise RuntimeError("Number of workers must be at least 1.")
+        if depth not in DEPTHS:
+            raise RuntimeError(f"Unknown audit depth {depth}, options: {DEPTHS}")
+        self.workers = workers
+        self.depth = depth
+        if client is None:
+            client = connect_to_object_store(pool_size=4 * workers)
+        self.client = client
+        self.listing = ThreadPoolExecutor(max_workers=workers)
+        self.partitions = ThreadPoolExecutor(max_workers=workers)
+        self.objects = ThreadPoolExecutor(max_workers=workers)
+        self.parts = ThreadPoolExecutor(max_workers=workers)
+        self.throughput = Throughput()
+        self.fingerprints = fingerprints
+        self.listings = listings
+        # bucket -> fingerprint record, for the transactions verified since the
+        # fingerprints were last saved
+        self.new_fingerprints = {}
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+
+    def shutdown(self, cancel: bool = False) -> None:
+        for executor in (self.listing, self.partitions, self.objects, self.parts):
+            executor.shutdown(wait=True, cancel_futures=cancel)
+
+    def submit_transactions(self, files: FileTable) -> list[Future]:
+        """Submit the verification of each transaction in the FileTable against the
+        object store.  Each future returns the diff for a transaction, from
+        diff_transaction, with the results of the object verification if the depth
+        is size or checksum."""
+        on_object_storage = files.has_location(OBJECT_STORAGE)
+        by_transaction = files.indices_by_transaction()
+        previous = {}
+        if self.fingerprints is not None:
+            previous = self.fingerprints.get_many(
+                ("nlds." + t for t in by_transaction), self.depth
+            )
+        futures = []
+        for transaction_id, index in by_transaction.items():
+            catalog = dict(zip(files.path[index].tolist(), files.size[index].tolist()))
+            expected = set(files.path[index[on_object_storage[index]]].tolist())
+            futures.append(
+                self.listing.submit(
+                    self._verify,
+                    transaction_id,
+                    catalog,
+                    expected,
+                    previous.get("nlds." + transaction_id),
+                )
+            )
+        return futures
+
+    def save_fingerprints(self) -> None:
+        """Store the fingerprints of the transactions verified since they were last
+        saved."""
+        if self.fingerprints is None or len(self.new_fingerprints) == 0:
+            return
+        with self.lock:
+            new_fingerprints = self.new_fingerprints
+            self.new_fingerprints = {}
+        self.fingerprints.put_many(new_fingerprints)
+
+    def _verify(self, transaction_id, catalog, expected, previous) -> dict:
+        bucket_name = "nlds." + transaction_id
+        etags = None if self.fingerprints is None else {}
+        objects = None
+        if self.listings is not None:
+            objects = self.listings.get(bucket_name, etags)
+        if objects is None:
+            objects = self._list(bucket_name, catalog, etags)
+            if self.listings is not None and objects is not None:
+                self.listings.put(bucket_name, objects, etags)
+        diff = diff_transaction(transaction_id, catalog, expected, objects)
+        if objects is None:
+            return diff
+        if self.fingerprints is None:
+            if self.depth != DEPTH_EXISTENCE:
+                self._verify_objects(bucket_name, catalog, expected, objects, diff)
+            return diff
+
+        # the catalog leaves include whether the file is expected in the bucket, as
+        # that changes the diff as much as its size does
+        catalog_leaves = directory_leaves(
+            (p, f"{size}\0{p in expected}") for p, size in catalog.items()
+        )
+        # the bucket leaves include the ETag, so that an object that has been
+        # rewritten with the same size is verified again
+        bucket_leaves = directory_leaves(
+            (name, f"{size}\0{etags.get(name)}") for name, size in objects.items()
+        )
+        record = {
+            "depth": self.depth,
+            "catalog_root": merkle_root(catalog_leaves),
+            "bucket_root": merkle_root(bucket_leaves),
+            "catalog_leaves": catalog_leaves,
+            "bucket_leaves": bucket_leaves,
+        }
+        changed = None
+        if previous is not None:
+            if (
+                previous["catalog_root"] == record["catalog_root"]
+                and previous["bucket_root"] == record["bucket_root"]
+            ):
+                changed = set()
+            else:
+                changed = changed_directories(
+                    previous["catalog_leaves"], catalog_leaves
+                ) | changed_directories(previous["bucket_leaves"], bucket_leaves)
+        if self.depth != DEPTH_EXISTENCE:
+            self._verify_objects(
+                bucket_name,
+                catalog,
+                expected,
+                objects,
+                diff,
+                directories=changed,
+                previous=None if previous is None else previous["diff"],
+            )
+        diff[FINGERPRINT] = {
+            "catalog": record["catalog_root"],
+            "bucket": record["bucket_root"],
+            "directories": len(catalog_leaves.keys() | bucket_leaves.keys()),
+            "verified_directories": None if changed is None else len(changed),
+        }
+        record["diff"] = diff
+        # an audit that carried over results from the previous audit is as old as
+        # it, so that all the objects are verified again when it expires
+        if previous is not None:
+            record["created"] = previous["created"]
+            # a shallower audit does not replace the fingerprint of a deeper one,
+            # which will still show what has changed since the deeper audit
+            if depth_rank(previous["depth"]) > depth_rank(self.depth):
+                return diff
+        with self.lock:
+            self.new_fingerprints[bucket_name] = record
+        return diff
+
+    def _list(self, bucket_name, catalog, etags) -> Optional[dict[str, int]]:
+        # large buckets are listed in partitions of the catalog's paths, in parallel
+        n_partitions = n_partitions_for(len(catalog), self.workers)
+        if n_partitions > 1:
+            return list_bucket_parallel(
+                self.client,
+                bucket_name,
+                self.partitions,
+                paths=catalog.keys(),
+                n_partitions=n_partitions,
+                etags=etags,
+            )
+        return list_bucket(self.client, bucket_name, etags)
+
+    def _verify_objects(
+        self,
+        bucket_name,
+        catalog,
+        expected,
+        objects,
+        diff,
+        directories: Optional[set] = None,
+        previous: Optional[dict] = None,
+    ) -> None:
+        """Verify each of the expected objects in the bucket listing, replacing the
+        size mismatches from the listing with those from the objects themselves, and
+        adding the checksum mismatches and the unverified objects to the diff.
+        If directories is given then only the objects in those directories are
+        verified, and the problems in the other directories are carried over from
+        the previous diff."""
+        names = sorted(
+            p
+            for p in expected
+            if p in objects
+            and (directories is None or os.path.dirname(p) in directories)
+        )
+        missing = []
+        size_mismatch = []
+        checksum_mismatch = []
+        unverified = []
+        # submit the objects in windows, so that the futures for a bucket with
+        # millions of objects are not all held at once
+        window = 16 * self.workers
+        for start in range(0, len(names), window):
+            futures = [
+                (
+                    p,
+                    self.objects.submit(
+                        verify_object,
+                        self.client,
+                        bucket_name,
+                        p,
+                        catalog[p],
+                        self.depth,
+                        self.parts,
+                        self.throughput,
+                    ),
+                )
+                for p in names[start : start + window]
+            ]
+            for p, future in futures:
+                result = future.result()
+                if result.get("missing"):
+                    missing.append(p)
+                elif "object_size" in result:
+                    size_mismatch.append(
+                        {
+                            MSG.PATH: p,
+                            "catalog_size": catalog[p],
+                            "object_size": result["object_size"],
+                        }
+                    )
+                elif result.get("checksum_mismatch"):
+                    checksum_mismatch.append(p)
+                elif result.get("unverified"):
+                    unverified.append(p)
+        if directories is not None and previous is not None:
+
+            def unchanged(p):
+                return os.path.dirname(p) not in directories
+
+            missing.extend(p for p in previous["missing"] if unchanged(p))
+            size_mismatch.extend(
+                m for m in previous["size_mismatch"] if unchanged(m[MSG.PATH])
+            )
+            checksum_mismatch.extend(
+                p for p in previous.get("checksum_mismatch", []) if unchanged(p)
+            )
+            unverified.extend(p for p in previous.get("unverified", []) if unchanged(p))
+            size_mismatch.sort(key=lambda m: m[MSG.PATH])
+        diff["missing"] = sorted(set(diff["missing"]) | set(missing))
+        diff["size_mismatch"] = size_mismatch
+        if self.depth == DEPTH_CHECKSUM:
+            diff["checksum_mismatch"] = sorted(checksum_mismatch)
+            diff["unverified"] = sorted(unverified)
+
+
+def verify_transactions(
+    files: FileTable,
+    workers: int = DEFAULT_WORKERS,
+    client=None,
+    depth: str = DEPTH_EXISTENCE,
+    fingerprints: Optional[FingerprintStore] = None,
+    listings: Optional[ListingCache] = None,
+) -> tuple[list[dict], dict]:
+    """Verify the files in the FileTable against the object store, to the depth,
+    listing the bucket for each transaction in a pool of worker threads.  Returns
+    the diff for each transaction, from diff_transaction, in transaction_id order,
+    and the throughput of the object verification."""
+    with ObjectStoreVerifier(
+        workers, depth, client, fingerprints, listings
+    ) as verifier:
+        futures = verifier.submit_transactions(files)
+        diffs = [future.result() for future in as_completed(futures)]
+        verifier.save_fingerprints()
+    diffs.sort(key=lambda d: d[MSG.TRANSACT_ID])
+    return diffs, verifier.throughput.as_dict()
+
+
+def audit_result(
+    holding: dict, diffs: list[dict], throughput: Optional[dict] = None
+) -> dict:
+    """Assemble the structured diff for a holding from the diffs of its
+    transactions."""
+    totals = {
+        key: sum(d[key] for d in diffs)
+        for key in ("catalog_files", "expected_objects", "objects")
+    }
+    for key in PROBLEMS:
+        totals[key] = sum(len(d.get(key, [])) for d in diffs)
+    totals["unverified"] = sum(len(d.get("unverified", [])) for d in diffs)
+    totals["missing_buckets"] = sum(1 for d in diffs if not d["bucket_exists"])
+    result = {
+        MSG.HOLDING_ID: holding[MSG.ID],
+        MSG.LABEL: holding[MSG.LABEL],
+        MSG.USER: holding[MSG.USER],
+        MSG.GROUP: holding[MSG.GROUP],
+        "transactions": diffs,
+        "totals": totals,
+    }
+    if throughput is not None:
+        result["throughput"] = throughput
+    return result
+
+
+def has_problems(totals: dict) -> bool:
+    """Whether the totals of an audit show any problems."""
+    return sum(totals.get(key, 0) for key in PROBLEMS) + totals["missing_buckets"] > 0
 
 
 def audit_holding(
@@ -24,7 +437,54 @@ def audit_holding(
     id: Optional[int] = None,
     transaction_id: Optional[str] = None,
     label: Optional[str] = None,
-):
+    workers: int = DEFAULT_WORKERS,
+    depth: str = DEPTH_EXISTENCE,
+    fingerprints: Optional[FingerprintStore] = None,
+    listings: Optional[ListingCache] = None,
+) -> dict:
+    """Audit a holding, comparing the files in the catalog with the objects in the
+    object store, to the depth.  Returns the structured diff:
+    {
+        "holding_id", "label", "user", "group",
+        "transactions": [diff_transaction for each transaction],
+        "totals": {"catalog_files", "expected_objects", "objects", "missing",
+                   "orphaned", "size_mismatch", "checksum_mismatch", "unverified",
+                   "missing_buckets"},
+        "throughput": {"objects", "bytes", "seconds", "objects_per_second",
+                       "mb_per_second"},
+    }
+    """
+    holding = get_holding(rpc_publisher, user, group, id, transaction_id, label)
+    # get the files for all the transactions in the holding in one query, rather
+    # than one query per transaction
+    files, json_response = find_file_table(
+        rpc_publisher=rpc_publisher,
+        user=user,
+        group=group,
+        groupall=False,
+        holding_id=holding[MSG.ID],
+    )
+    if json_response[MSG.DETAILS].get("failure"):
+        raise RuntimeError(json_response[MSG.DETAILS]["failure"])
+    diffs, throughput = verify_transactions(
+        files,
+        workers=workers,
+        depth=depth,
+        fingerprints=fingerprints,
+        listings=listings,
+    )
+    return audit_result(holding, diffs, throughput)
+
+
+def get_holding(
+    rpc_publisher: RabbitMQRPCPublisher,
+    user: str,
+    group: str,
+    id: Optional[int] = None,
+    transaction_id: Optional[str] = None,
+    label: Optional[str] = None,
+) -> dict:
+    """Get the singular holding to audit, with the id, transaction id or label."""
     # need user and group
     if not user:
         raise RuntimeError("User is required to perform an audit.")
@@ -38,7 +498,7 @@ def audit_holding(
             "--id (-i), --transaction_id (-n), --label (-l)"
         )
     # get the singular holding with the id, label or transaction_id
-    ret = list_holdings(
+    json_response = list_holdings(
         rpc_publisher=rpc_publisher,
         user=user,
         group=group,
@@ -47,29 +507,286 @@ def audit_holding(
         holding_id=id,
         transaction_id=transaction_id,
     )
-    # need to deserialise the return
-    json_response = deserialize(ret)
-    # get the (singular) holding and then the transactions
-    holding = json_response[MSG.DATA][MSG.HOLDINGS]
-    transactions = holding[0][MSG.TRANSACTIONS]
-    # for each transaction, get the files in the transaction
-    for t in transactions:
-        ret = find_files(
-            rpc_publisher=rpc_publisher,
-            user=user,
-            group=group,
-            groupall=False,
-            transaction_id=t,
+    if json_response[MSG.DETAILS].get("failure"):
+        raise RuntimeError(json_response[MSG.DETAILS]["failure"])
+    # get the (singular) holding
+    return json_response[MSG.DATA][MSG.HOLDINGS][0]
+
+
+def sample_holding(
+    rpc_publisher: RabbitMQRPCPublisher,
+    user: str,
+    group: str,
+    id: Optional[int] = None,
+    transaction_id: Optional[str] = None,
+    label: Optional[str] = None,
+    sample: Optional[int] = None,
+    confidence: float = DEFAULT_CONFIDENCE,
+    max_defect_rate: Optional[float] = None,
+    workers: int = DEFAULT_WORKERS,
+    depth: str = DEPTH_SIZE,
+    seed: Optional[int] = None,
+    client=None,
+) -> dict:
+    """Audit a uniform random sample of the files of a holding that should be on the
+    object store, and estimate the defect rate of the whole holding.  The sample is
+    drawn from the pages of the find response as they are streamed, so that the
+    files of the holding are never all held at once.  Either sample gives the number
+    of files to sample, or max_defect_rate gives the rate to test for, and the sample
+    is large enough that, if no defects are found, the upper bound on the rate at the
+    confidence level is below it.  Each sampled object is HEADed, and also read and
+    hashed if depth is checksum.  Returns:
+    {
+        "holding_id", "label", "user", "group",
+        "population", "sample", "unverified",
+        "defects": [{"path", "transaction_id", "problem"}],
+        "defect_rate", "confidence", "lower_bound", "upper_bound",
+        "estimated_defects": [lower, upper], "max_defect_rate", "passed",
+        "throughput",
+    }
+    Orphaned objects cannot be found by sampling the catalog."""
+    if sample is None:
+        if max_defect_rate is None:
+            raise RuntimeError(
+                "One of --sample or --max-defect-rate is required to sample a holding."
+            )
+        sample = sample_size(confidence, max_defect_rate)
+    holding = get_holding(rpc_publisher, user, group, id, transaction_id, label)
+
+    reservoir = Reservoir(sample, seed)
+    for response in stream_find_files(
+        rpc_publisher,
+        user=user,
+        group=group,
+        groupall=False,
+        holding_id=holding[MSG.ID],
+    ):
+        if response[MSG.DETAILS].get("failure"):
+            raise RuntimeError(response[MSG.DETAILS]["failure"])
+        files = FileTable.from_response(response)
+        expected = np.flatnonzero(files.has_location(OBJECT_STORAGE))
+        reservoir.add(
+            [
+                (
+                    files.transactions[files.transaction[i]][MSG.TRANSACT_ID],
+                    files.path[i],
+                    int(files.size[i]),
+                )
+                for i in expected
+            ]
         )
-        # need to deserialise the return
-        json_response = deserialize(ret)
-        # get the holding, transactions, files
-        t_holding = json_response[MSG.DATA][MSG.HOLDINGS]
-        # bit of munging to get the first holding (and only, hopefully!)
-        holding = t_holding[list(t_holding.keys())[0]]
-        # get the first and only transaction, using the same munging
-        t_transaction = holding[MSG.TRANSACTIONS]
-        transaction = t_transaction[list(t_transaction.keys())[0]]
-        files = transaction[MSG.FILELIST]
-        for f in files:
-            print(f["original_path"], f["size"])
+
+    # a sampled object is at least HEADed, as there is no bucket listing to check its
+    # existence against
+    if depth == DEPTH_EXISTENCE:
+        depth = DEPTH_SIZE
+    defects = []
+    unverified = 0
+    with ObjectStoreVerifier(workers, depth, client) as verifier:
+        futures = [
+            (
+                transaction_id,
+                path,
+                verifier.objects.submit(
+                    verify_object,
+                    verifier.client,
+                    "nlds." + transaction_id,
+                    path,
+                    size,
+                    depth,
+                    verifier.parts,
+                    verifier.throughput,
+                ),
+            )
+            for transaction_id, path, size in reservoir.items
+        ]
+        for transaction_id, path, future in futures:
+            result = future.result()
+            if len(result) == 0:
+                continue
+            if result.get("unverified"):
+                unverified += 1
+                continue
+            if "object_size" in result:
+                problem = "size_mismatch"
+            else:
+                problem = next(iter(result))
+            defects.append(
+                {MSG.PATH: path, MSG.TRANSACT_ID: transaction_id, "problem": problem}
+            )
+
+    population = reservoir.seen
+    # the objects whose checksum could not be verified are left out of the estimate
+    n = len(reservoir.items) - unverified
+    lower, upper = wilson_interval(len(defects), n, confidence, population)
+    return {
+        MSG.HOLDING_ID: holding[MSG.ID],
+        MSG.LABEL: holding[MSG.LABEL],
+        MSG.USER: holding[MSG.USER],
+        MSG.GROUP: holding[MSG.GROUP],
+        "population": population,
+        "sample": n,
+        "unverified": unverified,
+        "defects": sorted(defects, key=lambda d: d[MSG.PATH]),
+        "defect_rate": len(defects) / n if n > 0 else 0.0,
+        "confidence": confidence,
+        "lower_bound": lower,
+        "upper_bound": upper,
+        "estimated_defects": [
+            math.floor(lower * population),
+            math.ceil(upper * population),
+        ],
+        "max_defect_rate": max_defect_rate,
+        "passed": None if max_defect_rate is None else upper <= max_defect_rate,
+        "throughput": verifier.throughput.as_dict(),
+    }
+
+
+def campaign_holdings(
+    rpc_publisher: RabbitMQRPCPublisher,
+    user: Optional[str] = None,
+    group: Optional[str] = None,
+) -> list[dict]:
+    """List the holdings for an audit campaign: all the holdings of the user and / or
+    group, or all the holdings in the catalog if neither is given.  The holdings are
+    returned in holding id order, so that a campaign proceeds in a stable order."""
+    json_response = list_holdings(
+        rpc_publisher=rpc_publisher,
+        user="nlds",
+        group="**all**",
+        groupall=True,
+        query_user=user,
+        query_group=group,
+    )
+    if json_response[MSG.DETAILS].get("failure"):
+        raise RuntimeError(json_response[MSG.DETAILS]["failure"])
+    holdings = json_response[MSG.DATA][MSG.HOLDINGS]
+    return sorted(holdings, key=lambda h: h[MSG.ID])
+
+
+def audit_campaign(
+    rpc_publisher: RabbitMQRPCPublisher,
+    holdings: list[dict],
+    checkpoint: Checkpoint,
+    workers: int = DEFAULT_WORKERS,
+    concurrency: int = DEFAULT_CAMPAIGN_CONCURRENCY,
+    verifier: Optional[ObjectStoreVerifier] = None,
+) -> Iterator[dict]:
+    """Audit each of the holdings that is not already finished in the checkpoint,
+    yielding the audit of each holding, as from audit_holding, as it finishes.  Each
+    finished audit is recorded in the checkpoint before it is yielded, so that the
+    campaign can be stopped and resumed.
+    The budget for the whole campaign is:
+        concurrency : the number of holdings in progress at once.  The find queries
+                      for the holdings are pipelined on the one RPC connection.
+        workers     : the number of object store buckets listed (and objects
+                      verified) at once, shared between all the holdings in
+                      progress.
+    The verifier sets the depth of the audit, and its throughput is for the whole
+    campaign.
+    """
+    if concurrency < 1:
+        raise RuntimeError("Concurrency must be at least 1.")
+    if verifier is None:
+        verifier = ObjectStoreVerifier(workers)
+    todo = iter([h for h in holdings if str(h[MSG.ID]) not in checkpoint])
+    # holdings whose find query has been sent: (holding, corr_id)
+    finding = deque()
+    # holdings whose buckets are being listed: (holding, futures)
+    verifying = []
+
+    def request_files():
+        while len(finding) + len(verifying) < concurrency:
+            holding = next(todo, None)
+            if holding is None:
+                return
+            msg_dict = _find_message(
+                user="nlds",
+                group="**all**",
+                groupall=True,
+                holding_id=holding[MSG.ID],
+                query_user=holding[MSG.USER],
+                query_group=holding[MSG.GROUP],
+            )
+            corr_id = rpc_publisher.send(msg_dict=msg_dict, routing_key=RK.CATALOG_Q)
+            finding.append((holding, corr_id))
+
+    def finish(holding, futures):
+        try:
+            diffs = sorted(
+                (future.result() for future in futures),
+                key=lambda d: d[MSG.TRANSACT_ID],
+            )
+        except (S3Error, HTTPError, OSError) as e:
+            # as with a catalog failure, the holding is not recorded in the
+            # checkpoint, so that it is retried when the campaign is resumed
+            return {
+                MSG.HOLDING_ID: holding[MSG.ID],
+                MSG.LABEL: holding[MSG.LABEL],
+                MSG.USER: holding[MSG.USER],
+                MSG.GROUP: holding[MSG.GROUP],
+                "failure": f"{type(e).__name__}: {e}",
+            }
+        result = audit_result(holding, diffs)
+        verifier.save_fingerprints()
+        checkpoint.record(str(holding[MSG.ID]), result)
+        return result
+
+    with verifier:
+        try:
+            request_files()
+            while len(finding) > 0 or len(verifying) > 0:
+                # finish the holdings whose buckets have all been listed, and start
+                # the next holdings in their place
+                done = [v for v in verifying if all(f.done() for f in v[1])]
+                for v in done:
+                    verifying.remove(v)
+                    yield finish(*v)
+                    request_files()
+                if len(finding) == 0:
+                    # only wait on the futures still running, as wait returns at
+                    # once if any of the futures given has finished
+                    running = [
+                        f for _, futures in verifying for f in futures if not f.done()
+                    ]
+                    if len(running) > 0:
+                        wait(running, return_when=FIRST_COMPLETED)
+                    continue
+                holding, corr_id = finding.popleft()
+                response = rpc_publisher.receive(corr_id)
+                if response is None:
+                    raise RuntimeError("Catalog service could not be reached in time.")
+                files, response_dict = FileTable.from_body(response)
+                if response_dict[MSG.DETAILS].get("failure"):
+                    # a failed holding is not recorded in the checkpoint, so that it
+                    # is retried when the campaign is resumed
+                    yield {
+                        MSG.HOLDING_ID: holding[MSG.ID],
+                        MSG.LABEL: holding[MSG.LABEL],
+                        MSG.USER: holding[MSG.USER],
+                        MSG.GROUP: holding[MSG.GROUP],
+                        "failure": response_dict[MSG.DETAILS]["failure"],
+                    }
+                else:
+                    verifying.append((holding, verifier.submit_transactions(files)))
+                del files
+                request_files()
+        finally:
+            for _, corr_id in finding:
+                rpc_publisher.discard(corr_id)
+            for _, futures in verifying:
+                for future in futures:
+                    future.cancel()
+
+
+def campaign_totals(checkpoint: Checkpoint) -> dict:
+    """Sum the totals of all the holdings finished in the checkpoint, including those
+    from before the campaign was resumed."""
+    totals = {"holdings": len(checkpoint), "failed_holdings": 0}
+    for result in checkpoint.finished.values():
+        t = result["totals"]
+        if has_problems(t):
+            totals["failed_holdings"] += 1
+        for key, value in t.items():
+            totals[key] = totals.get(key, 0) + value
+    return totals
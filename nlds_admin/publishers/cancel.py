@@ -14,6 +14,7 @@ import uuid
 
 import nlds_admin.rabbit.message_keys as MSG
 import nlds_admin.rabbit.routing_keys as RK
+from nlds_admin.common.deserialize import deserialize
 from nlds_admin.rabbit.rpc_publisher import RabbitMQRPCPublisher
 
 
@@ -53,8 +54,8 @@ def cancel_transaction(
     response = rpc_publisher.call(msg_dict=msg_dict, routing_key=routing_key)
     # Check if response is valid or whether the request timed out
     if response is not None:
-        response = response.decode()
-        return response
+        # parse the byte response directly, without converting to str first
+        return deserialize(response)
     else:
         msg = ("NLDS service could not be reached in time.",)
         raise RuntimeError(msg)
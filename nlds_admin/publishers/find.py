@@ -2,22 +2,31 @@
 """
 find.py
 """
+
 __author__ = "Neil Massey and Jack Leland"
 __date__ = "24 Feb 2025"
 __copyright__ = "Copyright 2025 United Kingdom Research and Innovation"
 __license__ = "BSD - see LICENSE file in top-level package directory"
 __contact__ = "neil.massey@stfc.ac.uk"
 
-from typing import Optional
+from typing import Iterator, Optional
 
 import nlds_admin.rabbit.message_keys as MSG
 import nlds_admin.rabbit.routing_keys as RK
 from nlds_admin.publishers.process_tag import process_tag
+from nlds_admin.common.deserialize import deserialize
+from nlds_admin.common.cache import ResponseCache
+from nlds_admin.common.file_table import FileTable
+from nlds_admin.common.summary import FileSummary, BY_HOLDING
 
 from nlds_admin.rabbit.rpc_publisher import RabbitMQRPCPublisher
 
-def find_files(
-    rpc_publisher: RabbitMQRPCPublisher,
+# default initial page size and reply size budget for stream_find_files
+DEFAULT_PAGE_SIZE = 10000
+DEFAULT_MAX_PAGE_BYTES = 8 * 1024 * 1024
+
+
+def _find_message(
     user: str,
     group: str,
     groupall: Optional[bool] = False,
@@ -29,8 +38,10 @@ def find_files(
     query_user: Optional[str] = None,
     query_group: Optional[str] = None,
     limit: Optional[int] = None,
+    offset: Optional[int] = None,
     descending: Optional[bool] = False,
-):
+) -> dict:
+    """Assemble the message for the catalog find."""
     # create the message dictionary
     api_action = f"{RK.FIND}"
     msg_dict = {
@@ -70,19 +81,196 @@ def find_files(
         msg_dict[MSG.DETAILS][MSG.PATH] = path
     if limit:
         meta_dict[MSG.LIMIT] = limit
+    if offset:
+        meta_dict[MSG.OFFSET] = offset
     if descending:
         meta_dict[MSG.DESCENDING] = descending
     if len(meta_dict) > 0:
         msg_dict[MSG.META] = meta_dict
+    return msg_dict
+
+
+def find_files(
+    rpc_publisher: RabbitMQRPCPublisher,
+    user: str,
+    group: str,
+    groupall: Optional[bool] = False,
+    label: Optional[str] = None,
+    holding_id: Optional[int] = None,
+    transaction_id: Optional[str] = None,
+    path: Optional[str] = None,
+    tag: Optional[str] = None,
+    query_user: Optional[str] = None,
+    query_group: Optional[str] = None,
+    limit: Optional[int] = None,
+    offset: Optional[int] = None,
+    descending: Optional[bool] = False,
+    cache: Optional[ResponseCache] = None,
+):
+    msg_dict = _find_message(
+        user=user,
+        group=group,
+        groupall=groupall,
+        label=label,
+        holding_id=holding_id,
+        transaction_id=transaction_id,
+        path=path,
+        tag=tag,
+        query_user=query_user,
+        query_group=query_group,
+        limit=limit,
+        offset=offset,
+        descending=descending,
+    )
+
+    # return the cached response, if there is one
+    if cache is not None:
+        cache_key = cache.key(RK.FIND, msg_dict)
+        cached_response = cache.get(cache_key, RK.FIND)
+        if cached_response is not None:
+            return cached_response
 
     # call RPC function
     routing_key = f"{RK.CATALOG_Q}"
     response = rpc_publisher.call(msg_dict=msg_dict, routing_key=routing_key)
     # Check if response is valid or whether the request timed out
     if response is not None:
-        # convert byte response to str
-        response = response.decode()
-        return response
+        # parse the byte response directly, without converting to str first
+        response_dict = deserialize(response)
+        if cache is not None:
+            cache.put(cache_key, RK.FIND, response, response_dict)
+        return response_dict
     else:
         msg="Catalog service could not be reached in time."
-        raise RuntimeError(msg)
\ No newline at end of file
+        raise RuntimeError(msg)
+
+
+def find_file_table(
+    rpc_publisher: RabbitMQRPCPublisher,
+    user: str,
+    group: str,
+    **find_kwargs,
+) -> tuple[FileTable, dict]:
+    """Find the files that match the query and build a FileTable from the response as
+    it is parsed, so that the whole response is never held as dictionaries.  Returns
+    the table and the response, without the filelists of its transactions.  The
+    find_kwargs are as for find_files, except for the cache."""
+    msg_dict = _find_message(user=user, group=group, **find_kwargs)
+    response = rpc_publisher.call(msg_dict=msg_dict, routing_key=RK.CATALOG_Q)
+    if response is None:
+        msg = "Catalog service could not be reached in time."
+        raise RuntimeError(msg)
+    return FileTable.from_body(response)
+
+
+def count_files(response: dict) -> int:
+    """Count the files in a (deserialized) find_files response."""
+    return sum(
+        len(t[MSG.FILELIST])
+        for h in response[MSG.DATA][MSG.HOLDINGS].values()
+        for t in h[MSG.TRANSACTIONS].values()
+    )
+
+
+def _first_file(response: dict):
+    for h in response[MSG.DATA][MSG.HOLDINGS].values():
+        for tkey, t in h[MSG.TRANSACTIONS].items():
+            if len(t[MSG.FILELIST]) > 0:
+                return tkey, t[MSG.FILELIST][0]["original_path"]
+    return None
+
+
+def stream_find_files(
+    rpc_publisher: RabbitMQRPCPublisher,
+    user: str,
+    group: str,
+    page_size: int = DEFAULT_PAGE_SIZE,
+    max_page_bytes: int = DEFAULT_MAX_PAGE_BYTES,
+    limit: Optional[int] = None,
+    offset: Optional[int] = None,
+    **find_kwargs,
+) -> Iterator[dict]:
+    """Page through the files that match the query, using the offset into the
+    catalog's results, and yield the (deserialized) response for each page as it
+    arrives.  limit caps the total number of files.  page_size is the size of the
+    first page; the size of the later pages adapts to the size of the replies, so
+    that each reply is under max_page_bytes.  The other find_kwargs are as for
+    find_files."""
+    if page_size < 1:
+        raise RuntimeError("Page size must be at least 1.")
+
+    next_offset = offset or 0
+    remaining = limit
+    previous_first = None
+    while remaining is None or remaining > 0:
+        size = page_size if remaining is None else min(page_size, remaining)
+        msg_dict = _find_message(
+            user=user, group=group, limit=size, offset=next_offset, **find_kwargs
+        )
+        response = rpc_publisher.call(msg_dict=msg_dict, routing_key=RK.CATALOG_Q)
+        if response is None:
+            msg = "Catalog service could not be reached in time."
+            raise RuntimeError(msg)
+        response_dict = deserialize(response)
+        details = response_dict[MSG.DETAILS]
+        if details.get("failure"):
+            yield response_dict
+            return
+        n_files = count_files(response_dict)
+        # a catalog that ignores the offset would return the same page forever
+        first = _first_file(response_dict)
+        if first is not None and first == previous_first:
+            raise RuntimeError(
+                "Catalog returned the same page twice, it may not support paging "
+                "find with an offset."
+            )
+        previous_first = first
+
+        yield response_dict
+        if n_files < size:
+            return
+        next_offset += n_files
+        if remaining is not None:
+            remaining -= n_files
+        # adapt the page size to the bytes per file of this reply, growing by at most
+        # a factor of two each page
+        bytes_per_file = len(response) / n_files
+        page_size = max(1, min(2 * page_size, int(max_page_bytes / bytes_per_file)))
+
+
+def summarise_files(
+    rpc_publisher: RabbitMQRPCPublisher,
+    user: str,
+    group: str,
+    group_by: str = BY_HOLDING,
+    paged: bool = False,
+    page_size: int = DEFAULT_PAGE_SIZE,
+    max_page_bytes: int = DEFAULT_MAX_PAGE_BYTES,
+    **find_kwargs,
+) -> FileSummary:
+    """Find the files that match the query and aggregate them into a FileSummary,
+    grouped by group_by.  If paged is True then the files are fetched with
+    stream_find_files, and each page is added to the summary and released as it
+    arrives.  The other find_kwargs are as for find_files."""
+    summary = FileSummary(group_by)
+    if paged:
+        pages = stream_find_files(
+            rpc_publisher=rpc_publisher,
+            user=user,
+            group=group,
+            page_size=page_size,
+            max_page_bytes=max_page_bytes,
+            **find_kwargs,
+        )
+    else:
+        pages = [
+            find_files(
+                rpc_publisher=rpc_publisher, user=user, group=group, **find_kwargs
+            )
+        ]
+    for page in pages:
+        details = page[MSG.DETAILS]
+        if details.get("failure"):
+            raise RuntimeError(details["failure"])
+        summary.add(FileTable.from_response(page))
+    return summary
@@ -9,34 +9,72 @@ __copyright__ = "Copyright 2026 United Kingdom Research and Innovation"
 __license__ = "BSD - see LICENSE file in top-level package directory"
 __contact__ = "neil.massey@stfc.ac.uk"
 
-from typing import Optional
+import json
+import os
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Executor, ThreadPoolExecutor, wait
+from datetime import datetime, timedelta
+from typing import Iterator, Optional
+
+from minio.error import S3Error
+from pika.exceptions import NackError, UnroutableError
+from urllib3.exceptions import HTTPError
+
 from nlds_admin.rabbit.rpc_publisher import RabbitMQRPCPublisher
-from nlds_admin.publishers.status import get_request_status
-from nlds_admin.publishers.find import find_files
-from nlds_admin.common.deserialize import deserialize
+from nlds_admin.publishers.status import get_request_status, stream_request_status
+from nlds_admin.publishers.find import find_file_table, _find_message
 from nlds_admin.rabbit import routing_keys as RK
 from nlds_admin.rabbit import message_keys as MSG
 from nlds_admin.rabbit.state import State
 from nlds_admin.common.connect import connect_to_object_store
+from nlds_admin.common.object_listing import (
+    ListingCache,
+    invalidate_listings,
+    list_bucket,
+    list_bucket_parallel,
+    n_partitions_for,
+)
 from nlds_admin.rabbit.publisher import RabbitMQPublisher
 from nlds_admin.common.bcolors import bcolors
 import nlds_admin.common.config as CFG
 from nlds_admin.common.create_sub_id import create_sub_id
+from nlds_admin.common.compact_filelist import file_details, pack_filelist
+from nlds_admin.common.file_table import FileTable, OBJECT_STORAGE
 
+# the number of partitions of a large bucket to list at once
+DEFAULT_LIST_WORKERS = 8
+# the states that fix-status can fix
+FIXABLE_STATES = ("TRANSFER_PUTTING", "CATALOG_PUTTING")
 
-def file_has_object_storage_location(file: dict) -> bool:
-    storage_locations = file["locations"]
-    # quick exit on no storage locations
-    if len(storage_locations) == 0:
-        return False
-
-    # now check that one is OBJECT STORAGE or TAPE
-    for l in storage_locations:
-        if l["storage_type"] == "OBJECT_STORAGE":
-            return True
-        if l["storage_type"] == "TAPE":
-            continue
-    return False
+# A fix-status plan is the JSON of the messages to send to fix a transaction, so
+# that the fix can be reviewed before it is applied:
+# {
+#     "plan_version": 1, "created", "user", "group", "transaction_id",
+#     "api_action", "state", "complete_files",
+#     "actions": [{"action", "sub_id", "filelist" (not for monitor_complete)}]
+# }
+PLAN_VERSION = "plan_version"
+# the plans for several transactions are written as {"plans": [...]}
+PLAN_LIST = "plans"
+PLAN_ACTIONS = "actions"
+PLAN_ACTION = "action"
+CATALOG_UPDATE = "catalog_update"
+CATALOG_DELETE = "catalog_delete"
+MONITOR_COMPLETE = "monitor_complete"
+# the number of messages to send between servicing the connection's events
+DEFAULT_APPLY_BATCH = 100
+# the limits on the filelist in each catalog update or delete message, so that the
+# messages stay well under the broker's limits, and each can be processed by the
+# catalog within the consumer timeout.  A larger filelist is sent in chunks.
+DEFAULT_CHUNK_FILES = 1000
+DEFAULT_CHUNK_BYTES = 4 * 1024 * 1024
+# the estimated size of the entry for a file in a catalog message, other than its
+# path, which is in the entry twice
+FILE_ENTRY_OVERHEAD = 512
+# the number of stuck transactions to fix at once
+DEFAULT_STUCK_CONCURRENCY = 4
+# the units of the age of a stuck transaction, e.g. "6h"
+_AGE_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
 
 
 def get_incomplete_sub_ids(
@@ -48,15 +86,13 @@ def get_incomplete_sub_ids(
     transaction_id: str,
 ) -> tuple[list[str], str]:
     # first get a json representation of the requested transaction
-    trans_stat = get_request_status(
+    trans_response = get_request_status(
         rpc_publisher=rpc_publisher,
         user=user,
         group=group,
         id=id,
         transaction_id=transaction_id,
     )
-    # requires deserializing (decompressing)
-    trans_response = deserialize(trans_stat)
     # get the transaction records
     trans_records = trans_response[MSG.DATA][MSG.RECORD_LIST]
     # loop over the record list and the sub records below
@@ -93,48 +129,94 @@ def get_complete_and_incomplete_files(
 ) -> list[str]:
     # now get the files for the transaction - we need to use the transaction id
     # this may be None if the numeric id was used
-    trans_files = find_files(
+    files, _ = find_file_table(
         rpc_publisher=rpc_publisher,
         user=user,
         group=group,
         transaction_id=transaction_id,
     )
-    incomplete_files = []
-    complete_files = []
-    file_response = deserialize(trans_files)
-    # there is a holding, then a transaction in the DATA section
-    file_data = file_response[MSG.DATA]
-    for h in file_data[MSG.HOLDINGS]:
-        holding = file_data[MSG.HOLDINGS][h]
-        for tr in holding[MSG.TRANSACTIONS]:
-            if tr == transaction_id:
-                files = holding[MSG.TRANSACTIONS][tr][MSG.FILELIST]
-                for f in files:
-                    # check the file has a storage location
-                    if file_has_object_storage_location(f):
-                        complete_files.append(f["original_path"])
-                    else:
-                        incomplete_files.append(f["original_path"])
+    return split_files(files, transaction_id)
+
+
+def split_files(files: FileTable, transaction_id: str) -> tuple[list[str], list[str]]:
+    """Split the files in the transaction into those that are complete and those
+    that are incomplete."""
+    # the files are complete if they have an object storage location
+    in_transaction = files.in_transaction(transaction_id)
+    on_object_storage = files.has_location(OBJECT_STORAGE)
+    complete_files = files.path[in_transaction & on_object_storage].tolist()
+    incomplete_files = files.path[in_transaction & ~on_object_storage].tolist()
     return complete_files, incomplete_files
 
 
-def check_for_files_on_object_store(
+def get_uploaded_files(
     transaction_id: str,
-    search_files: list[str],
-) -> tuple[list[str], list[str]]:
-    mc = connect_to_object_store()
-    uploaded_files = []
-    missing_files = []
+    client=None,
+    paths: Optional[list[str]] = None,
+    workers: int = DEFAULT_LIST_WORKERS,
+    executor: Optional[Executor] = None,
+    listings: Optional[ListingCache] = None,
+) -> set[str]:
+    """List the bucket for the transaction once, returning the set of the object
+    names.  A bucket that does not exist raises a RuntimeError, rather than being
+    taken as having no objects, as every file in the transaction would then be
+    planned for deletion from the catalog.  If the paths of the files
+    in the transaction are given, and there are many of them, then the bucket is
+    listed in partitions of the paths, with up to workers partitions at once.
+    If the executor is given then all of the listing is done in it, so that the
+    listings of several transactions at once share its workers.  If the ListingCache
+    is given then a cached listing of the bucket is used, if there is one."""
     # nlds bucket is "nlds."+transaction_id
     bucket_name = "nlds." + transaction_id
-    # stat the object to see if it exists
-    result = mc.list_objects(bucket_name, recursive=True)
-    uploaded_files = [r.object_name for r in result]
-    set_of_uploaded = set(uploaded_files)
-    set_of_search = set(search_files)
-    # Get the list of files that is not on object store
-    missing_files = list(set_of_search - set_of_uploaded)
-    return uploaded_files, missing_files
+    if listings is not None:
+        objects = listings.get(bucket_name)
+        if objects is not None:
+            return set(objects)
+    if client is None:
+        client = connect_to_object_store(pool_size=workers)
+    n_partitions = n_partitions_for(len(paths or []), workers)
+    if executor is not None:
+        if n_partitions > 1:
+            objects = list_bucket_parallel(
+                client, bucket_name, executor, paths=paths, n_partitions=n_partitions
+            )
+        else:
+            objects = executor.submit(list_bucket, client, bucket_name).result()
+    elif n_partitions > 1:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            objects = list_bucket_parallel(
+                client, bucket_name, executor, paths=paths, n_partitions=n_partitions
+            )
+    else:
+        objects = list_bucket(client, bucket_name)
+    if objects is None:
+        # a missing bucket is more likely to be the wrong tenancy or configuration
+        # than evidence that the files are gone
+        raise RuntimeError(
+            f"Bucket {bucket_name} for transaction {transaction_id} does not exist "
+            "on the object store."
+        )
+    if listings is not None:
+        listings.put(bucket_name, objects)
+    return set(objects)
+
+
+def classify_files(
+    complete_files: list[str],
+    incomplete_files: list[str],
+    uploaded_files: set[str],
+) -> tuple[list[str], list[str], list[str]]:
+    """Classify the files of a transaction against the set of objects in its bucket,
+    keeping the order of the files.  Returns:
+        complete_files   : marked complete, and on the object store
+        incomplete_files : not marked complete, but on the object store
+        missing_files    : not on the object store, whether marked complete or not
+    """
+    missing_files = [f for f in complete_files if f not in uploaded_files]
+    missing_files.extend(f for f in incomplete_files if f not in uploaded_files)
+    complete_files = [f for f in complete_files if f in uploaded_files]
+    incomplete_files = [f for f in incomplete_files if f in uploaded_files]
+    return complete_files, incomplete_files, missing_files
 
 
 def send_monitor_complete_message(
@@ -145,16 +227,38 @@ def send_monitor_complete_message(
     sub_id: str,
     api_action: str,
 ) -> None:
+    send_monitor_state_message(
+        rabbit_publisher=rabbit_publisher,
+        user=user,
+        group=group,
+        transaction_id=transaction_id,
+        sub_id=sub_id,
+        api_action=api_action,
+        state=State.COMPLETE,
+    )
+
+
+def send_monitor_state_message(
+    rabbit_publisher: RabbitMQPublisher,
+    user: str,
+    group: str,
+    transaction_id: str,
+    sub_id: str,
+    api_action: str,
+    state: State,
+) -> None:
+    """Set the state of the sub record in the monitor, creating the sub record if it
+    does not exist."""
     msg_dict = {
         MSG.DETAILS: {
             MSG.TRANSACT_ID: transaction_id,
             # for the root message, the sub_id is the transaction_id
             MSG.SUB_ID: sub_id,
             MSG.API_ACTION: api_action,
-            MSG.JOB_LABEL: "monitor-complete",
+            MSG.JOB_LABEL: f"monitor-{state.name.lower().replace('_', '-')}",
             MSG.USER: user,
             MSG.GROUP: group,
-            MSG.STATE: State.COMPLETE.value,
+            MSG.STATE: state.value,
             MSG.ROUTE: "NLDS_ADMIN",
         },
         MSG.DATA: {
@@ -180,13 +284,15 @@ def send_catalog_update_message(
     sub_id: str,
     api_action: str,
     filelist: list[str],
+    compact: bool = False,
 ) -> None:
     """This sends an update message to the catalog for the files that have been
     uploaded to the object storage but not flagged as such in the database.
     The message requires the tenancy, bucket and original path for each file.
     The tenancy is in the config.
     The bucket is nlds.+the transaction id.
-    The original path is in the filelist"""
+    The original path is in the filelist.
+    If compact is True then the filelist is sent in the compact encoding."""
     config = CFG.load_config()
     tenancy = config["cronjob_publisher"]["tenancy"]
     bucket = "nlds." + transaction_id
@@ -195,19 +301,7 @@ def send_catalog_update_message(
     json_filelist = []
     for f in filelist:
         fj = {
-            "file_details": {
-                "original_path": f,
-                "path_type": 0,  # zero is FILE type
-                "link_path": None,
-                "size": 0,
-                "user": 0,
-                "group": 0,
-                "permissions": 0,
-                "mode": 0,
-                "access_time": 0.0,
-                "failure_reason": None,
-                "holding_id": 0,
-            },
+            "file_details": file_details(f),
             "storage_locations": {
                 "OBJECT_STORAGE": {
                     "storage_type": "OBJECT_STORAGE",
@@ -235,7 +329,7 @@ def send_catalog_update_message(
             MSG.ROUTE: "NLDS_ADMIN",
         },
         MSG.DATA: {
-            MSG.FILELIST: json_filelist,
+            MSG.FILELIST: pack_filelist(json_filelist, compact),
         },
         MSG.META: {
             # Insert an empty meta dict
@@ -258,25 +352,12 @@ def send_catalog_delete_message(
     sub_id: str,
     api_action: str,
     filelist: list[str],
+    compact: bool = False,
 ):
     json_filelist = []
     for f in filelist:
         failure_reason = f"Object with path {f} could not be found on object store."
-        fj = {
-            "file_details": {
-                "original_path": f,
-                "path_type": 0,  # zero is FILE type
-                "link_path": None,
-                "size": 0,
-                "user": 0,
-                "group": 0,
-                "permissions": 0,
-                "mode": 0,
-                "access_time": 0.0,
-                "failure_reason": failure_reason,
-                "holding_id": 0,
-            }
-        }
+        fj = {"file_details": file_details(f, failure_reason=failure_reason)}
         json_filelist.append(fj)
 
     msg_dict = {
@@ -292,7 +373,7 @@ def send_catalog_delete_message(
             MSG.ROUTE: "NLDS_ADMIN",
         },
         MSG.DATA: {
-            MSG.FILELIST: json_filelist,
+            MSG.FILELIST: pack_filelist(json_filelist, compact),
         },
         MSG.META: {
             # Insert an empty meta dict
@@ -307,18 +388,22 @@ def send_catalog_delete_message(
     )
 
 
-def fix_transfer_putting(
+def plan_transfer_putting(
     rpc_publisher: RabbitMQRPCPublisher,
-    rabbit_publisher: RabbitMQPublisher,
     user: str,
     group: str,
-    transaction_id: list[str,],
+    transaction_id: str,
     incomplete_sub_ids: list[str],
     api_action: str,
-) -> None:
+    state: str = "TRANSFER_PUTTING",
+    max_files: int = DEFAULT_CHUNK_FILES,
+    max_bytes: int = DEFAULT_CHUNK_BYTES,
+    listings: Optional[ListingCache] = None,
+) -> dict:
     """
-    Fix the status of files that have errored in transfer.
-    Also check that they are actually on the object store before committing any changes.
+    Plan the fix of the status of files that have errored in transfer, by checking
+    whether they are actually on the object store.  Nothing is changed: the plan is
+    the list of the messages to send to fix the transaction, which apply_plan sends.
     Four cases:
     1.  The files are marked as complete (have object store record) and are present on
         the object store - just send a complete message to the monitor but do nothing
@@ -337,116 +422,318 @@ def fix_transfer_putting(
         group=group,
         transaction_id=transaction_id,
     )
-    # check whether the "complete_files" are on the object store
-    _, missing_complete_files = check_for_files_on_object_store(
-        transaction_id,
-        complete_files,
+    # list the bucket once, and check both the "complete_files" and the
+    # "incomplete_files" against it
+    uploaded_files = get_uploaded_files(
+        transaction_id, paths=complete_files + incomplete_files, listings=listings
+    )
+    return build_plan(
+        user=user,
+        group=group,
+        transaction_id=transaction_id,
+        api_action=api_action,
+        state=state,
+        incomplete_sub_ids=incomplete_sub_ids,
+        complete_files=complete_files,
+        incomplete_files=incomplete_files,
+        uploaded_files=uploaded_files,
+        max_files=max_files,
+        max_bytes=max_bytes,
     )
-    # remove missing_files from the complete files
-    for m in missing_complete_files:
-        complete_files.remove(m)
 
-    # check whether the "incomplete_files" are on the object store
-    _, missing_incomplete_files = check_for_files_on_object_store(
-        transaction_id,
-        incomplete_files,
+
+def chunk_filelist(
+    filelist: list[str],
+    max_files: int = DEFAULT_CHUNK_FILES,
+    max_bytes: int = DEFAULT_CHUNK_BYTES,
+) -> list[list[str]]:
+    """Split the filelist into chunks of at most max_files files, and at most about
+    max_bytes in a catalog message, estimated from the length of the paths.  A file
+    whose entry is larger than max_bytes has a chunk to itself."""
+    if max_files < 1:
+        raise RuntimeError("Chunk size must be at least 1 file.")
+    chunks = []
+    chunk = []
+    chunk_bytes = 0
+    for f in filelist:
+        entry_bytes = FILE_ENTRY_OVERHEAD + 2 * len(f.encode())
+        if len(chunk) > 0 and (
+            len(chunk) >= max_files or chunk_bytes + entry_bytes > max_bytes
+        ):
+            chunks.append(chunk)
+            chunk = []
+            chunk_bytes = 0
+        chunk.append(f)
+        chunk_bytes += entry_bytes
+    if len(chunk) > 0:
+        chunks.append(chunk)
+    return chunks
+
+
+def build_plan(
+    user: str,
+    group: str,
+    transaction_id: str,
+    api_action: str,
+    state: str,
+    incomplete_sub_ids: list[str],
+    complete_files: list[str],
+    incomplete_files: list[str],
+    uploaded_files: set[str],
+    max_files: int = DEFAULT_CHUNK_FILES,
+    max_bytes: int = DEFAULT_CHUNK_BYTES,
+) -> dict:
+    """Build the plan to fix a transaction from its files in the catalog and the
+    objects in its bucket.  The files to update or delete in the catalog are split
+    into chunks with chunk_filelist, with an action, and a sub id, for each chunk."""
+    complete_files, incomplete_files, missing_files = classify_files(
+        complete_files, incomplete_files, uploaded_files
     )
-    # remove missing_files from the incomplete files
-    for m in missing_incomplete_files:
-        incomplete_files.remove(m)
-    # munge both missing lists together
-    missing_files = missing_complete_files
-    missing_files.extend(missing_incomplete_files)
-
-    # do incomplete files first
-    if len(incomplete_files) != 0:
-        # these files are incomplete - they are present on the object storage, but do
-        # not have the correct entry in the database
+    actions = []
+    # do incomplete files first - they are present on the object storage, but do not
+    # have the correct entry in the database
+    for chunk in chunk_filelist(incomplete_files, max_files, max_bytes):
+        actions.append(
+            {
+                PLAN_ACTION: CATALOG_UPDATE,
+                MSG.SUB_ID: str(create_sub_id(filelist=chunk)),
+                MSG.FILELIST: chunk,
+            }
+        )
+    # files that have database entries, but are missing from the object store, are
+    # marked as a failed upload
+    for chunk in chunk_filelist(missing_files, max_files, max_bytes):
+        actions.append(
+            {
+                PLAN_ACTION: CATALOG_DELETE,
+                MSG.SUB_ID: str(create_sub_id(filelist=chunk)),
+                MSG.FILELIST: chunk,
+            }
+        )
+    # the sub ids can then be marked as finished in the monitor
+    for sid in incomplete_sub_ids:
+        actions.append({PLAN_ACTION: MONITOR_COMPLETE, MSG.SUB_ID: sid})
+
+    return {
+        PLAN_VERSION: 1,
+        "created": datetime.now().isoformat(),
+        MSG.USER: user,
+        MSG.GROUP: group,
+        MSG.TRANSACT_ID: transaction_id,
+        MSG.API_ACTION: api_action,
+        MSG.STATE: state,
+        "complete_files": len(complete_files),
+        PLAN_ACTIONS: actions,
+    }
+
+
+def apply_plan(
+    rabbit_publisher: RabbitMQPublisher,
+    plan: dict,
+    compact: bool = False,
+    batch_size: int = DEFAULT_APPLY_BATCH,
+    actions: Optional[list[dict]] = None,
+) -> list[dict]:
+    """Send the messages in a plan from plan_transfer_putting, or only the given
+    actions of the plan.  The publisher's channel is in confirm mode, so each message
+    is confirmed by the broker as it is sent.  The connection's events are processed
+    between each batch of batch_size messages, so that the heartbeats are serviced
+    during a long plan.  The sub record for each chunk of a catalog update or delete
+    is created in the monitor before the chunk is sent to the catalog, so that the
+    transaction is not complete until all of its chunks are.  Returns the outcome of each action:
+        {"transaction_id", "action", "sub_id", "files", "status": "sent" | "failed",
+         "error"}
+    An action that fails does not stop the others from being sent."""
+    if plan.get(PLAN_VERSION) != 1:
+        raise RuntimeError(f"Unknown fix-status plan version {plan.get(PLAN_VERSION)}")
+    if actions is None:
+        actions = plan[PLAN_ACTIONS]
+    common = {
+        "rabbit_publisher": rabbit_publisher,
+        "user": plan[MSG.USER],
+        "group": plan[MSG.GROUP],
+        "transaction_id": plan[MSG.TRANSACT_ID],
+        "api_action": plan[MSG.API_ACTION],
+    }
+    outcomes = []
+    for n, action in enumerate(actions):
+        outcome = {
+            MSG.TRANSACT_ID: plan[MSG.TRANSACT_ID],
+            PLAN_ACTION: action[PLAN_ACTION],
+            MSG.SUB_ID: action[MSG.SUB_ID],
+            "files": len(action.get(MSG.FILELIST, [])),
+            "status": "sent",
+            "error": None,
+        }
+        # whether the sub record for a chunk has been created in the monitor
+        registered = False
+        try:
+            match action[PLAN_ACTION]:
+                case "catalog_update":
+                    send_monitor_state_message(
+                        sub_id=action[MSG.SUB_ID],
+                        state=State.CATALOG_UPDATING,
+                        **common,
+                    )
+                    registered = True
+                    send_catalog_update_message(
+                        sub_id=action[MSG.SUB_ID],
+                        filelist=action[MSG.FILELIST],
+                        compact=compact,
+                        **common,
+                    )
+                case "catalog_delete":
+                    send_monitor_state_message(
+                        sub_id=action[MSG.SUB_ID],
+                        state=State.CATALOG_DELETING,
+                        **common,
+                    )
+                    registered = True
+                    send_catalog_delete_message(
+                        sub_id=action[MSG.SUB_ID],
+                        filelist=action[MSG.FILELIST],
+                        compact=compact,
+                        **common,
+                    )
+                case "monitor_complete":
+                    send_monitor_complete_message(sub_id=action[MSG.SUB_ID], **common)
+                case _:
+                    raise RuntimeError(f"Unknown action {action[PLAN_ACTION]}")
+        except (UnroutableError, NackError, RuntimeError) as e:
+            outcome["status"] = "failed"
+            outcome["error"] = f"{type(e).__name__}: {e}"
+            # the chunk will not be processed by the catalog, so its sub record must
+            # not be left waiting for it
+            if registered:
+                try:
+                    send_monitor_state_message(
+                        sub_id=action[MSG.SUB_ID], state=State.FAILED, **common
+                    )
+                except (UnroutableError, NackError):
+                    pass
+        outcomes.append(outcome)
+        if (n + 1) % batch_size == 0:
+            rabbit_publisher.connection.process_data_events(time_limit=0)
+    # the cached listing of the bucket is stale once the catalog has been changed
+    if any(a[PLAN_ACTION] in (CATALOG_UPDATE, CATALOG_DELETE) for a in actions):
+        invalidate_listings(["nlds." + plan[MSG.TRANSACT_ID]])
+    return outcomes
+
+
+def write_plan(plan: dict, plan_file: str) -> None:
+    """Write the plan to the file as JSON, atomically, so that a partly written plan
+    is never applied."""
+    tmp_file = plan_file + ".tmp"
+    with open(tmp_file, "w") as fh:
+        json.dump(plan, fh, indent=1)
+    os.replace(tmp_file, plan_file)
+
+
+def read_plans(plan_file: str) -> list[dict]:
+    """Read the plans from a file written by write_plan, which holds either a single
+    plan, or the plans for several transactions as {"plans": [...]}."""
+    try:
+        with open(plan_file) as fh:
+            plan = json.load(fh)
+    except (OSError, json.JSONDecodeError) as e:
+        raise RuntimeError(f"Could not read fix-status plan {plan_file}: {e}")
+    if PLAN_LIST in plan:
+        return plan[PLAN_LIST]
+    return [plan]
+
+
+def confirm_fix(message: str, question: str = "Do you wish to fix them") -> bool:
+    print(bcolors.RED + message + f"\n{question}: Y/N ?" + bcolors.ENDC)
+    return input().lower() == "y"
+
+
+def fix_transfer_putting(
+    rpc_publisher: RabbitMQRPCPublisher,
+    user: str,
+    group: str,
+    transaction_id: str,
+    incomplete_sub_ids: list[str],
+    api_action: str,
+    compact: bool = False,
+    max_files: int = DEFAULT_CHUNK_FILES,
+    max_bytes: int = DEFAULT_CHUNK_BYTES,
+    listings: Optional[ListingCache] = None,
+) -> list[dict]:
+    """Plan the fix of a transaction stuck in TRANSFER_PUTTING, ask whether to send
+    each kind of message in the plan, then send those that were confirmed.  The
+    connection to publish the messages is only opened after the questions have been
+    answered, so that it does not sit idle while they are."""
+    plan = plan_transfer_putting(
+        rpc_publisher=rpc_publisher,
+        user=user,
+        group=group,
+        transaction_id=transaction_id,
+        incomplete_sub_ids=incomplete_sub_ids,
+        api_action=api_action,
+        max_files=max_files,
+        max_bytes=max_bytes,
+        listings=listings,
+    )
+    by_action = {CATALOG_UPDATE: [], CATALOG_DELETE: [], MONITOR_COMPLETE: []}
+    for action in plan[PLAN_ACTIONS]:
+        by_action[action[PLAN_ACTION]].append(action)
+
+    confirmed = []
+    update_actions = by_action[CATALOG_UPDATE]
+    if len(update_actions) > 0:
         print(
             bcolors.GREEN
             + "    Incomplete files, on object store but not updated in database:"
             + bcolors.ENDC
         )
-        for f in incomplete_files:
-            print(f"        {f}")
-        print(
-            bcolors.RED
-            + "Files have been found that are uploaded to the object store but do "
-            "not have complete database records.\n"
-            "Do you wish to fix them: Y/N ?" + bcolors.ENDC
-        )
-        user_response = input().lower()
-        if user_response == "y":
-            send_catalog_update_message(
-                rabbit_publisher=rabbit_publisher,
-                user=user,
-                group=group,
-                transaction_id=transaction_id,
-                # use the first sub id for the monitoring - complete the other
-                # sub records below
-                sub_id=str(create_sub_id(filelist=incomplete_files)),
-                api_action=api_action,
-                filelist=incomplete_files,
-            )
+        for action in update_actions:
+            for f in action[MSG.FILELIST]:
+                print(f"        {f}")
+        if confirm_fix(
+            "Files have been found that are uploaded to the object store but do not "
+            f"have complete database records ({len(update_actions)} messages)."
+        ):
+            confirmed.extend(update_actions)
 
-    if len(missing_files) > 0:
+    delete_actions = by_action[CATALOG_DELETE]
+    if len(delete_actions) > 0:
         print(
             bcolors.GREEN
             + "    Missing files, in database but not on object store:"
             + bcolors.ENDC
         )
-        for f in missing_files:
-            print(f"        {f}")
-        print(
-            bcolors.RED
-            + "Files have been found that have database entries, but are missing "
-            "from the object store. \n"
-            "Do you wish to mark them as a failed upload: Y/N ?" + bcolors.ENDC
-        )
-        user_response = input().lower()
-        if user_response == "y":
-            send_catalog_delete_message(
-                rabbit_publisher=rabbit_publisher,
-                user=user,
-                group=group,
-                transaction_id=transaction_id,
-                # use the first sub id for the monitoring - complete the other
-                # sub records below
-                sub_id=str(create_sub_id(filelist=missing_files)),
-                api_action=api_action,
-                filelist=missing_files,
-            )
+        for action in delete_actions:
+            for f in action[MSG.FILELIST]:
+                print(f"        {f}")
+        if confirm_fix(
+            "Files have been found that have database entries, but are missing from "
+            f"the object store ({len(delete_actions)} messages).",
+            "Do you wish to mark them as a failed upload",
+        ):
+            confirmed.extend(delete_actions)
 
-    # no files are incomplete, we can mark the sub ids as finished
-    # need to send a message to the Monitor Queue
+    monitor_actions = by_action[MONITOR_COMPLETE]
     print(
         bcolors.GREEN
         + "    Sub ids with all files uploaded to object store:"
         + bcolors.ENDC
     )
-    for sid in incomplete_sub_ids:
-        print(f"        {sid}")
-    if len(incomplete_sub_ids) > 0:
-        print(
-            bcolors.RED
-            + "Sub ids have been found with incomplete database records, even "
-            "though the transfer completed.\n"
-            "Do you wish to fix them: Y/N ?" + bcolors.ENDC
-        )
-        user_response = input().lower()
-        if user_response == "y":
-            # we start at an index offset if the complete and incomplete logic ran, so
-            # that we do not send COMPLETE messages to those that are FAILED or
-            # CATALOG_UPDATING
-            for sid in incomplete_sub_ids:
-                send_monitor_complete_message(
-                    rabbit_publisher=rabbit_publisher,
-                    user=user,
-                    group=group,
-                    transaction_id=transaction_id,
-                    sub_id=sid,
-                    api_action=api_action,
-                )
+    for action in monitor_actions:
+        print(f"        {action[MSG.SUB_ID]}")
+    if len(monitor_actions) > 0 and confirm_fix(
+        "Sub ids have been found with incomplete database records, even though the "
+        "transfer completed."
+    ):
+        confirmed.extend(monitor_actions)
+
+    if len(confirmed) == 0:
+        return []
+    rabbit_publisher = RabbitMQPublisher()
+    rabbit_publisher.get_connection()
+    try:
+        return apply_plan(rabbit_publisher, plan, compact=compact, actions=confirmed)
+    finally:
+        rabbit_publisher.close_connection()
 
 
 def fix_transaction_status(
@@ -457,7 +744,16 @@ def fix_transaction_status(
     id: Optional[int] = None,
     transaction_id: Optional[str] = None,
     json: Optional[bool] = False,
-):
+    compact: Optional[bool] = False,
+    plan_file: Optional[str] = None,
+    max_files: int = DEFAULT_CHUNK_FILES,
+    max_bytes: int = DEFAULT_CHUNK_BYTES,
+    listings: Optional[ListingCache] = None,
+) -> tuple[Optional[dict], list[dict]]:
+    """Fix the status of the transaction.  If plan_file is given then the plan is
+    written to it and nothing is changed, otherwise the plan is confirmed
+    interactively and then applied.  Returns the plan, and the outcomes of the
+    actions that were applied."""
     # error check - need to supply user, group, id and / or transaction
     # need user and group
     if not user or not group:
@@ -485,40 +781,362 @@ def fix_transaction_status(
     if transaction_id is None:
         transaction_id = ret_trans_id
 
-    if len(incomplete_sub_ids) > 0:
-        print(bcolors.YELLOW + "    Incomplete sub_ids" + bcolors.ENDC)
-        for i in incomplete_sub_ids:
-            print(f"        {i}")
-
-        # branch on the state to do the required fix
-        # only one at the moment (TRANSFER_PUTTING) but can extend this
-        match state:
-            case "TRANSFER_PUTTING":
-                rabbit_publisher = RabbitMQPublisher()
-                rabbit_publisher.get_connection()
-
-                fix_transfer_putting(
-                    rpc_publisher=rpc_publisher,
-                    rabbit_publisher=rabbit_publisher,
-                    user=user,
-                    group=group,
-                    transaction_id=transaction_id,
-                    incomplete_sub_ids=incomplete_sub_ids,
-                    api_action=api_action,
-                )
-                rabbit_publisher.close_connection()
-
-            case "CATALOG_PUTTING":
-                # I think this is the same as fix_transfer_putting
-                rabbit_publisher = RabbitMQPublisher()
-                rabbit_publisher.get_connection()
-                fix_transfer_putting(
-                    rpc_publisher=rpc_publisher,
-                    rabbit_publisher=rabbit_publisher,
-                    user=user,
-                    group=group,
-                    transaction_id=transaction_id,
-                    incomplete_sub_ids=incomplete_sub_ids,
-                    api_action=api_action,
+    if len(incomplete_sub_ids) == 0:
+        return None, []
+    print(bcolors.YELLOW + "    Incomplete sub_ids" + bcolors.ENDC)
+    for i in incomplete_sub_ids:
+        print(f"        {i}")
+
+    # branch on the state to do the required fix
+    # only TRANSFER_PUTTING and CATALOG_PUTTING at the moment, but can extend this
+    if state not in FIXABLE_STATES:
+        raise RuntimeError(
+            f"Cannot fix transactions in state {state}, options: {FIXABLE_STATES}"
+        )
+    if plan_file is not None:
+        plan = plan_transfer_putting(
+            rpc_publisher=rpc_publisher,
+            user=user,
+            group=group,
+            transaction_id=transaction_id,
+            incomplete_sub_ids=incomplete_sub_ids,
+            api_action=api_action,
+            state=state,
+            max_files=max_files,
+            max_bytes=max_bytes,
+            listings=listings,
+        )
+        write_plan(plan, plan_file)
+        return plan, []
+    outcomes = fix_transfer_putting(
+        rpc_publisher=rpc_publisher,
+        user=user,
+        group=group,
+        transaction_id=transaction_id,
+        incomplete_sub_ids=incomplete_sub_ids,
+        api_action=api_action,
+        compact=compact,
+        max_files=max_files,
+        max_bytes=max_bytes,
+        listings=listings,
+    )
+    return None, outcomes
+
+
+def apply_plan_file(
+    plan_file: str, compact: bool = False, batch_size: int = DEFAULT_APPLY_BATCH
+) -> tuple[list[dict], list[dict]]:
+    """Apply the plans in the file, written by fix_transaction_status or
+    fix_stuck_transactions with a plan_file, without any questions.  Returns the
+    plans and the outcomes of their actions."""
+    plans = read_plans(plan_file)
+    return plans, apply_plans(plans, compact=compact, batch_size=batch_size)
+
+
+def apply_plans(
+    plans: list[dict], compact: bool = False, batch_size: int = DEFAULT_APPLY_BATCH
+) -> list[dict]:
+    """Apply the plans over one connection, returning the outcomes of all of their
+    actions."""
+    rabbit_publisher = RabbitMQPublisher()
+    rabbit_publisher.get_connection()
+    outcomes = []
+    try:
+        for plan in plans:
+            outcomes.extend(
+                apply_plan(
+                    rabbit_publisher, plan, compact=compact, batch_size=batch_size
                 )
-                rabbit_publisher.close_connection()
+            )
+    finally:
+        rabbit_publisher.close_connection()
+    return outcomes
+
+
+def parse_age(age: str) -> float:
+    """Parse an age such as "90s", "30m", "6h", "2d" or "1w" into seconds."""
+    age = age.strip().lower()
+    try:
+        if age[-1] in _AGE_UNITS:
+            seconds = float(age[:-1]) * _AGE_UNITS[age[-1]]
+        else:
+            seconds = float(age)
+    except (IndexError, ValueError):
+        raise RuntimeError(
+            f"Could not parse age {age}, use a number with a unit of "
+            f"{', '.join(_AGE_UNITS)}, e.g. 6h"
+        )
+    if seconds <= 0:
+        raise RuntimeError("Age must be greater than zero.")
+    return seconds
+
+
+def find_stuck_transactions(
+    rpc_publisher: RabbitMQRPCPublisher,
+    state: str,
+    older_than: float,
+    user: Optional[str] = None,
+    group: Optional[str] = None,
+    page_size: int = 1000,
+    now: Optional[datetime] = None,
+) -> list[dict]:
+    """Page through the transactions with sub-records in the state, for the user and
+    / or group, or for everyone if neither is given, and return those with
+    sub-records in the state that were last updated more than older_than seconds
+    ago:
+        {"id", "transaction_id", "user", "group", "api_action", "sub_ids",
+         "last_updated": of the oldest of the sub-records}
+    """
+    if now is None:
+        now = datetime.now()
+    cutoff = now - timedelta(seconds=older_than)
+    stuck = []
+    pages = stream_request_status(
+        rpc_publisher=rpc_publisher,
+        user="nlds",
+        group="**all**",
+        page_size=page_size,
+        labels=False,
+        groupall=True,
+        state=[state],
+        query_user=user,
+        query_group=group,
+    )
+    for page in pages:
+        for tr in page[MSG.DATA][MSG.RECORD_LIST]:
+            sub_records = [
+                sr
+                for sr in tr[MSG.SUB_RECORD_LIST]
+                if sr[MSG.STATE] == state
+                and datetime.fromisoformat(sr["last_updated"]) < cutoff
+            ]
+            if len(sub_records) == 0:
+                continue
+            stuck.append(
+                {
+                    MSG.ID: tr[MSG.ID],
+                    MSG.TRANSACT_ID: tr[MSG.TRANSACT_ID],
+                    MSG.USER: tr[MSG.USER],
+                    MSG.GROUP: tr[MSG.GROUP],
+                    MSG.API_ACTION: tr[MSG.API_ACTION],
+                    "sub_ids": [sr[MSG.SUB_ID] for sr in sub_records],
+                    "last_updated": min(sr["last_updated"] for sr in sub_records),
+                }
+            )
+    return stuck
+
+
+def _plan_stuck_transaction(
+    stuck: dict,
+    state: str,
+    complete_files: list[str],
+    incomplete_files: list[str],
+    client,
+    list_budget: int,
+    list_executor: Executor,
+    max_files: int = DEFAULT_CHUNK_FILES,
+    max_bytes: int = DEFAULT_CHUNK_BYTES,
+    listings: Optional[ListingCache] = None,
+) -> dict:
+    """List the bucket of a stuck transaction in the shared list_executor, and build
+    the plan to fix it."""
+    transaction_id = stuck[MSG.TRANSACT_ID]
+    uploaded_files = get_uploaded_files(
+        transaction_id,
+        client=client,
+        paths=complete_files + incomplete_files,
+        workers=list_budget,
+        executor=list_executor,
+        listings=listings,
+    )
+    return build_plan(
+        user=stuck[MSG.USER],
+        group=stuck[MSG.GROUP],
+        transaction_id=transaction_id,
+        api_action=stuck[MSG.API_ACTION],
+        state=state,
+        incomplete_sub_ids=stuck["sub_ids"],
+        complete_files=complete_files,
+        incomplete_files=incomplete_files,
+        uploaded_files=uploaded_files,
+        max_files=max_files,
+        max_bytes=max_bytes,
+    )
+
+
+def plan_stuck_transactions(
+    rpc_publisher: RabbitMQRPCPublisher,
+    stuck: list[dict],
+    state: str,
+    concurrency: int = DEFAULT_STUCK_CONCURRENCY,
+    list_budget: int = DEFAULT_LIST_WORKERS,
+    client=None,
+    max_files: int = DEFAULT_CHUNK_FILES,
+    max_bytes: int = DEFAULT_CHUNK_BYTES,
+    listings: Optional[ListingCache] = None,
+) -> Iterator[dict]:
+    """Plan the fix of each of the stuck transactions from find_stuck_transactions,
+    yielding {"stuck": ..., "plan": ...}, or {"stuck": ..., "failure": ...}, for each
+    transaction as it finishes.  Nothing is changed.
+    The budget for all of the transactions is:
+        concurrency : the number of transactions in progress at once.  The find
+                      queries for the transactions are pipelined on the one RPC
+                      connection.
+        list_budget : the number of object store listings at once, shared between
+                      all the transactions in progress.
+    """
+    if concurrency < 1:
+        raise RuntimeError("Concurrency must be at least 1.")
+    if list_budget < 1:
+        raise RuntimeError("Listing budget must be at least 1.")
+    if client is None:
+        client = connect_to_object_store(pool_size=list_budget)
+    todo = iter(stuck)
+    # transactions whose find query has been sent: (stuck, corr_id)
+    finding = deque()
+    # transactions whose buckets are being listed: (stuck, future)
+    planning = []
+
+    def request_files():
+        while len(finding) + len(planning) < concurrency:
+            st = next(todo, None)
+            if st is None:
+                return
+            msg_dict = _find_message(
+                user="nlds",
+                group="**all**",
+                groupall=True,
+                transaction_id=st[MSG.TRANSACT_ID],
+                query_user=st[MSG.USER],
+                query_group=st[MSG.GROUP],
+            )
+            corr_id = rpc_publisher.send(msg_dict=msg_dict, routing_key=RK.CATALOG_Q)
+            finding.append((st, corr_id))
+
+    def finish(st, future):
+        try:
+            return {"stuck": st, "plan": future.result()}
+        except (S3Error, HTTPError, OSError) as e:
+            return {"stuck": st, "failure": f"{type(e).__name__}: {e}"}
+        except RuntimeError as e:
+            return {"stuck": st, "failure": str(e)}
+
+    with (
+        ThreadPoolExecutor(max_workers=list_budget) as list_executor,
+        ThreadPoolExecutor(max_workers=concurrency) as plan_executor,
+    ):
+        try:
+            request_files()
+            while len(finding) > 0 or len(planning) > 0:
+                # finish the transactions whose buckets have been listed, and start
+                # the next transactions in their place
+                done = [p for p in planning if p[1].done()]
+                for p in done:
+                    planning.remove(p)
+                    yield finish(*p)
+                    request_files()
+                if len(finding) == 0:
+                    if len(planning) > 0:
+                        wait([f for _, f in planning], return_when=FIRST_COMPLETED)
+                    continue
+                st, corr_id = finding.popleft()
+                response = rpc_publisher.receive(corr_id)
+                if response is None:
+                    raise RuntimeError("Catalog service could not be reached in time.")
+                files, response_dict = FileTable.from_body(response)
+                if response_dict[MSG.DETAILS].get("failure"):
+                    yield {
+                        "stuck": st,
+                        "failure": response_dict[MSG.DETAILS]["failure"],
+                    }
+                else:
+                    complete_files, incomplete_files = split_files(
+                        files, st[MSG.TRANSACT_ID]
+                    )
+                    future = plan_executor.submit(
+                        _plan_stuck_transaction,
+                        st,
+                        state,
+                        complete_files,
+                        incomplete_files,
+                        client,
+                        list_budget,
+                        list_executor,
+                        max_files,
+                        max_bytes,
+                        listings,
+                    )
+                    planning.append((st, future))
+                request_files()
+        finally:
+            for _, corr_id in finding:
+                rpc_publisher.discard(corr_id)
+            for _, future in planning:
+                future.cancel()
+
+
+def fix_stuck_transactions(
+    rpc_publisher: RabbitMQRPCPublisher,
+    state: str,
+    older_than: float,
+    user: Optional[str] = None,
+    group: Optional[str] = None,
+    concurrency: int = DEFAULT_STUCK_CONCURRENCY,
+    list_budget: int = DEFAULT_LIST_WORKERS,
+    plan_file: Optional[str] = None,
+    max_files: int = DEFAULT_CHUNK_FILES,
+    max_bytes: int = DEFAULT_CHUNK_BYTES,
+    listings: Optional[ListingCache] = None,
+) -> list[dict]:
+    """Plan the fix of all of the transactions with sub-records that have been stuck
+    in the state for more than older_than seconds, with plan_stuck_transactions.
+    Returns the result for each transaction, in id order.  If plan_file is given then
+    the plans are written to it, otherwise they can be applied with
+    apply_stuck_results."""
+    if state not in FIXABLE_STATES:
+        raise RuntimeError(
+            f"Cannot fix transactions in state {state}, options: {FIXABLE_STATES}"
+        )
+    stuck = find_stuck_transactions(
+        rpc_publisher=rpc_publisher,
+        state=state,
+        older_than=older_than,
+        user=user,
+        group=group,
+    )
+    results = list(
+        plan_stuck_transactions(
+            rpc_publisher=rpc_publisher,
+            stuck=stuck,
+            state=state,
+            concurrency=concurrency,
+            list_budget=list_budget,
+            max_files=max_files,
+            max_bytes=max_bytes,
+            listings=listings,
+        )
+    )
+    results.sort(key=lambda r: r["stuck"][MSG.ID])
+    if plan_file is not None:
+        write_plan(
+            {
+                PLAN_VERSION: 1,
+                "created": datetime.now().isoformat(),
+                PLAN_LIST: [r["plan"] for r in results if "plan" in r],
+            },
+            plan_file,
+        )
+    return results
+
+
+def apply_stuck_results(results: list[dict], compact: bool = False) -> None:
+    """Apply the plans in the results from fix_stuck_transactions, adding the
+    "outcomes" of its actions to the result of each transaction."""
+    plans = [r["plan"] for r in results if "plan" in r]
+    outcomes = apply_plans(plans, compact=compact)
+    by_transaction = {}
+    for o in outcomes:
+        by_transaction.setdefault(o[MSG.TRANSACT_ID], []).append(o)
+    for r in results:
+        if "plan" in r:
+            r["outcomes"] = by_transaction.get(r["stuck"][MSG.TRANSACT_ID], [])
@@ -15,18 +15,10 @@ from nlds_admin.rabbit.publisher import RabbitMQPublisher
 from nlds_admin.rabbit import message_keys as MSG
 from nlds_admin.rabbit import routing_keys as RK
 from nlds_admin.rabbit.state import State
-from nlds_admin.publishers.find import find_files
-from nlds_admin.common.deserialize import deserialize
+from nlds_admin.publishers.find import find_file_table
 from nlds_admin.common.bcolors import bcolors
 from nlds_admin.common.create_sub_id import create_sub_id
-
-
-def file_has_empty_tape_storage_location(file: dict):
-    locations = file["locations"]
-    for l in locations:
-        if l["storage_type"] == "TAPE" and l["root"] == "" and l["url"] == "":
-            return True
-    return False
+from nlds_admin.common.compact_filelist import file_details, pack_filelist
 
 
 def get_files_with_incomplete_records(
@@ -48,7 +40,7 @@ def get_files_with_incomplete_records(
     which can then be used to send a message to CATALOG_REMOVE.
     """
     # First of all get a list of the files for the holding or transaction_id
-    files_stat = find_files(
+    files, files_response = find_file_table(
         rpc_publisher=rpc_publisher,
         user=user,
         group=group,
@@ -56,26 +48,18 @@ def get_files_with_incomplete_records(
         transaction_id=transaction_id,
         limit=limit,
     )
-    # Requires deserializing (decompressing)
-    files_response = deserialize(files_stat)
     print(
         bcolors.YELLOW
         + "Working on Holding with holding_id:\n"
         + bcolors.ENDC
         + f"  {files_response[MSG.DETAILS][MSG.HOLDING_ID]}"
     )
-    file_data = files_response[MSG.DATA]
-    return_dict = {}
+    # the TAPE record is not valid if it has an empty root and url
+    return_dict = files.paths_by_transaction(files.empty_tape)
     print(bcolors.YELLOW + "  Untaping files:" + bcolors.ENDC)
-    for h in file_data[MSG.HOLDINGS]:
-        holding = file_data[MSG.HOLDINGS][h]
-        for tr in holding[MSG.TRANSACTIONS]:
-            return_dict[tr] = []
-            files = holding[MSG.TRANSACTIONS][tr][MSG.FILELIST]
-            for f in files:
-                if file_has_empty_tape_storage_location(f):
-                    print(f"    {f["original_path"]}")
-                    return_dict[tr].append(f["original_path"])
+    for tr in return_dict:
+        for f in return_dict[tr]:
+            print(f"    {f}")
     return return_dict
 
 
@@ -86,6 +70,7 @@ def send_archive_remove_message(
     holding_id: int,
     transaction_id: str,
     filelist: list[str],
+    compact: bool = False,
 ):
     # create the rabbit publisher and build the routing_key
     routing_key = f"{RK.ROOT}.{RK.CATALOG_REMOVE}.{RK.START}"
@@ -94,21 +79,7 @@ def send_archive_remove_message(
     sub_id = str(create_sub_id(filelist=filelist))
     msg_filelist = []
     for f in filelist:
-        fj = {
-            "file_details": {
-                "original_path": f,
-                "path_type": 0,  # zero is FILE type
-                "link_path": None,
-                "size": 0,
-                "user": 0,
-                "group": 0,
-                "permissions": 0,
-                "mode": 0,
-                "access_time": 0.0,
-                "failure_reason": None,
-                "holding_id": holding_id,
-            },
-        }
+        fj = {"file_details": file_details(f, holding_id=holding_id)}
         msg_filelist.append(fj)
 
     # Build the message to contain the filelist
@@ -124,7 +95,7 @@ def send_archive_remove_message(
             MSG.ROUTE: "NLDS_ADMIN",
         },
         MSG.DATA: {
-            MSG.FILELIST: msg_filelist,
+            MSG.FILELIST: pack_filelist(msg_filelist, compact),
         },
         MSG.META: {
             MSG.HOLDING_ID: holding_id,
@@ -146,6 +117,7 @@ def fix_holding_tape_records(
     transaction_id: Optional[str] = None,
     limit=1000,
     json: Optional[bool] = False,
+    compact: Optional[bool] = False,
 ):
     # error check - need to supply user, group, id and / or transaction
     # need user and group
@@ -192,6 +164,7 @@ def fix_holding_tape_records(
                 holding_id=holding_id,
                 transaction_id=tr,
                 filelist=filelist,
+                compact=compact,
             )
 
         rabbit_publisher.close_connection()
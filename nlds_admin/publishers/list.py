@@ -13,6 +13,8 @@ from typing import Optional
 import nlds_admin.rabbit.routing_keys as RK
 import nlds_admin.rabbit.message_keys as MSG
 from nlds_admin.publishers.process_tag import process_tag
+from nlds_admin.common.deserialize import deserialize
+from nlds_admin.common.cache import ResponseCache
 
 from nlds_admin.rabbit.rpc_publisher import RabbitMQRPCPublisher
 
@@ -29,6 +31,7 @@ def list_holdings(
     query_group: Optional[str] = None,
     limit: Optional[int] = None,
     time: Optional[bool] = None,
+    cache: Optional[ResponseCache] = None,
 ):
     # create the message dictionary
     msg_dict = {
@@ -72,14 +75,23 @@ def list_holdings(
     if len(meta_dict) > 0:
         msg_dict[MSG.META] = meta_dict
 
+    # return the cached response, if there is one
+    if cache is not None:
+        cache_key = cache.key(RK.LIST, msg_dict)
+        cached_response = cache.get(cache_key, RK.LIST)
+        if cached_response is not None:
+            return cached_response
+
     # call RPC function
     routing_key = f"{RK.CATALOG_Q}"
     response = rpc_publisher.call(msg_dict=msg_dict, routing_key=routing_key)
     # Check if response is valid or whether the request timed out
     if response is not None:
-        # convert byte response to str
-        response = response.decode()
-        return response
+        # parse the byte response directly, without converting to str first
+        response_dict = deserialize(response)
+        if cache is not None:
+            cache.put(cache_key, RK.LIST, response, response_dict)
+        return response_dict
     else:
         msg="Catalog service could not be reached in time."
         raise RuntimeError(msg)
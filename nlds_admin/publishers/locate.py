@@ -0,0 +1,189 @@
+# encoding: utf-8
+"""
+locate.py
+"""
+
+__author__ = "Neil Massey"
+__date__ = "19 Oct 2026"
+__copyright__ = "Copyright 2026 United Kingdom Research and Innovation"
+__license__ = "BSD - see LICENSE file in top-level package directory"
+__contact__ = "neil.massey@stfc.ac.uk"
+
+import os.path
+import re
+from collections import deque
+from typing import Iterable, Iterator, Optional
+
+import nlds_admin.rabbit.message_keys as MSG
+import nlds_admin.rabbit.routing_keys as RK
+from nlds_admin.rabbit.rpc_publisher import RabbitMQRPCPublisher
+from nlds_admin.publishers.find import _find_message
+from nlds_admin.common.file_table import FileTable, TAPE
+
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_MAX_REGEX_LENGTH = 64 * 1024
+DEFAULT_CONCURRENCY = 4
+# the columns of the CSV output, from flatten_row
+CSV_FIELDS = (
+    MSG.PATH,
+    "found",
+    MSG.HOLDING_ID,
+    MSG.LABEL,
+    MSG.TRANSACT_ID,
+    "storage_locations",
+    "on_tape",
+)
+
+
+def read_paths(lines: Iterable[str]) -> list[str]:
+    """Read the paths from the lines of a file, one per line, skipping blank lines.
+    The paths are returned in the order that they appear, including duplicates."""
+    paths = []
+    for line in lines:
+        path = line.rstrip("\n")
+        if path.strip():
+            paths.append(path)
+    return paths
+
+
+def path_regex(paths: list[str]) -> str:
+    """Build a single anchored regular expression that matches exactly the (sorted)
+    paths, with their common prefix factored out."""
+    prefix = os.path.commonprefix(paths)
+    suffixes = "|".join(re.escape(p[len(prefix) :]) for p in paths)
+    return f"^{re.escape(prefix)}(?:{suffixes})$"
+
+
+def batch_paths(
+    paths: Iterable[str],
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    max_regex_length: int = DEFAULT_MAX_REGEX_LENGTH,
+) -> Iterator[list[str]]:
+    """Split the unique paths, in sorted order, into batches of at most batch_size
+    paths whose combined regular expression is at most max_regex_length characters.
+    Sorting puts paths in the same directory into the same batch, so that their
+    common prefix is long."""
+    batch = []
+    length = 0
+    for path in sorted(set(paths)):
+        escaped_length = len(re.escape(path)) + 1
+        if batch and (
+            len(batch) >= batch_size or length + escaped_length > max_regex_length
+        ):
+            yield batch
+            batch = []
+            length = 0
+        batch.append(path)
+        length += escaped_length
+    if batch:
+        yield batch
+
+
+def locate_paths(
+    rpc_publisher: RabbitMQRPCPublisher,
+    paths: Iterable[str],
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    max_regex_length: int = DEFAULT_MAX_REGEX_LENGTH,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    query_user: Optional[str] = None,
+    query_group: Optional[str] = None,
+    groupall: Optional[bool] = False,
+) -> tuple[dict[str, list[dict]], list[str]]:
+    """Find the holdings and transactions that contain each of the paths.  The paths
+    are batched into combined find queries, with up to concurrency queries in flight
+    at once, and the files returned are joined to the paths with a dictionary.
+    Returns a dictionary of path -> list of matches, where each match is:
+        {"holding_id", "label", "transaction_id", "storage_locations", "on_tape"}
+    and a list of the failure messages for batches that the catalog failed on, which
+    includes batches where none of the paths were found."""
+    if concurrency < 1:
+        raise RuntimeError("Concurrency must be at least 1.")
+    matches = {p: [] for p in paths}
+    failures = []
+    batches = batch_paths(matches.keys(), batch_size, max_regex_length)
+    in_flight = deque()
+
+    def request_batches():
+        while len(in_flight) < concurrency:
+            batch = next(batches, None)
+            if batch is None:
+                return
+            msg_dict = _find_message(
+                user="nlds",
+                group="**all**",
+                groupall=groupall,
+                path=path_regex(batch),
+                query_user=query_user,
+                query_group=query_group,
+            )
+            corr_id = rpc_publisher.send(msg_dict=msg_dict, routing_key=RK.CATALOG_Q)
+            in_flight.append(corr_id)
+
+    try:
+        request_batches()
+        while len(in_flight) > 0:
+            corr_id = in_flight.popleft()
+            response = rpc_publisher.receive(corr_id)
+            if response is None:
+                msg = "Catalog service could not be reached in time."
+                raise RuntimeError(msg)
+            # keep the next batches in flight while this one is joined
+            request_batches()
+            files, response_dict = FileTable.from_body(response)
+            details = response_dict[MSG.DETAILS]
+            if details.get("failure"):
+                failures.append(details["failure"])
+                continue
+            _join_files(files, matches)
+    finally:
+        for corr_id in in_flight:
+            rpc_publisher.discard(corr_id)
+    return matches, failures
+
+
+def _join_files(files: FileTable, matches: dict[str, list[dict]]) -> None:
+    """Add the files in the table to the matches for their paths."""
+    for i in files.indices():
+        path_matches = matches.get(files.path[i])
+        if path_matches is None:
+            continue
+        holding = files.holding_of(i)
+        storage_types = files.storage_types(i)
+        path_matches.append(
+            {
+                MSG.HOLDING_ID: holding[MSG.HOLDING_ID],
+                MSG.LABEL: holding[MSG.LABEL],
+                MSG.TRANSACT_ID: files.transaction_of(i)[MSG.TRANSACT_ID],
+                "storage_locations": list(storage_types),
+                "on_tape": TAPE in storage_types and not bool(files.empty_tape[i]),
+            }
+        )
+
+
+def location_rows(paths: list[str], matches: dict[str, list[dict]]) -> Iterator[dict]:
+    """Yield one row for each input path, in the input order, with its matches."""
+    for path in paths:
+        path_matches = matches.get(path, [])
+        yield {
+            MSG.PATH: path,
+            "found": len(path_matches) > 0,
+            "matches": path_matches,
+        }
+
+
+def flatten_row(row: dict) -> dict:
+    """Flatten a location row for CSV output.  Where a path is in more than one
+    holding the values for each match are separated by ";", and the storage locations
+    of a match are separated by "+"."""
+    path_matches = row["matches"]
+    return {
+        MSG.PATH: row[MSG.PATH],
+        "found": row["found"],
+        MSG.HOLDING_ID: ";".join(str(m[MSG.HOLDING_ID]) for m in path_matches),
+        MSG.LABEL: ";".join(m[MSG.LABEL] for m in path_matches),
+        MSG.TRANSACT_ID: ";".join(m[MSG.TRANSACT_ID] for m in path_matches),
+        "storage_locations": ";".join(
+            "+".join(m["storage_locations"]) for m in path_matches
+        ),
+        "on_tape": ";".join(str(m["on_tape"]) for m in path_matches),
+    }
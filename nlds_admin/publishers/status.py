@@ -9,19 +9,21 @@ __copyright__ = "Copyright 2025 United Kingdom Research and Innovation"
 __license__ = "BSD - see LICENSE file in top-level package directory"
 __contact__ = "neil.massey@stfc.ac.uk"
 
-from typing import Optional, Union
+from collections import deque
+from typing import Iterator, Optional, Union
+import json
 import uuid
 
 import nlds_admin.rabbit.message_keys as MSG
 import nlds_admin.rabbit.routing_keys as RK
 from nlds_admin.rabbit.state import State
 from nlds_admin.common.deserialize import deserialize
+from nlds_admin.common.cache import ResponseCache, LabelCache
 
 from nlds_admin.rabbit.rpc_publisher import RabbitMQRPCPublisher
 
 
-def get_request_status(
-    rpc_publisher: RabbitMQRPCPublisher,
+def _status_message(
     user: str,
     group: str,
     groupall: Optional[bool] = False,
@@ -37,7 +39,8 @@ def get_request_status(
     limit: Optional[int] = None,
     offset: Optional[int] = None,
     descending: Optional[bool] = False,
-):
+) -> dict:
+    """Validate the stat parameters and assemble the message for the monitor."""
     # Validate state at this point.
     for s in state:
         # Attempt to convert to int, if can't then put in upper case for name
@@ -98,39 +101,228 @@ def get_request_status(
         msg_dict[MSG.META][MSG.EXCLUDE_API_ACTION] = exclude_api_action
     if len(state) > 0:
         msg_dict[MSG.META][MSG.STATE] = state
+    return msg_dict
+
+
+def get_request_status(
+    rpc_publisher: RabbitMQRPCPublisher,
+    user: str,
+    group: str,
+    groupall: Optional[bool] = False,
+    id: Optional[int] = None,
+    transaction_id: Optional[str] = None,
+    job_label: Optional[str] = None,
+    state: Optional[list[str]] = [],
+    sub_id: Optional[str] = None,
+    api_action: Optional[list[str]] = [],
+    exclude_api_action: Optional[list[str]] = [],
+    query_user: Optional[str] = None,
+    query_group: Optional[str] = None,
+    limit: Optional[int] = None,
+    offset: Optional[int] = None,
+    descending: Optional[bool] = False,
+    labels: Optional[bool] = True,
+    cache: Optional[ResponseCache] = None,
+    label_cache: Optional[LabelCache] = None,
+):
+    msg_dict = _status_message(
+        user=user,
+        group=group,
+        groupall=groupall,
+        id=id,
+        transaction_id=transaction_id,
+        job_label=job_label,
+        state=state,
+        sub_id=sub_id,
+        api_action=api_action,
+        exclude_api_action=exclude_api_action,
+        query_user=query_user,
+        query_group=query_group,
+        limit=limit,
+        offset=offset,
+        descending=descending,
+    )
+
+    # return the cached response, if there is one
+    if cache is not None:
+        cache_key = cache.key(RK.STAT, msg_dict, variant="" if labels else "no-labels")
+        cached_response = cache.get(cache_key, RK.STAT)
+        if cached_response is not None:
+            return cached_response
 
     # call RPC function
     routing_key = RK.MONITOR_Q
     response = rpc_publisher.call(msg_dict=msg_dict, routing_key=routing_key)
-    # Check if response is valid or whether t   he request timed out
-    if response is not None:
-        # convert byte response to dict for label fetching
-        response_dict = deserialize(response)
-        # Attempt to get list of transaction records
-        transaction_records = None
-        try:
-            transaction_records = response_dict[MSG.DATA][MSG.RECORD_LIST]
-        except KeyError as e:
-            msg = (
-                f"Encountered error when trying to get a record list from the"
-                f" message response ({e})"
-            )
-            raise RuntimeError(msg)
+    # Check if response is valid or whether the request timed out
+    if response is None:
+        msg = "Monitoring service could not be reached in time."
+        raise RuntimeError(msg)
+
+    # convert byte response to dict for label fetching
+    response_dict = deserialize(response)
+    # Attempt to get list of transaction records
+    transaction_records = None
+    try:
+        transaction_records = response_dict[MSG.DATA][MSG.RECORD_LIST]
+    except KeyError as e:
+        msg = (
+            f"Encountered error when trying to get a record list from the"
+            f" message response ({e})"
+        )
+        raise RuntimeError(msg)
+
+    # Only fetch the labels if the response actually had any transactions in it
+    labelled = False
+    if labels and transaction_records is not None and len(transaction_records) > 0:
+        failed_response = add_labels(
+            rpc_publisher, response_dict, transaction_records, label_cache
+        )
+        if failed_response is not None:
+            return failed_response
+        labelled = True
+
+    if cache is not None:
+        # the labelled response is only serialized again if it is to be cached
+        if labelled:
+            response = json.dumps(response_dict).encode()
+        cache.put(cache_key, RK.STAT, response, response_dict)
+    return response_dict
 
-        transaction_response = None
-        # Only continue if the response actually had any transactions in it
-        if transaction_records is not None and len(transaction_records) > 0:
-            routing_key = RK.CATALOG_Q
-            transaction_response = rpc_publisher.call(
-                msg_dict=response_dict, routing_key=routing_key
+
+def stream_request_status(
+    rpc_publisher: RabbitMQRPCPublisher,
+    user: str,
+    group: str,
+    page_size: int = 1000,
+    concurrency: int = 2,
+    limit: Optional[int] = None,
+    offset: Optional[int] = None,
+    labels: Optional[bool] = True,
+    label_cache: Optional[LabelCache] = None,
+    **status_kwargs,
+) -> Iterator[dict]:
+    """Page through all of the transaction records that match the query, yielding
+    the (deserialized) response for each page, in order, as it arrives.  Up to
+    concurrency pages are requested from the monitor at once, so that the next pages
+    are being fetched while the labels for the current page are fetched from the
+    catalog.  limit caps the total number of records, and offset is the offset of the
+    first record.  The other status_kwargs are as for get_request_status."""
+    if page_size < 1:
+        raise RuntimeError("Page size must be at least 1.")
+    if concurrency < 1:
+        raise RuntimeError("Concurrency must be at least 1.")
+
+    next_offset = offset or 0
+    end_offset = None if limit is None else next_offset + limit
+    # the pages in flight, as (offset, size, correlation_id), in offset order
+    in_flight = deque()
+    finished = False
+
+    def request_pages():
+        nonlocal next_offset
+        while not finished and len(in_flight) < concurrency:
+            size = page_size
+            if end_offset is not None:
+                size = min(size, end_offset - next_offset)
+            if size <= 0:
+                return
+            msg_dict = _status_message(
+                user=user,
+                group=group,
+                limit=size,
+                offset=next_offset,
+                **status_kwargs,
             )
+            corr_id = rpc_publisher.send(msg_dict=msg_dict, routing_key=RK.MONITOR_Q)
+            in_flight.append((next_offset, size, corr_id))
+            next_offset += size
 
-        if transaction_response is not None:
-            response = transaction_response
+    try:
+        request_pages()
+        while len(in_flight) > 0:
+            page_offset, size, corr_id = in_flight.popleft()
+            response = rpc_publisher.receive(corr_id)
+            if response is None:
+                msg = "Monitoring service could not be reached in time."
+                raise RuntimeError(msg)
+            response_dict = deserialize(response)
+            details = response_dict[MSG.DETAILS]
+            if details.get("failure"):
+                raise RuntimeError(details["failure"])
+            transaction_records = response_dict[MSG.DATA][MSG.RECORD_LIST]
+            # a short page is the last page - any later pages in flight are empty
+            if len(transaction_records) < size:
+                finished = True
+                for _, _, c in in_flight:
+                    rpc_publisher.discard(c)
+                in_flight.clear()
+            # prefetch the next page(s) before fetching the labels for this one
+            request_pages()
+            if labels and len(transaction_records) > 0:
+                failed_response = add_labels(
+                    rpc_publisher, response_dict, transaction_records, label_cache
+                )
+                if failed_response is not None:
+                    raise RuntimeError(failed_response[MSG.DETAILS]["failure"])
+            yield response_dict
+    finally:
+        for _, _, c in in_flight:
+            rpc_publisher.discard(c)
 
-        # convert byte response to str
-        response = response.decode()
-        return response
+
+def add_labels(
+    rpc_publisher: RabbitMQRPCPublisher,
+    response_dict: dict,
+    transaction_records: list[dict],
+    label_cache: Optional[LabelCache] = None,
+) -> Optional[dict]:
+    """Add the holding label to each of the transaction records in the monitor
+    response.  Labels that are in the label_cache are used directly, and the catalog
+    is only asked for the labels of the remaining transactions.  The catalog request
+    carries only the identifying fields of those transaction records, not their
+    sub-records.  Returns the catalog response if it failed, otherwise None.  If the
+    catalog cannot be reached in time then the records that are not in the
+    label_cache are left without a label, as the labels are only for display."""
+    transaction_ids = [tr[MSG.TRANSACT_ID] for tr in transaction_records]
+    if label_cache is not None:
+        known_labels = label_cache.get_labels(transaction_ids)
     else:
-        msg = ("Monitoring service could not be reached in time.",)
-        raise RuntimeError(msg)
+        known_labels = {}
+
+    unlabelled = [
+        {
+            k: tr[k]
+            for k in (MSG.ID, MSG.TRANSACT_ID, MSG.USER, MSG.GROUP, MSG.API_ACTION)
+            if k in tr
+        }
+        for tr in transaction_records
+        if tr[MSG.TRANSACT_ID] not in known_labels
+    ]
+    label_response = None
+    if len(unlabelled) > 0:
+        label_msg = {
+            MSG.DETAILS: dict(response_dict[MSG.DETAILS]),
+            MSG.DATA: {MSG.RECORD_LIST: unlabelled},
+            MSG.META: dict(response_dict.get(MSG.META, {})),
+            MSG.TYPE: response_dict.get(MSG.TYPE, MSG.TYPE_STANDARD),
+        }
+        label_response = rpc_publisher.call(
+            msg_dict=label_msg, routing_key=RK.CATALOG_Q
+        )
+    if label_response is not None:
+        label_response = deserialize(label_response)
+        if label_response[MSG.DETAILS].get("failure"):
+            return label_response
+        new_labels = {
+            tr[MSG.TRANSACT_ID]: tr[MSG.LABEL]
+            for tr in label_response[MSG.DATA].get(MSG.RECORD_LIST, [])
+            if tr.get(MSG.LABEL)
+        }
+        if label_cache is not None:
+            label_cache.put_labels(new_labels)
+        known_labels = known_labels | new_labels
+
+    for tr in transaction_records:
+        if tr[MSG.TRANSACT_ID] in known_labels:
+            tr[MSG.LABEL] = known_labels[tr[MSG.TRANSACT_ID]]
+    return None
@@ -0,0 +1,142 @@
+# encoding: utf-8
+"""
+watch.py
+"""
+
+__author__ = "Neil Massey"
+__date__ = "19 Oct 2026"
+__copyright__ = "Copyright 2026 United Kingdom Research and Innovation"
+__license__ = "BSD - see LICENSE file in top-level package directory"
+__contact__ = "neil.massey@stfc.ac.uk"
+
+import time
+from typing import Iterator, Optional
+
+import nlds_admin.rabbit.message_keys as MSG
+from nlds_admin.rabbit.rpc_publisher import RabbitMQRPCPublisher
+from nlds_admin.rabbit.state import State
+from nlds_admin.publishers.status import get_request_status
+
+# sub-record states after which a sub-record will not change again: the complete
+# states, from COMPLETE onwards, but not the SEARCHING pseudo-state
+FINAL_STATES = tuple(
+    s.name
+    for s in State
+    if s.value >= State.COMPLETE.value and s is not State.SEARCHING
+)
+
+
+def diff_sub_records(previous: dict, records: list[dict]) -> tuple[dict, list, list]:
+    """Compare the sub-records in the transaction records against those from the
+    previous poll, which are held in a dictionary of sub_id -> last_updated.
+    Returns the dictionary for this poll, the (transaction record, sub-record) pairs
+    that have changed since the previous poll, and the pairs that are new."""
+    current = {}
+    changed = []
+    new = []
+    for tr in records:
+        for sr in tr[MSG.SUB_RECORD_LIST]:
+            sub_id = sr[MSG.SUB_ID]
+            current[sub_id] = sr["last_updated"]
+            if sub_id not in previous:
+                new.append((tr, sr))
+            elif previous[sub_id] != sr["last_updated"]:
+                changed.append((tr, sr))
+    return current, changed, new
+
+
+def get_progress(records: list[dict], start_time: float, start_final: int) -> dict:
+    """Aggregate the state of the sub-records across all the transaction records.
+    Throughput is the number of sub-records that have reached a final state per
+    minute, since the watch started."""
+    states = {}
+    n_failed_files = 0
+    n_sub_records = 0
+    for tr in records:
+        for sr in tr[MSG.SUB_RECORD_LIST]:
+            n_sub_records += 1
+            states[sr[MSG.STATE]] = states.get(sr[MSG.STATE], 0) + 1
+            n_failed_files += len(sr.get("failed_files", []))
+    n_final = sum(states.get(s, 0) for s in FINAL_STATES)
+    elapsed = time.monotonic() - start_time
+    if elapsed > 0:
+        throughput = (n_final - start_final) * 60.0 / elapsed
+    else:
+        throughput = 0.0
+    return {
+        "sub_records": n_sub_records,
+        "final": n_final,
+        "failed_files": n_failed_files,
+        "states": states,
+        "elapsed": elapsed,
+        "throughput": throughput,
+    }
+
+
+def watch_request_status(
+    rpc_publisher: RabbitMQRPCPublisher,
+    interval: float = 5.0,
+    max_interval: Optional[float] = None,
+    **status_kwargs,
+) -> Iterator[dict]:
+    """Poll the monitor for the status of the transactions over the publisher's
+    connection, until all of the sub-records are in a final state.  A dictionary is
+    yielded for the first poll, and for each poll where a sub-record has changed:
+    {
+        "records": the transaction records,
+        "changed": the (transaction record, sub-record) pairs that have changed,
+        "new": the (transaction record, sub-record) pairs that are new,
+        "progress": the aggregate progress from get_progress,
+        "done": True if all of the sub-records are in a final state,
+    }
+    When nothing has changed the polling interval is doubled, up to max_interval
+    (default: 12 x interval), and it is reset to interval when something changes.
+    The status_kwargs are passed to get_request_status, and the response is never
+    cached."""
+    if interval <= 0:
+        raise RuntimeError("Watch interval must be greater than zero.")
+    if max_interval is None:
+        max_interval = interval * 12
+    max_interval = max(interval, max_interval)
+
+    previous = None
+    start_time = time.monotonic()
+    start_final = None
+    wait = interval
+    while True:
+        response = get_request_status(
+            rpc_publisher=rpc_publisher, cache=None, **status_kwargs
+        )
+        details = response[MSG.DETAILS]
+        if details.get("failure"):
+            raise RuntimeError(details["failure"])
+        records = response[MSG.DATA][MSG.RECORD_LIST]
+
+        current, changed, new = diff_sub_records(previous or {}, records)
+        if start_final is None:
+            start_final = sum(
+                1
+                for tr in records
+                for sr in tr[MSG.SUB_RECORD_LIST]
+                if sr[MSG.STATE] in FINAL_STATES
+            )
+        progress = get_progress(records, start_time, start_final)
+        done = progress["final"] == progress["sub_records"]
+
+        if previous is None or changed or new or done:
+            wait = interval
+            yield {
+                "records": records,
+                "changed": changed,
+                "new": new,
+                "progress": progress,
+                "done": done,
+            }
+        else:
+            # back off when nothing has changed
+            wait = min(wait * 2, max_interval)
+        if done:
+            return
+        previous = current
+        # sleep on the connection, so that the heartbeats are still processed
+        rpc_publisher.connection.sleep(wait)
@@ -14,8 +14,6 @@ import logging
 import traceback
 from typing import Dict, List, Any
 
-import json
-
 from pika.exceptions import StreamLostError, AMQPConnectionError
 from pika.channel import Channel
 from pika.connection import Connection
@@ -28,6 +26,7 @@ import nlds_admin.rabbit.message_keys as MSG
 from nlds_admin.rabbit.state import State
 from nlds_admin.rabbit.publisher import RabbitMQPublisher as RMQP
 import nlds_admin.common.config as CFG
+from nlds_admin.common.deserialize import deserialize
 
 logger = logging.getLogger("nlds.root")
 
@@ -55,15 +54,6 @@ class SigTermError(Exception):
     pass
 
 
-def deserialize(body: str) -> dict:
-    """Deserialize the message body by calling JSON loads and decompressing the
-    message if necessary."""
-    # NRM - in v1.0.11 of NLDS the data is compressed.  This function only currently
-    # works for v1.0.9
-    body_dict = json.loads(body)
-    return body_dict
-
-
 class RabbitMQConsumer(RMQP):
 
     def __setup_queues(self, queue: str = None):
@@ -20,6 +20,12 @@ from retry import retry
 
 import nlds_admin.common.config as CFG
 import nlds_admin.rabbit.routing_keys as RK
+from nlds_admin.common.serialize import (
+    JSON_CONTENT_ENCODING,
+    BINARY_CONTENT_ENCODING,
+    serialize_binary,
+    ZLIB,
+)
 
 logger = logging.getLogger(RK.ADMIN)
 
@@ -118,7 +124,7 @@ class RabbitMQPublisher:
 
     def _get_default_properties(self, delay: int = 0) -> pika.BasicProperties:
         return pika.BasicProperties(
-            content_encoding="application/json",
+            content_encoding=JSON_CONTENT_ENCODING,
             headers={"x-delay": delay},
             delivery_mode=pika.spec.PERSISTENT_DELIVERY_MODE,
         )
@@ -133,6 +139,9 @@ class RabbitMQPublisher:
         properties: pika.BasicProperties = None,
         mandatory_fl: bool = True,
         correlation_id: str = None,
+        binary: bool = False,
+        codec: str = ZLIB,
+        level: int = None,
     ) -> None:
         """Sends a message with the specified routing key to an exchange for
         routing. If no exchange is provided it will default to the first
@@ -144,18 +153,32 @@ class RabbitMQPublisher:
         exchange is declared as a x-delayed-message exchange at start up with
         the 'delayed' flag.
 
+        If the binary flag is set then the message is sent in the binary message
+        format (see common/serialize.py), with the DATA part compressed using the
+        codec at the given level, and the content_encoding of the message properties
+        is set to announce this.
+
         This is in essence a light wrapper around the basic_publish method in
         pika.
         """
         # add the time stamp to the message here
         msg_dict["timestamp"] = datetime.now().isoformat(sep="-")
-        # JSON the message
-        msg = json.dumps(msg_dict)
+        # JSON the message, or pack it into the binary format
+        if binary:
+            msg = serialize_binary(msg_dict, codec=codec, level=level)
+        else:
+            msg = json.dumps(msg_dict)
 
         if not exchange:
             exchange = self.default_exchange
         if not properties:
             properties = self._get_default_properties(delay=delay)
+        # make sure the content_encoding matches the format of the message, as the
+        # properties may have been copied from a message in the other format
+        if binary:
+            properties.content_encoding = BINARY_CONTENT_ENCODING
+        elif properties.content_encoding == BINARY_CONTENT_ENCODING:
+            properties.content_encoding = JSON_CONTENT_ENCODING
         if delay > 0:
             # Delayed messages and mandatory acknowledgements are unfortunately
             # incompatible. For now prioritising delay over the mandatory flag.
@@ -164,6 +187,31 @@ class RabbitMQPublisher:
         if correlation_id:
             properties.correlation_id = correlation_id
 
+        self._basic_publish(exchange, routing_key, properties, msg, mandatory_fl)
+
+    def publish_body(
+        self,
+        routing_key: str,
+        body: bytes,
+        properties: pika.BasicProperties,
+        exchange: Dict = None,
+        mandatory_fl: bool = True,
+    ) -> None:
+        """Sends the body of a consumed message, unchanged, with its properties.  This
+        republishes a message in the format, and with the compression, that it was
+        consumed with."""
+        if not exchange:
+            exchange = self.default_exchange
+        self._basic_publish(exchange, routing_key, properties, body, mandatory_fl)
+
+    def _basic_publish(
+        self,
+        exchange: Dict,
+        routing_key: str,
+        properties: pika.BasicProperties,
+        msg,
+        mandatory_fl: bool,
+    ) -> None:
         try:
             self.channel.basic_publish(
                 exchange=exchange["name"],
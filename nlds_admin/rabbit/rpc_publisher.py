@@ -12,6 +12,8 @@ __contact__ = "neil.massey@stfc.ac.uk"
 import uuid
 import socket
 import os
+import time
+from typing import Optional
 
 from retry import retry
 import pika
@@ -37,6 +39,9 @@ class RabbitMQRPCPublisher(RMQP):
         self.response = None
         self.corr_id = None
         self.queue_suffix = 0
+        # responses for requests sent with send, keyed by correlation_id
+        self.pending = set()
+        self.responses = {}
 
         rpc_config = self.DEFAULT_CONFIG
         # Merge rpc config section into default (overriding defaults) if present
@@ -87,40 +92,76 @@ class RabbitMQRPCPublisher(RMQP):
             raise e
 
     def callback(self, ch: Channel, method: Method, properties: Header, body: bytes):
-        # Check if message matches our correlation_id and stash the message
-        # contents if so
-        if self.corr_id == properties.correlation_id:
-            self.response = body
+        # Check if message matches one of our outstanding correlation_ids and stash
+        # the message contents if so
+        if properties.correlation_id in self.pending:
+            self.responses[properties.correlation_id] = body
 
-    def call(
+    def send(
         self,
         msg_dict: dict,
         routing_key: str = "rpc_queue",
         time_limit: int = None,
         correlation_id: str = None,
-    ):
+    ) -> str:
+        """Send an RPC request without waiting for the response, returning the
+        correlation_id to pass to receive.  This allows several requests to be in
+        flight at once on the one connection."""
         if time_limit is None:
             time_limit = self.time_limit
 
         # Create a unique correlation_id to recognise the correct message when
         # it comes back
-
         if correlation_id is None:
-            self.corr_id = str(uuid.uuid4())
-        else:
-            self.corr_id = correlation_id
-
-        self.response = None
+            correlation_id = str(uuid.uuid4())
+        self.pending.add(correlation_id)
 
         self.publish_message(
             routing_key=routing_key,
             msg_dict=msg_dict,
             properties=pika.BasicProperties(
                 reply_to=self.callback_queue,
-                correlation_id=self.corr_id,
+                correlation_id=correlation_id,
                 expiration=f"{time_limit*1000}",
             ),
             exchange={"name": ""},
         )
-        self.connection.process_data_events(time_limit=time_limit)
+        return correlation_id
+
+    def receive(self, correlation_id: str, time_limit: int = None) -> Optional[bytes]:
+        """Wait for the response to a request sent with send.  Responses to other
+        outstanding requests that arrive in the meantime are kept until they are
+        received.  Returns None if the response does not arrive within the time
+        limit."""
+        if time_limit is None:
+            time_limit = self.time_limit
+        deadline = time.monotonic() + time_limit
+        while correlation_id not in self.responses:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            self.connection.process_data_events(time_limit=remaining)
+        self.pending.discard(correlation_id)
+        return self.responses.pop(correlation_id, None)
+
+    def discard(self, correlation_id: str) -> None:
+        """Stop waiting for the response to a request sent with send."""
+        self.pending.discard(correlation_id)
+        self.responses.pop(correlation_id, None)
+
+    def call(
+        self,
+        msg_dict: dict,
+        routing_key: str = "rpc_queue",
+        time_limit: int = None,
+        correlation_id: str = None,
+    ):
+        self.response = None
+        self.corr_id = self.send(
+            msg_dict=msg_dict,
+            routing_key=routing_key,
+            time_limit=time_limit,
+            correlation_id=correlation_id,
+        )
+        self.response = self.receive(self.corr_id, time_limit=time_limit)
         return self.response
@@ -1,12 +1,24 @@
 import click
 from nlds_admin.rabbit.consumer import RabbitMQConsumer
 from nlds_admin.rabbit import message_keys as MSG
+from nlds_admin.common.deserialize import deserialize
+from nlds_admin.common.compact_filelist import pack_filelist
+from nlds_admin.common.serialize import (
+    compress_data,
+    serialize_binary,
+    compress_flag,
+    compress_bytes,
+    decompress_bytes,
+    codec_available,
+    CODECS,
+    ZLIB,
+    DEFAULT_LEVELS,
+)
 import json
 import uuid
-import base64
-import zlib
 import os
 import os.path
+import time
 
 """
 Utility program to manipulate messages in the NLDS queue.
@@ -15,22 +27,6 @@ The following operations can be performed:
 """
 
 
-def compress_data(data_dict):
-    """Compress the data part of the message.  Only compatible with v1.0.11 of NLDS"""
-    byte_string = json.dumps(data_dict).encode("ascii")
-    data_dict_out = base64.b64encode(zlib.compress(byte_string, level=1)).decode(
-        "ascii"
-    )
-    return data_dict_out
-
-
-def decompress_data(data_dict):
-    byte_string = data_dict.encode("ascii")
-    decompressed_string = zlib.decompress(base64.b64decode(byte_string))
-    dicto = json.loads(decompressed_string)
-    return dicto
-
-
 @click.group()
 def nlds_qm():
     pass
@@ -58,7 +54,47 @@ def nlds_qm():
     is_flag=True,
     help="Compress the DATA part of the message",
 )
-def split(queue, number, length, compress=False):
+@click.option(
+    "-b",
+    "--binary",
+    default=False,
+    type=bool,
+    is_flag=True,
+    help="Use the binary message format, with the DATA part compressed and not "
+    "base64 encoded.  Only messages produced by the admin tools use this format.",
+)
+@click.option(
+    "-z",
+    "--codec",
+    default=ZLIB,
+    type=click.Choice(CODECS),
+    help="Codec to compress the DATA part of the message with.  Only zlib can be "
+    "read by NLDS, zstd and lz4 can only be read by the admin tools.",
+)
+@click.option(
+    "--level",
+    default=None,
+    type=int,
+    help="Compression level for the codec.  Defaults to "
+    + ", ".join(f"{c}: {l}" for c, l in DEFAULT_LEVELS.items()),
+)
+@click.option(
+    "--compact",
+    default=False,
+    type=bool,
+    is_flag=True,
+    help="Encode the filelist in the compact (front-coded) encoding.",
+)
+def split(
+    queue,
+    number,
+    length,
+    compress=False,
+    binary=False,
+    codec=ZLIB,
+    level=None,
+    compact=False,
+):
     """Split the messages in the queue so that they have <length> files in them as a
     maximum"""
     # consume a message off the queues and interpret as JSON
@@ -67,14 +103,11 @@ def split(queue, number, length, compress=False):
         method, properties, body = consumer.consume_one_message()
         # get the routing key from the method
         rk = method.routing_key
-        body_json = json.loads(body)
+        # deserialize decompresses the message, whichever format it is in
+        body_json = deserialize(body, properties.content_encoding)
         # the message consists of the DETAILS and the DATA part
         details = body_json[MSG.DETAILS]
-        # if the message is compressed then decompress it
-        if MSG.COMPRESS in details and details[MSG.COMPRESS]:
-            data = decompress_data[MSG.DATA]
-        else:
-            data = body_json[MSG.DATA]
+        data = body_json[MSG.DATA]
         # get a list of files and split it
         files = data[MSG.FILELIST]
         file_sublist = [files[i : i + length] for i in range(0, len(files), length)]
@@ -97,25 +130,31 @@ def split(queue, number, length, compress=False):
             )
             # reform the dictionary
             details[MSG.SUB_ID] = str(sub_id)
-            data[MSG.FILELIST] = f
-            if compress:
-                comp_data = compress_data(data)
-                details[MSG.COMPRESS] = True
+            data[MSG.FILELIST] = pack_filelist(f, compact)
+            if binary:
+                # the binary format compresses the DATA part when it is serialized
+                new_msg_dict = {MSG.DETAILS: details, MSG.DATA: data}
+            elif compress:
+                comp_data = compress_data(data, codec=codec, level=level)
+                details[MSG.COMPRESS] = compress_flag(codec)
                 new_msg_dict = {MSG.DETAILS: details, MSG.DATA: comp_data}
             else:
                 new_msg_dict = {MSG.DETAILS: details, MSG.DATA: data}
-            consumer.publish_message(rk, new_msg_dict, properties=properties)
+            consumer.publish_message(
+                rk,
+                new_msg_dict,
+                properties=properties,
+                binary=binary,
+                codec=codec,
+                level=level,
+            )
         click.echo("Number of sub messages", len(file_sublist))
         consumer.basic_ack(method=method)
     consumer.close()
 
 
 def print_details(details, data, rk):
-    if MSG.COMPRESS in details and details[MSG.COMPRESS]:
-        data_uc = decompress_data(data)
-    else:
-        data_uc = data
-    n_files = len(data_uc[MSG.FILELIST])
+    n_files = len(data[MSG.FILELIST])
     click.echo(
         f"{details[MSG.USER]:<16}"
         f"{details[MSG.GROUP]:<12}"
@@ -148,7 +187,7 @@ def list(queue, number):
         method, properties, body = consumer.consume_one_message()
         # get the routing key from the method
         rk = method.routing_key
-        body_json = json.loads(body)
+        body_json = deserialize(body, properties.content_encoding)
         # the message consists of the DETAILS and the DATA part
         details = body_json[MSG.DETAILS]
         data = body_json[MSG.DATA]
@@ -167,7 +206,7 @@ def pop(queue, ack, nack):
     consumer = RabbitMQConsumer(queue)
     method, properties, body = consumer.consume_one_message()
     rk = method.routing_key
-    body_json = json.loads(body)
+    body_json = deserialize(body, properties.content_encoding)
     details = body_json[MSG.DETAILS]
     data = body_json[MSG.DATA]
 
@@ -218,7 +257,49 @@ def pop(queue, ack, nack):
     is_flag=True,
     help="Acknowledge the message - i.e. remove it from the queue",
 )
-def dump(queue, number, target, length, compress=False, ack=False):
+@click.option(
+    "-b",
+    "--binary",
+    default=False,
+    type=bool,
+    is_flag=True,
+    help="Use the binary message format, with the DATA part compressed and not "
+    "base64 encoded.  Only messages produced by the admin tools use this format.",
+)
+@click.option(
+    "-z",
+    "--codec",
+    default=ZLIB,
+    type=click.Choice(CODECS),
+    help="Codec to compress the DATA part of the message with.  Only zlib can be "
+    "read by NLDS, zstd and lz4 can only be read by the admin tools.",
+)
+@click.option(
+    "--level",
+    default=None,
+    type=int,
+    help="Compression level for the codec.  Defaults to "
+    + ", ".join(f"{c}: {l}" for c, l in DEFAULT_LEVELS.items()),
+)
+@click.option(
+    "--compact",
+    default=False,
+    type=bool,
+    is_flag=True,
+    help="Encode the filelist in the compact (front-coded) encoding.",
+)
+def dump(
+    queue,
+    number,
+    target,
+    length,
+    compress=False,
+    ack=False,
+    binary=False,
+    codec=ZLIB,
+    level=None,
+    compact=False,
+):
     """Dump the messages as JSON files."""
     # check the target directory exists
     if not os.path.exists(target):
@@ -234,7 +315,8 @@ def dump(queue, number, target, length, compress=False, ack=False):
         method, properties, body = consumer.consume_one_message()
         message_methods.append(method)
 
-        body_json = json.loads(body)
+        # deserialize decompresses the message, whichever format it is in
+        body_json = deserialize(body, properties.content_encoding)
         # get the routing key
         rk = method.routing_key
         # the message consists of the DETAILS and the DATA part
@@ -246,11 +328,7 @@ def dump(queue, number, target, length, compress=False, ack=False):
         if not os.path.exists(trans_dir):
             os.mkdir(trans_dir)
 
-        # if the message is compressed then decompress it
-        if MSG.COMPRESS in details and details[MSG.COMPRESS]:
-            data = decompress_data(body_json[MSG.DATA])
-        else:
-            data = body_json[MSG.DATA]
+        data = body_json[MSG.DATA]
         # get a list of files and split it
         files = data[MSG.FILELIST]
         file_sublist = [files[i : i + length] for i in range(0, len(files), length)]
@@ -275,10 +353,10 @@ def dump(queue, number, target, length, compress=False, ack=False):
             details[MSG.SUB_ID] = str(sub_id)
             # record the routing key
             details["routing_key"] = rk
-            data[MSG.FILELIST] = f
-            if compress:
-                comp_data = compress_data(data)
-                details[MSG.COMPRESS] = True
+            data[MSG.FILELIST] = pack_filelist(f, compact)
+            if compress and not binary:
+                comp_data = compress_data(data, codec=codec, level=level)
+                details[MSG.COMPRESS] = compress_flag(codec)
                 new_msg_dict = {MSG.DETAILS: details, MSG.DATA: comp_data}
             else:
                 new_msg_dict = {MSG.DETAILS: details, MSG.DATA: data}
@@ -287,14 +365,18 @@ def dump(queue, number, target, length, compress=False, ack=False):
             fname = os.path.join(trans_dir, details[MSG.SUB_ID])
             # open the file
             with open(fname, "bw") as fh:
-                msg = json.dumps(new_msg_dict)
-                fh.write(msg.encode("ascii"))
+                if binary:
+                    fh.write(serialize_binary(new_msg_dict, codec=codec, level=level))
+                else:
+                    msg = json.dumps(new_msg_dict)
+                    fh.write(msg.encode("ascii"))
 
-        # republish message if not acknowledge flag set
+        # republish message if not acknowledge flag set, in the same format as it was
+        # consumed
         consumer.basic_ack(method=method)
         if not ack:
             print("Republish!")
-            consumer.publish_message(rk, msg_dict=body_json, properties=properties)
+            consumer.publish_body(rk, body, properties)
 
 
 @nlds_qm.command("load", help="load messages.")
@@ -328,14 +410,96 @@ def load(queue, transact_id, target, compress=False):
         sub_name = os.path.join(trans_dir, s)
         with open(sub_name, "br") as fh:
             msg = fh.read()
-        msg_body = json.loads(msg)
+        # deserialize reads both the JSON and binary formats, decompressing the data
+        msg_body = deserialize(msg)
         details = msg_body[MSG.DETAILS]
-        # is the data compressed?
-        if MSG.COMPRESS in details and details[MSG.COMPRESS]:
-            data = decompress_data(msg_body[MSG.DATA])
-        else:
-            data = msg[MSG.DATA]
-        click.echo(details, data)
+        data = msg_body[MSG.DATA]
+        click.echo(details)
+        click.echo(data)
+
+
+@nlds_qm.command("bench", help="Benchmark the compression codecs on dumped messages.")
+@click.option(
+    "-q", "--queue", default="", type=str, help="Queue name of the dumped messages."
+)
+@click.option(
+    "-t",
+    "--transact_id",
+    default=None,
+    type=str,
+    help="Transaction id to benchmark the messages for.  Default is all transactions.",
+)
+@click.option(
+    "-r", "--target", default="/", type=str, help="Target directory to read from"
+)
+@click.option(
+    "-z",
+    "--codec",
+    default=None,
+    type=click.Choice(CODECS),
+    multiple=True,
+    help="Codec to benchmark.  More than one can be specified, e.g. -z zstd -z lz4. "
+    "Default is all installed codecs.",
+)
+@click.option(
+    "--level",
+    default=None,
+    type=int,
+    multiple=True,
+    help="Compression level to benchmark.  More than one can be specified.  Default is "
+    "the default level for each codec.",
+)
+def bench(queue, transact_id, target, codec, level):
+    """Report the compression ratio and the compression and decompression speed, in
+    MB/s, of each codec on the DATA part of the messages written by dump."""
+    queue_dir = os.path.join(target, queue)
+    if transact_id:
+        trans_dirs = [os.path.join(queue_dir, transact_id)]
+    else:
+        trans_dirs = [
+            os.path.join(queue_dir, t)
+            for t in os.listdir(queue_dir)
+            if os.path.isdir(os.path.join(queue_dir, t))
+        ]
+    # load the DATA part of each message as the uncompressed JSON bytes that would be
+    # compressed when the message is sent
+    payloads = []
+    for trans_dir in trans_dirs:
+        for s in os.listdir(trans_dir):
+            with open(os.path.join(trans_dir, s), "br") as fh:
+                msg_body = deserialize(fh.read())
+            payloads.append(json.dumps(msg_body[MSG.DATA]).encode("ascii"))
+    if len(payloads) == 0:
+        raise click.UsageError(f"No dumped messages found in {queue_dir}")
+    raw_size = sum(len(p) for p in payloads)
+    click.echo(
+        f"Benchmarking {len(payloads)} messages, total size {raw_size / 1e6:.2f} MB"
+    )
+
+    codecs = codec if codec else CODECS
+    click.echo(
+        f"{'codec':<8}{'level':>6}{'size MB':>12}{'ratio':>8}"
+        f"{'comp MB/s':>12}{'decomp MB/s':>14}"
+    )
+    for c in codecs:
+        if not codec_available(c):
+            click.echo(f"{c:<8}  not installed")
+            continue
+        levels = level if level else (DEFAULT_LEVELS[c],)
+        for l in levels:
+            start = time.perf_counter()
+            compressed = [compress_bytes(p, c, l) for p in payloads]
+            comp_time = time.perf_counter() - start
+            start = time.perf_counter()
+            for p in compressed:
+                decompress_bytes(p, c)
+            decomp_time = time.perf_counter() - start
+            comp_size = sum(len(p) for p in compressed)
+            click.echo(
+                f"{c:<8}{l:>6}{comp_size / 1e6:>12.2f}{raw_size / comp_size:>8.2f}"
+                f"{raw_size / 1e6 / comp_time:>12.1f}"
+                f"{raw_size / 1e6 / decomp_time:>14.1f}"
+            )
 
 
 def main():
@@ -27,8 +27,14 @@ setup(
         'pika',
         'py',
         'retry',
-        'click'
+        'click',
+        'numpy'
     ],
+    extras_require={
+        'zstd': ['zstandard'],
+        'lz4': ['lz4'],
+        'parquet': ['pyarrow'],
+    },
     include_package_data=True,
     package_data={
     },
@@ -0,0 +1,42 @@
+# encoding: utf-8
+"""
+test_import.py
+"""
+
+__author__ = "Neil Massey"
+__date__ = "19 Oct 2026"
+__copyright__ = "Copyright 2026 United Kingdom Research and Innovation"
+__license__ = "BSD - see LICENSE file in top-level package directory"
+__contact__ = "neil.massey@stfc.ac.uk"
+
+import importlib
+import pkgutil
+
+import click
+import pytest
+
+import nlds_admin
+
+MODULES = sorted(
+    m.name
+    for m in pkgutil.walk_packages(
+        nlds_admin.__path__, prefix=nlds_admin.__name__ + "."
+    )
+)
+
+
+@pytest.mark.parametrize("module", MODULES)
+def test_import(module):
+    """Every module in the package can be imported."""
+    importlib.import_module(module)
+
+
+def test_cli_commands():
+    """The command line interface, and the commands in the sphinx-click docs, can be
+    loaded."""
+    from nlds_admin import nlds_admin as cli
+
+    assert isinstance(cli.nlds_admin, click.Group)
+    for name in ("list", "find", "stat", "cancel", "fix-status", "audit"):
+        assert name in cli.nlds_admin.commands
+    assert isinstance(cli.list, click.Command)